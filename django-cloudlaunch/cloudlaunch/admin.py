@@ -1,10 +1,11 @@
 """Models exposed via Django Admin."""
-import ast
 from django.contrib import admin
+from django.contrib import messages
 import nested_admin
 
 from . import forms
 from . import models
+from . import view_helpers
 import djcloudbridge
 
 
@@ -56,11 +57,58 @@ class ReadOnlyTabularInline(admin.TabularInline):
 class AppDeployTaskAdmin(ReadOnlyTabularInline):
     model = models.ApplicationDeploymentTask
     ordering = ('added',)
+    readonly_fields = ('status', 'result')
+    exclude = ['_result', '_status']
+
+    def get_queryset(self, request):
+        return super(AppDeployTaskAdmin, self).get_queryset(
+            request).with_task_meta()
 
 
 class AppDeploymentsAdmin(admin.ModelAdmin):
     models = models.ApplicationDeployment
     inlines = [AppDeployTaskAdmin]
+    actions = ['health_check_deployments', 'restart_deployments',
+               'delete_deployments']
+
+    def _create_tasks(self, request, queryset, action):
+        deployment_tasks, skipped = view_helpers.create_deployment_tasks(
+            queryset.select_related('target_cloud'), action)
+        self.message_user(request,
+                          "Started %s task(s)." % len(deployment_tasks))
+        if skipped:
+            self.message_user(
+                request, "Skipped deployment(s) without stored credentials: "
+                "%s" % ", ".join(d.name for d in skipped),
+                level=messages.WARNING)
+
+    def health_check_deployments(self, request, queryset):
+        self._create_tasks(request, queryset,
+                           models.ApplicationDeploymentTask.HEALTH_CHECK)
+    health_check_deployments.short_description = (
+        "Check health of selected deployments")
+
+    def restart_deployments(self, request, queryset):
+        self._create_tasks(request, queryset,
+                           models.ApplicationDeploymentTask.RESTART)
+    restart_deployments.short_description = "Restart selected deployments"
+
+    def delete_deployments(self, request, queryset):
+        self._create_tasks(request, queryset,
+                           models.ApplicationDeploymentTask.DELETE)
+    delete_deployments.short_description = (
+        "Delete cloud resources of selected deployments")
+
+
+class DeploymentInstanceAdmin(admin.ModelAdmin):
+    models = models.DeploymentInstance
+    list_display = ('instance_id', 'public_ip', 'cloud', 'deployment',
+                    'archived_deployment', 'added')
+    list_filter = ('cloud',)
+    ordering = ('-added',)
+    # Find whose instance an ID or IP belongs to
+    search_fields = ['=instance_id', '=public_ip']
+    raw_id_fields = ('deployment', 'archived_deployment')
 
 
 class UsageAdmin(admin.ModelAdmin):
@@ -89,8 +137,8 @@ class UsageAdmin(admin.ModelAdmin):
     target_cloud.short_description = 'Target cloud'
 
     def instance_type(self, obj):
-        app_config = ast.literal_eval(obj.app_config)
-        return app_config.get('config_cloudlaunch', {}).get('instanceType')
+        app_config = obj.app_config or {}
+        return app_config.get('config_cloudlaunch', {}).get('vmType')
 
 
 class PublicKeyInline(admin.StackedInline):
@@ -106,6 +154,7 @@ admin.site.register(models.Application, AppAdmin)
 admin.site.register(models.AppCategory, AppCategoryAdmin)
 admin.site.register(models.ApplicationDeployment, AppDeploymentsAdmin)
 admin.site.register(models.CloudImage, CloudImageAdmin)
+admin.site.register(models.DeploymentInstance, DeploymentInstanceAdmin)
 admin.site.register(models.Usage, UsageAdmin)
 
 # Add public key to existing UserProfile
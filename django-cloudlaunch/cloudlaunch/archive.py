@@ -0,0 +1,85 @@
+"""
+Archival of old deployments.
+
+Deployments that were archived by their owner more than
+``CLOUDLAUNCH_ARCHIVE_AFTER_DAYS`` days ago are moved, along with their
+tasks, from the deployment tables to the ``ArchivedDeployment`` and
+``ArchivedDeploymentTask`` tables. Usage records and recorded instances
+are relinked to the archived deployment. This keeps the deployment tables,
+which every deployment list and task query reads, down to deployments in
+use.
+"""
+from datetime import timedelta
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import models
+from . import task_meta
+
+log = logging.getLogger(__name__)
+
+
+def get_archive_age():
+    """Return the number of days after which deployments are archived."""
+    return getattr(settings, 'CLOUDLAUNCH_ARCHIVE_AFTER_DAYS', 90)
+
+
+def _archive_batch(deployment_ids):
+    with transaction.atomic():
+        deployments = list(models.ApplicationDeployment.objects.filter(
+            pk__in=deployment_ids, archived=True).select_for_update())
+        deployment_ids = [deployment.pk for deployment in deployments]
+        deployment_tasks = list(
+            models.ApplicationDeploymentTask.objects.filter(
+                deployment__in=deployment_ids).with_task_meta())
+        models.ArchivedDeployment.objects.bulk_create(
+            models.ArchivedDeployment.from_deployment(deployment)
+            for deployment in deployments)
+        models.ArchivedDeploymentTask.objects.bulk_create(
+            models.ArchivedDeploymentTask.from_task(task)
+            for task in deployment_tasks)
+        models.Usage.objects.filter(app_deployment__in=deployment_ids).update(
+            archived_deployment=F('app_deployment'), app_deployment=None)
+        models.DeploymentInstance.objects.filter(
+            deployment__in=deployment_ids).update(
+                archived_deployment=F('deployment'), deployment=None)
+        models.ApplicationDeployment.objects.filter(
+            pk__in=deployment_ids).delete()
+    # Task results have been copied over
+    task_meta.forget_task_metas(
+        [task.celery_id for task in deployment_tasks if task.celery_id])
+    return len(deployments)
+
+
+def archive_deployments(age=None, batch_size=500):
+    """
+    Move deployments archived more than ``age`` days ago to the archive.
+
+    Deployments are moved in batches of ``batch_size``, each in its own
+    transaction.
+
+    :type age: ``int``
+    :param age: Minimum age in days, since they were last updated, of the
+                archived deployments to move. Defaults to the
+                ``CLOUDLAUNCH_ARCHIVE_AFTER_DAYS`` setting.
+
+    :rtype: ``int``
+    :return: The number of deployments moved.
+    """
+    cutoff = timezone.now() - timedelta(
+        days=get_archive_age() if age is None else age)
+    candidates = models.ApplicationDeployment.objects.filter(
+        archived=True, updated__lt=cutoff).order_by('id')
+    moved = 0
+    while True:
+        deployment_ids = list(candidates.values_list(
+            'pk', flat=True)[:batch_size])
+        if not deployment_ids:
+            break
+        moved += _archive_batch(deployment_ids)
+        log.debug("Moved %s deployments to the archive", moved)
+    return moved
@@ -356,17 +356,22 @@ ssh_authorized_keys:
         Extract instance ID for the supplied deployment.
 
         We extract instance ID only for deployments in the SUCCESS state.
+        The ID recorded when the launch completed is used if the deployment
+        carries one; otherwise, it is taken from the launch result.
 
         @type  deployment: ``dict``
         @param deployment: A dictionary describing an instance of the
                            app deployment, requiring at least the following
                            keys: ``launch_status``, ``launch_result``.
+                           ``instance_id`` is optional.
 
         :rtype: ``str``
         :return: Provider-specific instance ID for the deployment or
                  ``None`` if instance ID not available.
         """
         if deployment.get('launch_status') == 'SUCCESS':
+            if deployment.get('instance_id'):
+                return deployment['instance_id']
             return deployment.get('launch_result', {}).get(
                 'cloudLaunch', {}).get('instance', {}).get('id')
         else:
@@ -1,9 +1,14 @@
+import hashlib
 import yaml
 
 from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.core.cache import cache
 from urllib.parse import urlparse
 from rest_framework.serializers import ValidationError
 
+from djcloudbridge import domain_model
+
 from .simple_web_app import SimpleWebAppPlugin
 
 log = get_task_logger('cloudlaunch')
@@ -16,6 +21,69 @@ def get_required_val(data, name, message):
     return val
 
 
+def _get_ec2_cache_key(provider, kind):
+    """
+    Return the cache key for EC2 info of an OpenStack provider.
+
+    The key hashes the Keystone settings identifying the cloud, project and
+    user, so changed credentials never hit stale entries.
+    """
+    identity = '|'.join(str(value) for value in (
+        provider.auth_url, provider.region_name, provider.project_name,
+        provider.project_domain_name, provider.user_domain_name,
+        provider.username, provider.password))
+    return 'cloudlaunch:ec2-{0}:{1}'.format(
+        kind, hashlib.sha256(identity.encode('utf-8')).hexdigest())
+
+
+def _get_ec2_cache_timeout():
+    return getattr(settings, 'CLOUDLAUNCH_EC2_CACHE_TIMEOUT', 3600)
+
+
+def get_ec2_endpoints(provider):
+    """Return the EC2 and S3 endpoints of an OpenStack provider, cached."""
+    key = _get_ec2_cache_key(provider, 'endpoints')
+    endpoints = cache.get(key)
+    if endpoints is None:
+        endpoints = provider.security.get_ec2_endpoints()
+        cache.set(key, endpoints, _get_ec2_cache_timeout())
+    return endpoints
+
+
+def get_ec2_credentials(provider):
+    """
+    Return the EC2 credentials of an OpenStack provider's user, cached.
+
+    :rtype: ``dict``
+    :return: The ``access`` and ``secret`` keys of the credentials.
+    """
+    key = _get_ec2_cache_key(provider, 'credentials')
+    credentials = cache.get(key)
+    if credentials is None:
+        ec2_creds = provider.security.get_or_create_ec2_credentials()
+        credentials = {'access': ec2_creds.access, 'secret': ec2_creds.secret}
+        cache.set(key, credentials, _get_ec2_cache_timeout())
+    return credentials
+
+
+def invalidate_ec2_cache(provider):
+    """Drop cached EC2 info of an OpenStack provider, e.g. if revoked."""
+    cache.delete_many([_get_ec2_cache_key(provider, kind)
+                       for kind in ('endpoints', 'credentials')])
+
+
+def invalidate_credentials_ec2_cache(credentials):
+    """
+    Drop cached EC2 info fetched with the supplied OpenStack credentials.
+
+    :type credentials: :class:`djcloudbridge.models.OpenStackCredentials`
+    :param credentials: The credentials as stored before they changed.
+    """
+    # Providers only connect when first used so this is cheap
+    invalidate_ec2_cache(domain_model.get_cloud_provider(
+        credentials.cloud, credentials.as_dict()))
+
+
 class CloudManAppPlugin(SimpleWebAppPlugin):
 
     def __init__(self):
@@ -84,33 +152,13 @@ class CloudManAppPlugin(SimpleWebAppPlugin):
             user_data['secret_key'] = provider.session_cfg.get(
                 'aws_secret_access_key')
         elif provider.PROVIDER_ID == 'openstack':
-            user_data['cloud_type'] = 'openstack'
-            ec2_endpoints = provider.security.get_ec2_endpoints()
-            if not ec2_endpoints.get('ec2_endpoint'):
-                raise ValidationError(
-                    {"error": "This version of CloudMan supports only "
-                              "EC2-compatible clouds. This OpenStack cloud "
-                              "provider does not appear to have an ec2 "
-                              "endpoint."})
-            uri_comp = urlparse(ec2_endpoints.get('ec2_endpoint'))
-
-            user_data['region_name'] = provider.region_name
-            user_data['region_endpoint'] = uri_comp.hostname
-            user_data['ec2_port'] = uri_comp.port
-            user_data['ec2_conn_path'] = uri_comp.path
-            user_data['is_secure'] = uri_comp.scheme == "https"
-
-            if ec2_endpoints.get('s3_endpoint'):
-                uri_comp = urlparse(ec2_endpoints.get('s3_endpoint'))
-                user_data['s3_host'] = uri_comp.hostname
-                user_data['s3_port'] = uri_comp.port
-                user_data['s3_conn_path'] = uri_comp.path
-            else:
-                user_data['use_object_store'] = False
-
-            ec2_creds = provider.security.get_or_create_ec2_credentials()
-            user_data['access_key'] = ec2_creds.access
-            user_data['secret_key'] = ec2_creds.secret
+            try:
+                user_data.update(
+                    CloudManAppPlugin._get_openstack_user_data(provider))
+            except Exception:
+                # Look the EC2 info up again on the next attempt
+                invalidate_ec2_cache(provider)
+                raise
         else:
             raise ValidationError({
                 "error": "This version of CloudMan supports only "
@@ -118,6 +166,38 @@ class CloudManAppPlugin(SimpleWebAppPlugin):
 
         return user_data
 
+    @staticmethod
+    def _get_openstack_user_data(provider):
+        """Return the user data describing the EC2 API of an OpenStack."""
+        user_data = {'cloud_type': 'openstack'}
+        ec2_endpoints = get_ec2_endpoints(provider)
+        if not ec2_endpoints.get('ec2_endpoint'):
+            raise ValidationError(
+                {"error": "This version of CloudMan supports only "
+                          "EC2-compatible clouds. This OpenStack cloud "
+                          "provider does not appear to have an ec2 "
+                          "endpoint."})
+        uri_comp = urlparse(ec2_endpoints.get('ec2_endpoint'))
+
+        user_data['region_name'] = provider.region_name
+        user_data['region_endpoint'] = uri_comp.hostname
+        user_data['ec2_port'] = uri_comp.port
+        user_data['ec2_conn_path'] = uri_comp.path
+        user_data['is_secure'] = uri_comp.scheme == "https"
+
+        if ec2_endpoints.get('s3_endpoint'):
+            uri_comp = urlparse(ec2_endpoints.get('s3_endpoint'))
+            user_data['s3_host'] = uri_comp.hostname
+            user_data['s3_port'] = uri_comp.port
+            user_data['s3_conn_path'] = uri_comp.path
+        else:
+            user_data['use_object_store'] = False
+
+        ec2_creds = get_ec2_credentials(provider)
+        user_data['access_key'] = ec2_creds['access']
+        user_data['secret_key'] = ec2_creds['secret']
+        return user_data
+
     @staticmethod
     def sanitise_app_config(app_config):
         app_config = super(CloudManAppPlugin, CloudManAppPlugin).sanitise_app_config(app_config)
@@ -126,6 +206,16 @@ class CloudManAppPlugin(SimpleWebAppPlugin):
 
     def deploy(self, name, task, app_config, provider_config):
         """See the parent class in ``app_plugin.py`` for the docstring."""
+        try:
+            return self._deploy(name, task, app_config, provider_config)
+        except Exception:
+            # The EC2 info in the user data may be stale, e.g. revoked
+            provider = provider_config.get('cloud_provider')
+            if provider and provider.PROVIDER_ID == 'openstack':
+                invalidate_ec2_cache(provider)
+            raise
+
+    def _deploy(self, name, task, app_config, provider_config):
         user_data = provider_config.get('cloud_user_data')
         ud = yaml.dump(user_data, default_flow_style=False,
                        allow_unicode=False)
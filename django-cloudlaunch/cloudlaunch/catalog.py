@@ -0,0 +1,163 @@
+"""Helpers for serving the application catalog as a whole."""
+import glob
+import gzip
+import hashlib
+import logging
+import os
+import re
+import tempfile
+
+from django.conf import settings
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from . import models
+from . import serializers
+
+log = logging.getLogger(__name__)
+
+# Encodings a snapshot is stored in, in order of preference
+SNAPSHOT_ENCODINGS = ('br', 'gzip', 'identity')
+SNAPSHOT_SUFFIXES = {'br': '.json.br', 'gzip': '.json.gz',
+                     'identity': '.json'}
+SNAPSHOT_NAME_RE = re.compile(r'^catalog-(\d+)-')
+
+
+def get_snapshot_dir():
+    """Return the directory prebuilt catalog snapshots are stored in."""
+    return getattr(settings, 'CLOUDLAUNCH_CATALOG_SNAPSHOT_DIR',
+                   os.path.join(tempfile.gettempdir(), 'cloudlaunch-catalog'))
+
+
+def get_snapshot_encodings():
+    """Return the encodings snapshots are available in."""
+    return [encoding for encoding in SNAPSHOT_ENCODINGS
+            if encoding != 'br' or brotli]
+
+
+def render_snapshot(request, revision):
+    """
+    Render all LIVE applications into a single JSON document.
+
+    The document contains applications, their versions and per-cloud
+    configs, including merged launch configs, as served by the
+    applications endpoint.
+    """
+    queryset = models.Application.objects.filter(
+        status=models.Application.LIVE).with_catalog_tree().order_by(
+            'display_order', 'slug')
+    applications = serializers.ApplicationSerializer(
+        queryset, many=True, context={'request': request}).data
+    return JSONRenderer().render({'revision': revision,
+                                  'applications': applications})
+
+
+def _encode(content, encoding):
+    if encoding == 'br':
+        return brotli.compress(content)
+    elif encoding == 'gzip':
+        return gzip.compress(content)
+    return content
+
+
+def _write_atomic(path, content):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def _prune_snapshots(snapshot_dir, revision):
+    """
+    Remove the snapshots of catalog revisions older than ``revision``.
+
+    Only older revisions are removed since another process may have read a
+    newer revision than ours. Files that are still being streamed remain
+    readable until they are closed.
+    """
+    for path in glob.glob(os.path.join(snapshot_dir, 'catalog-*')):
+        match = SNAPSHOT_NAME_RE.match(os.path.basename(path))
+        if match and int(match.group(1)) < revision:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def get_snapshot(request):
+    """
+    Return the snapshot of the current catalog revision.
+
+    Snapshots are rendered once per catalog revision (and per host since
+    the catalog contains absolute URLs) and stored on disk in each of the
+    supported encodings so they can be streamed to clients as is.
+
+    :rtype: ``tuple`` of ``str`` and ``dict``
+    :return: An ID identifying the snapshot and a dict mapping each
+             available encoding to the path of the snapshot in that encoding.
+    """
+    revision = models.CatalogRevision.get_current()
+    host_hash = hashlib.md5(
+        request.build_absolute_uri('/').encode('utf-8')).hexdigest()
+    snapshot_id = '{0}-{1}'.format(revision, host_hash[:12])
+    snapshot_dir = get_snapshot_dir()
+    prefix = os.path.join(snapshot_dir, 'catalog-{0}'.format(snapshot_id))
+    paths = {encoding: prefix + SNAPSHOT_SUFFIXES[encoding]
+             for encoding in get_snapshot_encodings()}
+    if not all(os.path.exists(path) for path in paths.values()):
+        log.debug("Rendering catalog snapshot %s", snapshot_id)
+        os.makedirs(snapshot_dir, exist_ok=True)
+        content = render_snapshot(request, revision)
+        for encoding, path in paths.items():
+            _write_atomic(path, _encode(content, encoding))
+        _prune_snapshots(snapshot_dir, revision)
+    return snapshot_id, paths
+
+
+def open_snapshot(request, encoding):
+    """
+    Open the snapshot of the current catalog revision.
+
+    :type encoding: ``str``
+    :param encoding: One of the encodings returned by
+                     ``get_snapshot_encodings()``.
+
+    :rtype: ``tuple`` of ``str`` and file
+    :return: The ID of the snapshot and the snapshot file, opened for
+             reading in binary mode.
+    """
+    snapshot_id, paths = get_snapshot(request)
+    try:
+        return snapshot_id, open(paths[encoding], 'rb')
+    except FileNotFoundError:
+        # Pruned by a process that rendered a newer revision since we
+        # looked; look the revision up again
+        log.debug("Catalog snapshot %s was pruned before it was opened",
+                  snapshot_id)
+    snapshot_id, paths = get_snapshot(request)
+    return snapshot_id, open(paths[encoding], 'rb')
+
+
+def choose_encoding(accept_encoding):
+    """
+    Pick the preferred snapshot encoding accepted by the client.
+
+    :type accept_encoding: ``str``
+    :param accept_encoding: Value of the ``Accept-Encoding`` request header.
+    """
+    accepted = set()
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q=') and params[2:] in (
+                '0', '0.0', '0.00', '0.000'):
+            continue
+        accepted.add(coding.strip().lower())
+    for encoding in get_snapshot_encodings():
+        if encoding in accepted or '*' in accepted:
+            return encoding
+    return 'identity'
@@ -0,0 +1,198 @@
+"""
+Publish and subscribe to deployment task events.
+
+Events are published to a channel per deployment owner. With
+``CLOUDLAUNCH_EVENTS_REDIS_URL`` set (and the ``redis`` package installed),
+channels are Redis pub/sub channels so events published by Celery workers
+reach subscribers in web processes. Otherwise, events are only delivered
+to subscribers in the publishing process, which is enough when tasks run
+eagerly, e.g. during development and tests.
+
+Delivery is best effort: ``progress`` events are lost while a client is
+disconnected. ``finished`` events carry the time the task's outcome was
+stored as their ID, so a reconnecting client that sends ``Last-Event-ID``
+gets the ones it missed again from the stored task state.
+
+Each stream occupies a worker for as long as it is open, at most
+``CLOUDLAUNCH_EVENTS_MAX_AGE`` seconds, after which clients reconnect.
+Serve the API with an asynchronous worker class, e.g.
+``gunicorn -k gevent``; with sync workers each subscriber holds a whole
+worker process.
+"""
+import functools
+import json
+import logging
+import queue
+import threading
+
+from django.conf import settings
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+log = logging.getLogger(__name__)
+
+# Seconds a subscription waits for an event before yielding ``None``
+KEEPALIVE_INTERVAL = 15
+# Milliseconds clients wait before reconnecting to a closed stream
+RETRY_INTERVAL = 3000
+
+
+def get_max_age():
+    """Return the number of seconds an event stream is kept open for."""
+    return getattr(settings, 'CLOUDLAUNCH_EVENTS_MAX_AGE', 300)
+
+
+def get_channel(owner_id):
+    """Return the name of the channel events of a user are published to."""
+    return 'cloudlaunch:deployment-events:{0}'.format(owner_id)
+
+
+@functools.lru_cache()
+def _get_redis_client(url):
+    return redis.StrictRedis.from_url(url)
+
+
+def get_redis_client():
+    """Return a Redis client if Redis pub/sub is configured, else ``None``."""
+    url = getattr(settings, 'CLOUDLAUNCH_EVENTS_REDIS_URL', None)
+    if url and redis:
+        return _get_redis_client(url)
+    return None
+
+
+class LocalBroker(object):
+    """Deliver events to subscribers in the current process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscriber in subscribers:
+            subscriber.put(message)
+
+    def subscribe(self, channel):
+        subscriber = queue.Queue()
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, channel, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(channel, set())
+            subscribers.discard(subscriber)
+            if not subscribers:
+                self._subscribers.pop(channel, None)
+
+
+local_broker = LocalBroker()
+
+
+def get_event(deployment, event_type, data, event_id=None):
+    """Return the event published about a deployment."""
+    event = {'type': event_type, 'deployment': deployment.id, 'data': data}
+    if event_id:
+        event['id'] = event_id
+    return event
+
+
+def get_finished_data(task):
+    """Return the details of the ``finished`` event of a stored task."""
+    return {'task': task.id, 'action': task.action, 'state': task._status,
+            'deployment_state': task.deployment.state,
+            'health_status': task.deployment.health_status}
+
+
+def get_finished_event_id(task):
+    """
+    Return the ID of the ``finished`` event of a stored task.
+
+    This is the time the task's outcome was stored, which streams resume
+    from.
+    """
+    return task.updated.isoformat()
+
+
+def get_finished_event(task):
+    """Return the ``finished`` event of a task whose outcome is stored."""
+    return get_event(task.deployment, 'finished', get_finished_data(task),
+                     get_finished_event_id(task))
+
+
+def publish(deployment, event_type, data, event_id=None):
+    """
+    Publish an event about the supplied deployment to its owner.
+
+    Failing to publish is logged and otherwise ignored so that tasks never
+    fail because of it.
+
+    :type deployment: :class:`.models.ApplicationDeployment`
+    :param deployment: The deployment the event is about.
+
+    :type event_type: ``str``
+    :param event_type: Kind of event, e.g. ``progress`` or ``finished``.
+
+    :type data: ``dict``
+    :param data: JSON serializable event details.
+
+    :type event_id: ``str``
+    :param event_id: ID clients can resume the stream from, if any.
+    """
+    message = json.dumps(get_event(deployment, event_type, data, event_id))
+    channel = get_channel(deployment.owner_id)
+    try:
+        client = get_redis_client()
+        if client:
+            client.publish(channel, message)
+        else:
+            local_broker.publish(channel, message)
+    except Exception as exc:
+        log.warning("Could not publish %s event for deployment %s: %s",
+                    event_type, deployment.id, exc)
+
+
+class Subscription(object):
+    """
+    Iterate over the events published for a user's deployments.
+
+    Each event is a ``dict`` with ``type``, ``deployment`` and ``data``
+    keys. ``None`` is yielded whenever no event arrives for ``timeout``
+    seconds so callers can keep idle connections alive.
+    """
+
+    def __init__(self, owner_id, timeout=KEEPALIVE_INTERVAL):
+        self.channel = get_channel(owner_id)
+        self.timeout = timeout
+        self._pubsub = None
+        self._queue = None
+        client = get_redis_client()
+        if client:
+            self._pubsub = client.pubsub(ignore_subscribe_messages=True)
+            self._pubsub.subscribe(self.channel)
+        else:
+            self._queue = local_broker.subscribe(self.channel)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._pubsub:
+            message = self._pubsub.get_message(timeout=self.timeout)
+            message = message['data'] if message else None
+        else:
+            try:
+                message = self._queue.get(timeout=self.timeout)
+            except queue.Empty:
+                message = None
+        return json.loads(message) if message else None
+
+    def close(self):
+        if self._pubsub:
+            self._pubsub.close()
+        else:
+            local_broker.unsubscribe(self.channel, self._queue)
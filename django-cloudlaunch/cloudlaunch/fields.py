@@ -0,0 +1,159 @@
+"""
+A JSON model field for the databases CloudLaunch runs on.
+
+On PostgreSQL, values are stored in ``jsonb`` columns and decoded by the
+database driver. Elsewhere, they are stored as JSON text and decoded once,
+as rows are loaded. Either way, model instances hold the decoded value.
+
+Keys of stored objects can be filtered on with the usual ``__`` syntax,
+e.g., ``application_config__config_cloudlaunch__vmType='m1.small'``. The
+value found at the key path is compared as text (``#>>`` on PostgreSQL,
+``JSON_EXTRACT`` on SQLite), so matching expression indexes are used.
+"""
+import json
+
+from django import forms
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+
+
+class JSONEncoder(DjangoJSONEncoder):
+    """Encode values JSON has no type for, e.g. exceptions, as text."""
+
+    def default(self, o):
+        try:
+            return super(JSONEncoder, self).default(o)
+        except TypeError:
+            return str(o)
+
+
+class KeyTextTransform(models.Transform):
+    """The text of the value found at a key path of a JSON column."""
+
+    def __init__(self, key_name, *args, **kwargs):
+        super(KeyTextTransform, self).__init__(*args, **kwargs)
+        self.key_name = key_name
+
+    @property
+    def output_field(self):
+        return KeyTextField()
+
+    def compile_path(self, compiler):
+        """Return the SQL of the JSON column, its params and the key path."""
+        keys = [self.key_name]
+        lhs = self.lhs
+        while isinstance(lhs, KeyTextTransform):
+            keys.insert(0, lhs.key_name)
+            lhs = lhs.lhs
+        lhs_sql, params = compiler.compile(lhs)
+        return lhs_sql, list(params), keys
+
+    @staticmethod
+    def get_json_path(keys):
+        return '$' + ''.join('."{0}"'.format(key.replace('"', '\\"'))
+                             for key in keys)
+
+    def as_sql(self, compiler, connection):
+        lhs, params, keys = self.compile_path(compiler)
+        return 'JSON_EXTRACT({0}, %s)'.format(lhs), params + [
+            self.get_json_path(keys)]
+
+    def as_mysql(self, compiler, connection):
+        lhs, params, keys = self.compile_path(compiler)
+        return 'JSON_UNQUOTE(JSON_EXTRACT({0}, %s))'.format(lhs), params + [
+            self.get_json_path(keys)]
+
+    def as_postgresql(self, compiler, connection):
+        lhs, params, keys = self.compile_path(compiler)
+        return '({0} #>> %s)'.format(lhs), params + [keys]
+
+
+class KeyTextTransformFactory(object):
+
+    def __init__(self, key_name):
+        self.key_name = key_name
+
+    def __call__(self, *args, **kwargs):
+        return KeyTextTransform(self.key_name, *args, **kwargs)
+
+
+class KeyTextField(models.TextField):
+    """Output field of key transforms; allows filtering on nested keys."""
+
+    def get_transform(self, name):
+        transform = super(KeyTextField, self).get_transform(name)
+        if transform:
+            return transform
+        return KeyTextTransformFactory(name)
+
+
+class JSONFormField(forms.CharField):
+    """Edit a JSON value as text, e.g. in the admin."""
+    widget = forms.Textarea
+
+    def prepare_value(self, value):
+        if isinstance(value, str):
+            return value
+        return json.dumps(value, indent=2, cls=JSONEncoder)
+
+    def to_python(self, value):
+        value = super(JSONFormField, self).to_python(value)
+        if value in self.empty_values:
+            return None
+        try:
+            return json.loads(value)
+        except ValueError:
+            raise forms.ValidationError("Enter valid JSON.", code='invalid')
+
+    def has_changed(self, initial, data):
+        try:
+            data = self.to_python(data)
+        except forms.ValidationError:
+            return True
+        return initial != data
+
+
+class JSONField(models.Field):
+    """Store a JSON serializable value; ``jsonb`` on PostgreSQL."""
+    empty_strings_allowed = False
+    description = "A JSON object"
+
+    def get_internal_type(self):
+        # Behave like a TextField on databases without native JSON columns
+        return 'TextField'
+
+    def db_type(self, connection):
+        if connection.vendor == 'postgresql':
+            return 'jsonb'
+        return super(JSONField, self).db_type(connection)
+
+    def from_db_value(self, value, expression, connection):
+        if value is None or connection.vendor == 'postgresql':
+            return value
+        try:
+            return json.loads(value)
+        except ValueError:
+            # Text stored before the column held JSON
+            return value
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if value is None:
+            return None
+        if connection.vendor == 'postgresql':
+            from psycopg2.extras import Json
+            return Json(value, dumps=lambda obj: json.dumps(
+                obj, cls=JSONEncoder))
+        return json.dumps(value, cls=JSONEncoder)
+
+    def get_transform(self, name):
+        transform = super(JSONField, self).get_transform(name)
+        if transform:
+            return transform
+        return KeyTextTransformFactory(name)
+
+    def value_to_string(self, obj):
+        return self.value_from_object(obj)
+
+    def formfield(self, **kwargs):
+        return super(JSONField, self).formfield(
+            **{'form_class': JSONFormField, **kwargs})
@@ -0,0 +1,37 @@
+# Generated by Django 2.2.28 on 2026-10-17 06:01
+
+import json
+
+from django.db import migrations, models
+import jsonmerge
+
+
+def store_merged_configs(apps, schema_editor):
+    ApplicationVersionCloudConfig = apps.get_model(
+        'cloudlaunch', 'ApplicationVersionCloudConfig')
+    for cloud_config in ApplicationVersionCloudConfig.objects.select_related(
+            'application_version__application'):
+        version = cloud_config.application_version
+        merged_config = jsonmerge.merge(
+            json.loads(version.application.default_launch_config or "{}"),
+            json.loads(version.default_launch_config or "{}"))
+        merged_config = jsonmerge.merge(
+            merged_config, json.loads(cloud_config.default_launch_config or "{}"))
+        cloud_config.merged_launch_config = json.dumps(merged_config)
+        cloud_config.save(update_fields=['merged_launch_config'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloudlaunch', '0005_change_public_key_pk_relation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='applicationversioncloudconfig',
+            name='merged_launch_config',
+            field=models.TextField(blank=True, editable=False, help_text='Application, version and cloud launch configs merged together.', max_length=49152, null=True),
+        ),
+        migrations.RunPython(store_merged_configs, migrations.RunPython.noop),
+    ]
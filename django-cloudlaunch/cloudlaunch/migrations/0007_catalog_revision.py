@@ -0,0 +1,27 @@
+# Generated by Django 2.2.28 on 2026-10-17 06:10
+
+from django.db import migrations, models
+
+
+def create_catalog_revision(apps, schema_editor):
+    CatalogRevision = apps.get_model('cloudlaunch', 'CatalogRevision')
+    CatalogRevision.objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloudlaunch', '0006_cloud_config_merged_launch_config'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogRevision',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('revision', models.PositiveIntegerField(default=1)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(create_catalog_revision, migrations.RunPython.noop),
+    ]
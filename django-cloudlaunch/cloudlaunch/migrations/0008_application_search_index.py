@@ -0,0 +1,87 @@
+# Generated by Django 2.2.28 on 2026-10-17 06:25
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# The search index as of this migration; kept independent of
+# ``cloudlaunch.search`` so later changes to it do not alter this migration
+SEARCH_CONFIG = 'english'
+SQLITE_FTS_TABLE = 'cloudlaunch_application_fts'
+CATEGORY_NAMES = {'FEATURED': 'Featured', 'GALAXY': 'Galaxy',
+                  'SCALABLE': 'Scalable', 'VM': 'Virtual machine'}
+
+
+def get_search_fields(application):
+    categories = []
+    for category in application.category.all():
+        categories.extend([category.name or '',
+                           CATEGORY_NAMES.get(category.name,
+                                              category.name or '')])
+    return ["{0} {1}".format(application.name or '',
+                             application.slug.replace('-', ' ')),
+            application.summary or '',
+            application.maintainer or '',
+            ' '.join(categories),
+            application.description or '']
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE INDEX cloudlaunch_application_search_vector_gin "
+            "ON cloudlaunch_application USING gin (search_vector)")
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE {0} USING fts5(slug UNINDEXED, name, "
+            "summary, maintainer, categories, description, "
+            "tokenize='porter unicode61')".format(SQLITE_FTS_TABLE))
+    else:
+        return
+    Application = apps.get_model('cloudlaunch', 'Application')
+    for application in Application.objects.prefetch_related('category'):
+        name, summary, maintainer, categories, description = (
+            get_search_fields(application))
+        if vendor == 'postgresql':
+            schema_editor.execute(
+                "UPDATE cloudlaunch_application SET search_vector = "
+                "setweight(to_tsvector(%s, %s), 'A') || "
+                "setweight(to_tsvector(%s, %s), 'B') || "
+                "setweight(to_tsvector(%s, %s || ' ' || %s), 'C') || "
+                "setweight(to_tsvector(%s, %s), 'D') WHERE slug = %s",
+                [SEARCH_CONFIG, name, SEARCH_CONFIG, summary, SEARCH_CONFIG,
+                 maintainer, categories, SEARCH_CONFIG, description,
+                 application.slug])
+        else:
+            schema_editor.execute(
+                "INSERT INTO {0} (slug, name, summary, maintainer, "
+                "categories, description) VALUES (%s, %s, %s, %s, %s, %s)"
+                .format(SQLITE_FTS_TABLE),
+                [application.slug, name, summary, maintainer, categories,
+                 description])
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            "DROP INDEX IF EXISTS cloudlaunch_application_search_vector_gin")
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            "DROP TABLE IF EXISTS {0}".format(SQLITE_FTS_TABLE))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloudlaunch', '0007_catalog_revision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='application',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 2.2.28 on 2026-10-17 06:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def index_launchable_applications(apps, schema_editor):
+    ApplicationVersionCloudConfig = apps.get_model(
+        'cloudlaunch', 'ApplicationVersionCloudConfig')
+    LaunchableApplication = apps.get_model(
+        'cloudlaunch', 'LaunchableApplication')
+    for cloud_config in ApplicationVersionCloudConfig.objects.filter(
+            application_version__application__status='LIVE').select_related(
+                'application_version__application', 'image'):
+        version = cloud_config.application_version
+        LaunchableApplication.objects.create(
+            cloud_config=cloud_config,
+            cloud_id=cloud_config.cloud_id,
+            application=version.application,
+            application_name=version.application.name,
+            application_version=version,
+            version=version.version,
+            display_order=version.application.display_order,
+            image_id=cloud_config.image.image_id,
+            image_name=cloud_config.image.name,
+            default_instance_type=cloud_config.default_instance_type)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djcloudbridge', '0001_initial'),
+        ('cloudlaunch', '0008_application_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LaunchableApplication',
+            fields=[
+                ('cloud_config', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='launchable', serialize=False, to='cloudlaunch.ApplicationVersionCloudConfig')),
+                ('application_name', models.CharField(max_length=60)),
+                ('version', models.CharField(max_length=30)),
+                ('display_order', models.IntegerField(default=10000)),
+                ('image_id', models.CharField(max_length=50, verbose_name='Image ID')),
+                ('image_name', models.CharField(max_length=60)),
+                ('default_instance_type', models.CharField(blank=True, max_length=256, null=True)),
+                ('application', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='cloudlaunch.Application')),
+                ('application_version', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='cloudlaunch.ApplicationVersion')),
+                ('cloud', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='djcloudbridge.Cloud')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='launchableapplication',
+            index=models.Index(fields=['cloud', 'display_order'], name='cloudlaunch_cloud_i_c68046_idx'),
+        ),
+        migrations.RunPython(index_launchable_applications,
+                             migrations.RunPython.noop),
+    ]
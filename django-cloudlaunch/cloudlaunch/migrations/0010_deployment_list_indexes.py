@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-17 06:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloudlaunch', '0009_launchable_application'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='applicationdeployment',
+            index=models.Index(fields=['owner', '-added', 'id'], name='cloudlaunch_owner_i_9d0290_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='applicationdeploymenttask',
+            index=models.Index(fields=['deployment', '-updated', 'id'], name='cloudlaunch_deploym_563ca4_idx'),
+        ),
+    ]
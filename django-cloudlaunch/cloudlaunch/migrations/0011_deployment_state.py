@@ -0,0 +1,82 @@
+# Generated by Django 2.2.28 on 2026-10-17 06:13
+
+from django.db import migrations, models
+import json
+
+
+def _load_result(value):
+    try:
+        return json.loads(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def populate_deployment_state(apps, schema_editor):
+    """Fill in state from task results already migrated to the database."""
+    ApplicationDeployment = apps.get_model(
+        'cloudlaunch', 'ApplicationDeployment')
+    ApplicationDeploymentTask = apps.get_model(
+        'cloudlaunch', 'ApplicationDeploymentTask')
+    # Tasks still held by Celery update their deployment once migrated
+    tasks = ApplicationDeploymentTask.objects.filter(
+        celery_id__isnull=True, _status__isnull=False).order_by('updated')
+    for task in tasks.iterator():
+        result = _load_result(task._result)
+        succeeded = task._status == 'SUCCESS'
+        changes = {}
+        if task.action == 'LAUNCH':
+            if succeeded and isinstance(result, dict):
+                launch = result.get('cloudLaunch') or {}
+                changes = {
+                    'state': 'RUNNING',
+                    'instance_id': (launch.get('instance') or {}).get('id'),
+                    'public_ip': launch.get('publicIP'),
+                    'application_url': launch.get('applicationURL')}
+            elif not succeeded:
+                changes = {'state': 'LAUNCH_FAILED'}
+        elif task.action == 'HEALTH_CHECK':
+            if succeeded and isinstance(result, dict):
+                changes = {'health_status': result.get('instance_status')}
+        elif task.action == 'DELETE':
+            if succeeded and result is True:
+                changes = {'state': 'DELETED'}
+        if changes:
+            ApplicationDeployment.objects.filter(
+                pk=task.deployment_id).update(**changes)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloudlaunch', '0010_deployment_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='applicationdeployment',
+            name='application_url',
+            field=models.URLField(blank=True, editable=False, max_length=2048, null=True),
+        ),
+        migrations.AddField(
+            model_name='applicationdeployment',
+            name='health_status',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='applicationdeployment',
+            name='instance_id',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='applicationdeployment',
+            name='public_ip',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='applicationdeployment',
+            name='state',
+            field=models.CharField(choices=[('LAUNCHING', 'Launching'), ('RUNNING', 'Running'), ('LAUNCH_FAILED', 'Launch failed'), ('DELETED', 'Deleted')], db_index=True, default='LAUNCHING', editable=False, max_length=64),
+        ),
+        migrations.RunPython(populate_deployment_state,
+                             migrations.RunPython.noop),
+    ]
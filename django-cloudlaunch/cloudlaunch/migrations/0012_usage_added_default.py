@@ -0,0 +1,19 @@
+# Generated by Django 2.2.28 on 2026-10-17 06:22
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloudlaunch', '0011_deployment_state'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='usage',
+            name='added',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
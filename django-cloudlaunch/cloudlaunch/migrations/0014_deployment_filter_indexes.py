@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-17 06:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloudlaunch', '0013_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='applicationdeployment',
+            index=models.Index(fields=['owner', 'archived', '-added', 'id'], name='cloudlaunch_owner_i_585318_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='applicationdeployment',
+            index=models.Index(fields=['owner', 'state', '-added', 'id'], name='cloudlaunch_owner_i_0b7b42_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='applicationdeployment',
+            index=models.Index(fields=['owner', 'target_cloud', '-added', 'id'], name='cloudlaunch_owner_i_5077f7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='applicationdeployment',
+            index=models.Index(fields=['owner', 'application_version', '-added', 'id'], name='cloudlaunch_owner_i_251f05_idx'),
+        ),
+    ]
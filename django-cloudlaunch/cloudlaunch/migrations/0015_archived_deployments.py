@@ -0,0 +1,60 @@
+# Generated by Django 2.2.28 on 2026-10-17 06:27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('djcloudbridge', '0001_initial'),
+        ('cloudlaunch', '0014_deployment_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedDeployment',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=60)),
+                ('added', models.DateTimeField()),
+                ('updated', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('provider_settings', models.TextField(blank=True, null=True)),
+                ('application_config', models.TextField(blank=True, null=True)),
+                ('state', models.CharField(choices=[('LAUNCHING', 'Launching'), ('RUNNING', 'Running'), ('LAUNCH_FAILED', 'Launch failed'), ('DELETED', 'Deleted')], max_length=64)),
+                ('instance_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('public_ip', models.CharField(blank=True, max_length=255, null=True)),
+                ('application_url', models.URLField(blank=True, max_length=2048, null=True)),
+                ('health_status', models.CharField(blank=True, max_length=64, null=True)),
+                ('application_version', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='cloudlaunch.ApplicationVersion')),
+                ('credentials', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='djcloudbridge.Credentials')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('target_cloud', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='djcloudbridge.Cloud')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedDeploymentTask',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('added', models.DateTimeField()),
+                ('updated', models.DateTimeField()),
+                ('action', models.CharField(blank=True, choices=[('LAUNCH', 'Launch'), ('HEALTH_CHECK', 'Health check'), ('RESTART', 'Restart'), ('DELETE', 'Delete')], max_length=255, null=True)),
+                ('status', models.CharField(blank=True, max_length=64, null=True)),
+                ('result', models.TextField(blank=True, null=True)),
+                ('traceback', models.TextField(blank=True, null=True)),
+                ('deployment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tasks', to='cloudlaunch.ArchivedDeployment')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='usage',
+            name='archived_deployment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='usage', to='cloudlaunch.ArchivedDeployment'),
+        ),
+        migrations.AddIndex(
+            model_name='archiveddeployment',
+            index=models.Index(fields=['owner', '-added', 'id'], name='cloudlaunch_owner_i_00608b_idx'),
+        ),
+    ]
@@ -0,0 +1,128 @@
+# Generated by Django 2.2.28 on 2026-10-17 06:32
+
+import ast
+import json
+
+import cloudlaunch.fields
+from django.db import migrations
+
+# Columns converted to JSON, by model
+JSON_COLUMNS = {
+    'ApplicationDeployment': ['provider_settings', 'application_config'],
+    'ApplicationDeploymentTask': ['_result'],
+    'ArchivedDeployment': ['provider_settings', 'application_config'],
+    'ArchivedDeploymentTask': ['result'],
+    'Usage': ['app_config'],
+}
+
+# Expression indexes on hot keys, used by filters such as
+# ``application_config__config_cloudlaunch__vmType`` on PostgreSQL
+KEY_INDEXES = [
+    ('cloudlaunch_appdeployment_vmtype',
+     'cloudlaunch_applicationdeployment', 'application_config',
+     ['config_cloudlaunch', 'vmType']),
+    ('cloudlaunch_appdeploymenttask_instance_id',
+     'cloudlaunch_applicationdeploymenttask', 'result',
+     ['cloudLaunch', 'instance', 'id']),
+    ('cloudlaunch_usage_vmtype', 'cloudlaunch_usage', 'app_config',
+     ['config_cloudlaunch', 'vmType']),
+]
+
+
+def to_json(value):
+    """Return the JSON text of a stored value, or ``None`` if empty."""
+    if not value:
+        return None
+    try:
+        json.loads(value)
+        return value
+    except ValueError:
+        pass
+    try:
+        # Usage app configs used to be stored as Python literals
+        return json.dumps(ast.literal_eval(value))
+    except (ValueError, SyntaxError, TypeError):
+        # Keep any other text as a JSON string
+        return json.dumps(value)
+
+
+def convert_to_json(apps, schema_editor):
+    for model_name, columns in JSON_COLUMNS.items():
+        model = apps.get_model('cloudlaunch', model_name)
+        changed = []
+        for obj in model.objects.only('pk', *columns).iterator():
+            values = {column: to_json(getattr(obj, column))
+                      for column in columns}
+            if any(values[column] != getattr(obj, column)
+                   for column in columns):
+                for column, value in values.items():
+                    setattr(obj, column, value)
+                changed.append(obj)
+            if len(changed) >= 500:
+                model.objects.bulk_update(changed, columns)
+                changed = []
+        model.objects.bulk_update(changed, columns)
+
+
+def create_key_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, column, keys in KEY_INDEXES:
+        schema_editor.execute(
+            "CREATE INDEX {0} ON {1} (({2} #>> ARRAY[{3}]))".format(
+                name, table, column,
+                ', '.join("'{0}'".format(key) for key in keys)))
+
+
+def drop_key_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, column, keys in KEY_INDEXES:
+        schema_editor.execute("DROP INDEX IF EXISTS {0}".format(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloudlaunch', '0015_archived_deployments'),
+    ]
+
+    operations = [
+        migrations.RunPython(convert_to_json, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='applicationdeployment',
+            name='application_config',
+            field=cloudlaunch.fields.JSONField(blank=True, help_text='Application configuration data used for this launch.', null=True),
+        ),
+        migrations.AlterField(
+            model_name='applicationdeployment',
+            name='provider_settings',
+            field=cloudlaunch.fields.JSONField(blank=True, help_text='Cloud provider specific settings used for this launch.', null=True),
+        ),
+        migrations.AlterField(
+            model_name='applicationdeploymenttask',
+            name='_result',
+            field=cloudlaunch.fields.JSONField(blank=True, db_column='result', help_text='Result of Celery task', null=True),
+        ),
+        migrations.AlterField(
+            model_name='archiveddeployment',
+            name='application_config',
+            field=cloudlaunch.fields.JSONField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='archiveddeployment',
+            name='provider_settings',
+            field=cloudlaunch.fields.JSONField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='archiveddeploymenttask',
+            name='result',
+            field=cloudlaunch.fields.JSONField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='usage',
+            name='app_config',
+            field=cloudlaunch.fields.JSONField(blank=True, null=True),
+        ),
+        migrations.RunPython(create_key_indexes, drop_key_indexes),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 2.2.28 on 2026-10-17 06:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def record_launched_instances(apps, schema_editor):
+    ApplicationDeployment = apps.get_model('cloudlaunch',
+                                           'ApplicationDeployment')
+    DeploymentInstance = apps.get_model('cloudlaunch', 'DeploymentInstance')
+    deployments = ApplicationDeployment.objects.filter(
+        instance_id__isnull=False).exclude(instance_id='').values_list(
+            'pk', 'target_cloud_id', 'instance_id', 'public_ip', 'added')
+    DeploymentInstance.objects.bulk_create(
+        (DeploymentInstance(deployment_id=pk, cloud_id=cloud_id,
+                            instance_id=instance_id, public_ip=public_ip,
+                            added=added)
+         for pk, cloud_id, instance_id, public_ip, added
+         in deployments.iterator()),
+        batch_size=500, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djcloudbridge', '0001_initial'),
+        ('cloudlaunch', '0016_json_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeploymentInstance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('instance_id', models.CharField(max_length=255)),
+                ('public_ip', models.CharField(blank=True, max_length=255, null=True)),
+                ('added', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('cloud', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='djcloudbridge.Cloud')),
+                ('deployment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='instances', to='cloudlaunch.ApplicationDeployment')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='deploymentinstance',
+            index=models.Index(fields=['cloud', 'public_ip', '-added'], name='cloudlaunch_cloud_i_7b15e4_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='deploymentinstance',
+            unique_together={('cloud', 'instance_id')},
+        ),
+        migrations.RunPython(record_launched_instances,
+                             migrations.RunPython.noop),
+    ]
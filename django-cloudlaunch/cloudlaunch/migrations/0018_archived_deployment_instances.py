@@ -0,0 +1,42 @@
+# Generated by Django 2.2.28 on 2026-10-17 07:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def record_archived_instances(apps, schema_editor):
+    ArchivedDeployment = apps.get_model('cloudlaunch', 'ArchivedDeployment')
+    DeploymentInstance = apps.get_model('cloudlaunch', 'DeploymentInstance')
+    deployments = ArchivedDeployment.objects.filter(
+        instance_id__isnull=False).exclude(instance_id='').values_list(
+            'pk', 'target_cloud_id', 'instance_id', 'public_ip', 'added')
+    # Instances reused by a live deployment keep pointing at it
+    DeploymentInstance.objects.bulk_create(
+        (DeploymentInstance(archived_deployment_id=pk, cloud_id=cloud_id,
+                            instance_id=instance_id, public_ip=public_ip,
+                            added=added)
+         for pk, cloud_id, instance_id, public_ip, added
+         in deployments.iterator()),
+        batch_size=500, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloudlaunch', '0017_deployment_instance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deploymentinstance',
+            name='archived_deployment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='instances', to='cloudlaunch.ArchivedDeployment'),
+        ),
+        migrations.AlterField(
+            model_name='deploymentinstance',
+            name='deployment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='instances', to='cloudlaunch.ApplicationDeployment'),
+        ),
+        migrations.RunPython(record_archived_instances,
+                             migrations.RunPython.noop),
+    ]
@@ -1,20 +1,35 @@
+from celery import states
 from celery.result import AsyncResult
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchVectorField
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError
 from django.db import models
+from django.db import transaction
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.template.defaultfilters import slugify
+from django.utils import timezone
 from rest_framework.authtoken.models import Token
 
 from djcloudbridge import models as cb_models
 
 from smart_selects.db_fields import ChainedForeignKey
 
+from datetime import timedelta
+import copy
 import json
 import jsonmerge
 import djcloudbridge
+import logging
+import traceback
+
+from . import fields
+from . import task_meta
+from . import util
+
+log = logging.getLogger(__name__)
 
 
 # Create API auth token when user is created
@@ -67,6 +82,25 @@ class AppCategory(models.Model):
         verbose_name_plural = "App categories"
 
 
+class ApplicationQuerySet(models.QuerySet):
+
+    def with_catalog_tree(self):
+        """
+        Load the full catalog tree used by ``ApplicationSerializer``.
+
+        Versions, their cloud configs, clouds (including the provider
+        specific subclass) and images are fetched in a fixed number of
+        queries, regardless of how many applications are returned.
+        """
+        cloud_configs = ApplicationVersionCloudConfig.objects.select_related(
+            'cloud', 'cloud__aws', 'cloud__openstack', 'cloud__azure',
+            'cloud__gce', 'image')
+        versions = ApplicationVersion.objects.prefetch_related(
+            models.Prefetch('app_version_config', queryset=cloud_configs))
+        return self.select_related('default_version').prefetch_related(
+            models.Prefetch('versions', queryset=versions))
+
+
 class Application(cb_models.DateNameAwareModel):
 
     DEV = 'DEV'
@@ -95,6 +129,11 @@ class Application(cb_models.DateNameAwareModel):
     default_version = models.ForeignKey('ApplicationVersion', on_delete=models.SET_NULL,
                                         related_name='+', blank=True, null=True)
     display_order = models.IntegerField(blank=False, null=False, default="10000")
+    # Full-text search document, maintained by the search module. It is only
+    # populated and indexed on PostgreSQL.
+    search_vector = SearchVectorField(blank=True, null=True, editable=False)
+
+    objects = ApplicationQuerySet.as_manager()
 
     def __str__(self):
         return "{0} [{1}]".format(self.name, self.get_status_display())
@@ -156,6 +195,14 @@ class ApplicationVersionCloudConfig(models.Model):
     default_launch_config = models.TextField(max_length=1024 * 16, help_text="Cloud "
                                    "specific initial configuration data to parameterize the launch with.",
                                    blank=True, null=True)
+    # Stored result of compute_merged_config(). It is refreshed whenever this
+    # config, its application version or its application is saved so the
+    # catalog never has to merge configs while serving requests.
+    merged_launch_config = models.TextField(
+        max_length=1024 * 48, help_text="Application, version and cloud "
+        "launch configs merged together.", blank=True, null=True,
+        editable=False)
+
     class Meta:
         unique_together = (("application_version", "cloud"),)
 
@@ -166,6 +213,7 @@ class ApplicationVersionCloudConfig(models.Model):
                 json.loads(self.default_launch_config)
             except Exception as e:
                 raise Exception("Invalid JSON syntax. Launch config must be in JSON format. Cause: {0}".format(e))
+        self.merged_launch_config = json.dumps(self.compute_merged_config())
         return super(ApplicationVersionCloudConfig, self).save()
 
     def compute_merged_config(self):
@@ -175,21 +223,354 @@ class ApplicationVersionCloudConfig(models.Model):
         default_combined_config = jsonmerge.merge(default_appwide_config, default_version_config)
         return jsonmerge.merge(default_combined_config, default_cloud_config)
 
+    def get_merged_config(self):
+        """
+        Return the merged launch config for this cloud config.
+
+        The stored copy is used so configs are not merged on every read. The
+        config is only computed if it has not been stored yet (e.g., for rows
+        created with ``bulk_create``, which bypasses ``save()``).
+        """
+        if self.merged_launch_config is None:
+            return self.compute_merged_config()
+        return json.loads(self.merged_launch_config)
+
+    @classmethod
+    def refresh_merged_configs(cls, **filters):
+        """
+        Recompute and store the merged config of matching cloud configs.
+
+        Called when an application or an application version is saved since
+        their launch configs are part of the merged config.
+        """
+        for cloud_config in cls.objects.filter(**filters).select_related(
+                'application_version__application'):
+            cls.objects.filter(pk=cloud_config.pk).update(
+                merged_launch_config=json.dumps(
+                    cloud_config.compute_merged_config()))
+
+
+class LaunchableApplication(models.Model):
+    """
+    Index of the applications that can be launched on each cloud.
+
+    A row exists for every cloud config of a LIVE application and holds a
+    denormalized copy of what is needed to launch the application on the
+    cloud so the applications of a cloud can be listed without joins. Rows
+    are refreshed when an application, version, cloud config or image is
+    saved and are removed along with their cloud config.
+    """
+
+    cloud_config = models.OneToOneField(
+        ApplicationVersionCloudConfig, on_delete=models.CASCADE,
+        primary_key=True, related_name="launchable")
+    cloud = models.ForeignKey(cb_models.Cloud, on_delete=models.CASCADE,
+                              related_name="+")
+    application = models.ForeignKey(Application, on_delete=models.CASCADE,
+                                    related_name="+")
+    application_name = models.CharField(max_length=60)
+    application_version = models.ForeignKey(
+        ApplicationVersion, on_delete=models.CASCADE, related_name="+")
+    version = models.CharField(max_length=30)
+    display_order = models.IntegerField(default=10000)
+    image_id = models.CharField(max_length=50, verbose_name="Image ID")
+    image_name = models.CharField(max_length=60)
+    default_instance_type = models.CharField(max_length=256, blank=True,
+                                             null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['cloud', 'display_order'])]
+
+    def __str__(self):
+        return "{0} {1} (on {2})".format(self.application_name, self.version,
+                                        self.cloud_id)
+
+    @classmethod
+    def refresh(cls, **filters):
+        """Refresh the index rows of cloud configs matching ``filters``."""
+        cloud_configs = ApplicationVersionCloudConfig.objects.filter(
+            **filters).select_related('application_version__application',
+                                      'image')
+        for cloud_config in cloud_configs:
+            version = cloud_config.application_version
+            application = version.application
+            if application.status != Application.LIVE:
+                cls.objects.filter(cloud_config=cloud_config).delete()
+                continue
+            cls.objects.update_or_create(
+                cloud_config=cloud_config,
+                defaults={
+                    'cloud_id': cloud_config.cloud_id,
+                    'application': application,
+                    'application_name': application.name,
+                    'application_version': version,
+                    'version': version.version,
+                    'display_order': application.display_order,
+                    'image_id': cloud_config.image.image_id,
+                    'image_name': cloud_config.image.name,
+                    'default_instance_type':
+                        cloud_config.default_instance_type})
+
+
+class CatalogRevision(models.Model):
+    """
+    Revision counter for the application catalog.
+
+    A single row is kept and its ``revision`` is incremented whenever an
+    application, version, cloud config, image or cloud is saved or deleted.
+    Catalog responses are derived from the revision so they can be validated
+    by clients without being serialized again.
+    """
+
+    SINGLETON_ID = 1
+
+    revision = models.PositiveIntegerField(default=1)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "{0}".format(self.revision)
+
+    @classmethod
+    def get_current(cls):
+        """Return the current catalog revision number."""
+        revision = cls.objects.filter(pk=cls.SINGLETON_ID).values_list(
+            'revision', flat=True).first()
+        return revision or 0
+
+    @classmethod
+    def bump(cls):
+        """Increment the catalog revision number."""
+        if not cls.objects.filter(pk=cls.SINGLETON_ID).update(
+                revision=models.F('revision') + 1, updated=timezone.now()):
+            _, created = cls.objects.get_or_create(pk=cls.SINGLETON_ID)
+            if not created:
+                cls.bump()
+
+
+class ApplicationDeploymentQuerySet(models.QuerySet):
+
+    def with_task_summary(self):
+        """
+        Load what ``DeploymentSerializer`` outputs about deployment tasks.
+
+        The latest and LAUNCH tasks of every deployment are fetched in a
+        single query, into a ``summary_tasks`` list on each deployment.
+        """
+        latest = ApplicationDeploymentTask.objects.filter(
+            deployment=models.OuterRef('deployment')).order_by(
+                '-updated', '-id').values('id')[:1]
+        summary_tasks = ApplicationDeploymentTask.objects.filter(
+            models.Q(action=ApplicationDeploymentTask.LAUNCH) |
+            models.Q(id=models.Subquery(latest))).order_by(
+                'id').with_task_meta()
+        return self.select_related(
+            'owner', 'application_version__application').prefetch_related(
+                models.Prefetch('tasks', queryset=summary_tasks,
+                                to_attr='summary_tasks'))
+
 
 class ApplicationDeployment(cb_models.DateNameAwareModel):
     """Application deployment details."""
 
+    LAUNCHING = 'LAUNCHING'
+    RUNNING = 'RUNNING'
+    LAUNCH_FAILED = 'LAUNCH_FAILED'
+    DELETED = 'DELETED'
+    STATE_CHOICES = (
+        (LAUNCHING, 'Launching'),
+        (RUNNING, 'Running'),
+        (LAUNCH_FAILED, 'Launch failed'),
+        (DELETED, 'Deleted')
+    )
+
     owner = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
     archived = models.BooleanField(blank=True, default=False)
     application_version = models.ForeignKey(ApplicationVersion, on_delete=models.CASCADE, null=False)
     target_cloud = models.ForeignKey(cb_models.Cloud, on_delete=models.CASCADE, null=False)
-    provider_settings = models.TextField(
-        max_length=1024 * 16, help_text="Cloud provider specific settings "
-        "used for this launch.", blank=True, null=True)
-    application_config = models.TextField(
-        max_length=1024 * 16, help_text="Application configuration data used "
-        "for this launch.", blank=True, null=True)
+    provider_settings = fields.JSONField(
+        help_text="Cloud provider specific settings used for this launch.",
+        blank=True, null=True)
+    application_config = fields.JSONField(
+        help_text="Application configuration data used for this launch.",
+        blank=True, null=True)
     credentials = models.ForeignKey(cb_models.Credentials, on_delete=models.CASCADE, related_name="deployment_creds", null=True)
+    # Current state of the deployment, denormalized from the results of its
+    # tasks as they complete (see ``update_from_task``)
+    state = models.CharField(max_length=64, choices=STATE_CHOICES,
+                             default=LAUNCHING, db_index=True, editable=False)
+    instance_id = models.CharField(max_length=255, blank=True, null=True,
+                                   db_index=True, editable=False)
+    public_ip = models.CharField(max_length=255, blank=True, null=True,
+                                 editable=False)
+    application_url = models.URLField(max_length=2048, blank=True, null=True,
+                                      editable=False)
+    health_status = models.CharField(max_length=64, blank=True, null=True,
+                                     editable=False)
+
+    objects = ApplicationDeploymentQuerySet.as_manager()
+
+    class Meta:
+        # Deployments are listed per owner, newest first, and optionally
+        # filtered on one of the columns below
+        indexes = [
+            models.Index(fields=['owner', '-added', 'id']),
+            models.Index(fields=['owner', 'archived', '-added', 'id']),
+            models.Index(fields=['owner', 'state', '-added', 'id']),
+            models.Index(fields=['owner', 'target_cloud', '-added', 'id']),
+            models.Index(fields=['owner', 'application_version', '-added',
+                                 'id']),
+        ]
+
+    def update_from_task(self, action, status, result):
+        """
+        Record the outcome of a finished deployment task.
+
+        :type action: ``str``
+        :param action: Action of the task, one of
+                       ``ApplicationDeploymentTask.ACTION_CHOICES``.
+
+        :type status: ``str``
+        :param status: Terminal Celery state of the task, e.g. ``SUCCESS``.
+
+        :type result: ``dict``
+        :param result: Value the task returned, if it succeeded.
+        """
+        succeeded = status == 'SUCCESS'
+        if action == ApplicationDeploymentTask.LAUNCH:
+            if succeeded:
+                launch = (result or {}).get('cloudLaunch') or {}
+                self.state = self.RUNNING
+                self.instance_id = (launch.get('instance') or {}).get('id')
+                self.public_ip = launch.get('publicIP')
+                self.application_url = launch.get('applicationURL')
+                fields = ('state', 'instance_id', 'public_ip',
+                          'application_url')
+            else:
+                self.state = self.LAUNCH_FAILED
+                fields = ('state',)
+        elif action == ApplicationDeploymentTask.HEALTH_CHECK:
+            if succeeded and isinstance(result, dict):
+                self.health_status = result.get('instance_status')
+            else:
+                self.health_status = 'unknown'
+            fields = ('health_status',)
+        elif action == ApplicationDeploymentTask.DELETE:
+            if not (succeeded and result is True):
+                return
+            self.state = self.DELETED
+            fields = ('state',)
+        else:
+            return
+        # Only write what this action changed; the instance may be stale
+        type(self).objects.filter(pk=self.pk).update(
+            **{field: getattr(self, field) for field in fields})
+        if (action == ApplicationDeploymentTask.LAUNCH and succeeded and
+                self.instance_id):
+            DeploymentInstance.record(self)
+
+
+class DeploymentInstance(models.Model):
+    """
+    A cloud instance launched for a deployment.
+
+    Maps a cloud instance (by ID or public IP) back to the deployment it
+    belongs to without looking at task results. Rows are recorded as
+    LAUNCH tasks succeed (see ``ApplicationDeployment.update_from_task``)
+    and kept, pointing at the archived deployment, by ``archive``.
+    """
+    deployment = models.ForeignKey(ApplicationDeployment,
+                                   on_delete=models.CASCADE,
+                                   related_name='instances', blank=True,
+                                   null=True)
+    # Set instead of deployment once the deployment has been archived
+    archived_deployment = models.ForeignKey(
+        'ArchivedDeployment', on_delete=models.CASCADE,
+        related_name='instances', blank=True, null=True)
+    cloud = models.ForeignKey(cb_models.Cloud, on_delete=models.CASCADE,
+                              related_name='+')
+    instance_id = models.CharField(max_length=255)
+    public_ip = models.CharField(max_length=255, blank=True, null=True)
+    # Instances of existing deployments were recorded with their launch time
+    added = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        unique_together = (('cloud', 'instance_id'),)
+        indexes = [models.Index(fields=['cloud', 'public_ip', '-added'])]
+
+    def __str__(self):
+        return "{0}/{1}".format(self.cloud_id, self.instance_id)
+
+    @classmethod
+    def record(cls, deployment):
+        """
+        Record the instance of a launched deployment.
+
+        A reused instance ID is reassigned to the deployment, as of now.
+        """
+        cls.objects.update_or_create(
+            cloud_id=deployment.target_cloud_id,
+            instance_id=deployment.instance_id,
+            defaults={'deployment': deployment,
+                      'archived_deployment': None,
+                      'public_ip': deployment.public_ip,
+                      'added': timezone.now()})
+
+    @classmethod
+    def find_deployment(cls, cloud, instance_id=None, public_ip=None):
+        """
+        Return the deployment an instance on the supplied cloud belongs to.
+
+        Public IPs get reused so, when looking up by ``public_ip``, the most
+        recently launched deployment with that IP is returned.
+
+        :type cloud: :class:`djcloudbridge.models.Cloud` or ``str``
+        :param cloud: The cloud, or its slug, the instance runs on.
+
+        :rtype: :class:`ApplicationDeployment` or :class:`ArchivedDeployment`
+        :return: The deployment or ``None`` if there is no such instance.
+        """
+        if instance_id is None and public_ip is None:
+            raise ValueError("Either instance_id or public_ip is required")
+        instances = cls.objects.filter(cloud=cloud).select_related(
+            'deployment', 'archived_deployment')
+        if instance_id is not None:
+            instances = instances.filter(instance_id=instance_id)
+        if public_ip is not None:
+            instances = instances.filter(public_ip=public_ip)
+        instance = instances.order_by('-added').first()
+        if not instance:
+            return None
+        return instance.deployment or instance.archived_deployment
+
+
+class ApplicationDeploymentTaskQuerySet(models.QuerySet):
+
+    _with_task_meta = False
+
+    def with_task_meta(self):
+        """
+        Resolve the Celery state of fetched tasks in bulk.
+
+        When the queryset is evaluated, the task meta of all fetched tasks
+        is looked up at once and memoized on each task, so their ``result``
+        and ``status`` no longer query the result backend one by one.
+        """
+        clone = self._chain()
+        clone._with_task_meta = True
+        return clone
+
+    def _clone(self):
+        clone = super(ApplicationDeploymentTaskQuerySet, self)._clone()
+        clone._with_task_meta = self._with_task_meta
+        return clone
+
+    def _fetch_all(self):
+        fetched = self._result_cache is None
+        super(ApplicationDeploymentTaskQuerySet, self)._fetch_all()
+        if fetched and self._with_task_meta:
+            ApplicationDeploymentTask.prefetch_task_meta(
+                [task for task in self._result_cache
+                 if isinstance(task, ApplicationDeploymentTask)])
 
 
 class ApplicationDeploymentTask(models.Model):
@@ -215,18 +596,106 @@ class ApplicationDeploymentTask(models.Model):
         "running on this deployment", blank=True, null=True, unique=True)
     action = models.CharField(max_length=255, blank=True, null=True,
                               choices=ACTION_CHOICES)
-    _result = models.TextField(
-        max_length=1024 * 16, help_text="Result of Celery task", blank=True,
-        null=True, db_column='result')
+    _result = fields.JSONField(help_text="Result of Celery task", blank=True,
+                               null=True, db_column='result')
     _status = models.CharField(max_length=64, blank=True, null=True,
                                db_column='status')
     traceback = models.TextField(
         max_length=1024 * 16, help_text="Celery task traceback, if any",
         blank=True, null=True)
 
+    class Meta:
+        # Tasks are listed per deployment, most recently updated first
+        indexes = [models.Index(fields=['deployment', '-updated', 'id'])]
+
+    objects = ApplicationDeploymentTaskQuerySet.as_manager()
+
     def __str__(self):
         return "{0}".format(self.id)
 
+    @classmethod
+    def prefetch_task_meta(cls, tasks):
+        """
+        Look up the Celery task meta of the supplied tasks in bulk.
+
+        The meta is memoized on each task and used by ``result`` and
+        ``status`` instead of querying the result backend per task.
+        """
+        tasks = [task for task in tasks if task.needs_task_meta()]
+        if not tasks:
+            return
+        try:
+            metas = task_meta.get_task_metas(
+                [task.celery_id for task in tasks])
+        except Exception as exc:
+            # Leave the tasks to be looked up one by one
+            log.warning("Could not look up Celery task meta in bulk: %s", exc)
+            return
+        for task in tasks:
+            task._task_meta = metas.get(task.celery_id)
+
+    def needs_task_meta(self):
+        """
+        Check whether the result and status must come from Celery.
+
+        Results of finished tasks are frozen into this table as soon as the
+        task completes (see ``freeze_result``). The exception are successful
+        LAUNCH tasks, whose stored result lacks the key pair material: their
+        result is read from Celery until it is migrated.
+        """
+        if not self.celery_id:
+            return False
+        if self._status not in states.READY_STATES:
+            return True
+        return self.action == self.LAUNCH and self._status == states.SUCCESS
+
+    @staticmethod
+    def sanitise_result(result):
+        """Return a copy of a task result without private key material."""
+        if (isinstance(result, dict) and result.get('cloudLaunch', {}).get(
+                'keyPair', {}).get('material')):
+            result = copy.deepcopy(result)
+            result['cloudLaunch']['keyPair']['material'] = None
+        return result
+
+    @staticmethod
+    def get_failure_result(exc):
+        """Return the result stored for a task that raised ``exc``."""
+        if isinstance(exc, util.LaunchValidationError):
+            return {'exc_message': str(exc), 'validation_errors': exc.detail}
+        return {'exc_message': str(exc)}
+
+    def freeze_result(self, status, retval):
+        """
+        Store the final status and (sanitised) result of the task.
+
+        :type status: ``str``
+        :param status: Terminal Celery state of the task.
+
+        :type retval: ``object``
+        :param retval: Value returned, or exception raised, by the task.
+        """
+        self._status = status
+        if status == states.FAILURE and isinstance(retval, Exception):
+            result = self.get_failure_result(retval)
+            self.traceback = ''.join(traceback.format_exception(
+                type(retval), retval, retval.__traceback__))
+        else:
+            result = self.sanitise_result(retval)
+        self._result = result
+        self.updated = timezone.now()
+        type(self).objects.filter(pk=self.pk).update(
+            _status=self._status, _result=self._result,
+            traceback=self.traceback, updated=self.updated)
+
+    def get_task_meta(self):
+        """Return the Celery task meta, memoized by ``prefetch_task_meta``."""
+        meta = getattr(self, '_task_meta', None)
+        if meta is None:
+            meta = AsyncResult(self.celery_id).backend.get_task_meta(
+                self.celery_id)
+        return meta
+
     def clean(self):
         # Check new records and validate at most one LAUNCH task per deployment
         if not self.id and self.action == self.LAUNCH:
@@ -241,40 +710,31 @@ class ApplicationDeploymentTask(models.Model):
         """
         Result can come from a Celery task or the database so we check both.
 
-        While a task is active or up to (by default) one hour after a task
-        was initiated, ``result`` field is available from the task. At the
-        end of the period, the Celery task is deleted and the data is migrated
-        to this table. By wrapping this field as a property, we ensure proper
-        data is returned.
+        While a task is active, ``result`` is available from the task. Once
+        the task finishes, its (sanitised) result is frozen into this table
+        (see ``freeze_result``) and read from here. By wrapping this field as
+        a property, we ensure proper data is returned.
 
         In the process, we have data types to deal with. Some task results
-        return a ``dict`` while others a ``bool``. In addition, result
-        returned from the task broker is returned as a native ``dict`` while,
-        after migration, the result for the same task is stored in the database
-        as a ``str``. This method tries to standardize on the value returned
-        for a given task and, at the very least, always returns a ``dict``.
-        More specifically, Celery task results are returned in native format as
-        returned from the broker. For the result stored in the database, an
-        attempt it made to de-serialize the value from JSON. If that does not
-        work, raw value is returned. It is hence desirable to serialize
-        the result value before saving it here.
+        return a ``dict`` while others a ``bool``. Celery task results are
+        returned in native format as returned from the broker and results
+        stored in the database are decoded from JSON as they are loaded. This
+        method tries to standardize on the value returned for a given task
+        and, at the very least, always returns a ``dict``.
         """
         r = None
-        if self.celery_id:
+        if self.needs_task_meta():
             try:
-                task = AsyncResult(self.celery_id)
-                r = task.result
-                if task.state == 'FAILURE':
-                    return {'exc_message': str(r)}
+                meta = self.get_task_meta()
+                r = meta.get('result')
+                if meta.get('status') == 'FAILURE':
+                    return self.get_failure_result(r)
                 if not isinstance(r, dict):
                     r = str(r)
             except Exception as exc:
                 return {'exc_message': str(exc)}
-        else:  # This is an older task whose task ID has been removed so return DB value
-            try:
-                r = json.loads(self._result)
-            except (ValueError, TypeError):
-                r = self._result
+        else:  # The task has finished so return the DB value
+            r = self._result
         # Always return a dict
         if not isinstance(r, dict):
             return {'result': r}
@@ -295,21 +755,18 @@ class ApplicationDeploymentTask(models.Model):
         """
         Status can come from a Celery task or the database so check both.
 
-        While a task is active or up to (by default) one hour after a task
-        was initiated, ``result`` field is available from the task. At the
-        end of the period, the Celery task is deleted and the data is migrated
-        to this table. By wrapping this field as a property, we ensure proper
-        data is returned.
+        While a task is active, ``status`` is available from the task. Once
+        the task finishes, its status is frozen into this table. By wrapping
+        this field as a property, we ensure proper data is returned.
 
         Available status values include: PENDING, STARTED, RETRY, FAILURE,
         SUCCESS, and "UNKNOWN - `Exception value`".
         See http://docs.celeryproject.org/en/latest/reference/celery.result.html#celery.result.AsyncResult.status
         """
         try:
-            if self.celery_id:
-                task = AsyncResult(self.celery_id)
-                return task.backend.get_task_meta(task.id).get('status')
-            else:  # This is an older task whose task ID has been removed so return DB value
+            if self.celery_id and self._status not in states.READY_STATES:
+                return self.get_task_meta().get('status')
+            else:  # The task has finished so return the DB value
                 return self._status
         except Exception as exc:
             return 'UNKNOWN - %s' % exc
@@ -319,18 +776,113 @@ class ApplicationDeploymentTask(models.Model):
         self._status = value
 
 
+class ArchivedDeployment(models.Model):
+    """
+    A deployment moved out of the deployment table by ``archive``.
+
+    Archived deployments keep their original ID. Fields only used while a
+    deployment is live, such as its tasks' Celery IDs, are dropped.
+    """
+    # Fields copied over from ``ApplicationDeployment``
+    DEPLOYMENT_FIELDS = ('id', 'name', 'added', 'updated', 'owner_id',
+                         'application_version_id', 'target_cloud_id',
+                         'provider_settings', 'application_config',
+                         'credentials_id', 'state', 'instance_id', 'public_ip',
+                         'application_url', 'health_status')
+
+    id = models.IntegerField(primary_key=True)
+    name = models.CharField(max_length=60)
+    added = models.DateTimeField()
+    updated = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE,
+                              related_name='+')
+    application_version = models.ForeignKey(
+        ApplicationVersion, on_delete=models.CASCADE, related_name='+')
+    target_cloud = models.ForeignKey(cb_models.Cloud, on_delete=models.CASCADE,
+                                     related_name='+')
+    provider_settings = fields.JSONField(blank=True, null=True)
+    application_config = fields.JSONField(blank=True, null=True)
+    credentials = models.ForeignKey(
+        cb_models.Credentials, on_delete=models.SET_NULL, related_name='+',
+        blank=True, null=True)
+    state = models.CharField(max_length=64,
+                             choices=ApplicationDeployment.STATE_CHOICES)
+    instance_id = models.CharField(max_length=255, blank=True, null=True)
+    public_ip = models.CharField(max_length=255, blank=True, null=True)
+    application_url = models.URLField(max_length=2048, blank=True, null=True)
+    health_status = models.CharField(max_length=64, blank=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['owner', '-added', 'id'])]
+
+    def __str__(self):
+        return "{0}".format(self.name)
+
+    @classmethod
+    def from_deployment(cls, deployment):
+        """Return an unsaved archive copy of the supplied deployment."""
+        return cls(**{field: getattr(deployment, field)
+                      for field in cls.DEPLOYMENT_FIELDS})
+
+
+class ArchivedDeploymentTask(models.Model):
+    """A task of an archived deployment, with its final result."""
+
+    id = models.IntegerField(primary_key=True)
+    deployment = models.ForeignKey(ArchivedDeployment, on_delete=models.CASCADE,
+                                   related_name='tasks')
+    added = models.DateTimeField()
+    updated = models.DateTimeField()
+    action = models.CharField(
+        max_length=255, blank=True, null=True,
+        choices=ApplicationDeploymentTask.ACTION_CHOICES)
+    status = models.CharField(max_length=64, blank=True, null=True)
+    result = fields.JSONField(blank=True, null=True)
+    traceback = models.TextField(blank=True, null=True)
+
+    def __str__(self):
+        return "{0}".format(self.id)
+
+    @classmethod
+    def from_task(cls, task):
+        """
+        Return an unsaved archive copy of the supplied task.
+
+        Results still held by the Celery result backend are copied over so
+        call ``ApplicationDeploymentTask.prefetch_task_meta()`` first when
+        archiving many tasks.
+        """
+        archived = cls(id=task.id, deployment_id=task.deployment_id,
+                       added=task.added, updated=task.updated,
+                       action=task.action)
+        if task.needs_task_meta():
+            archived.status = task.status
+            archived.result = task.sanitise_result(task.result)
+            archived.traceback = task.get_task_meta().get('traceback')
+        else:
+            archived.status = task._status
+            archived.result = task._result
+            archived.traceback = task.traceback
+        return archived
+
+
 class Usage(models.Model):
     """
     Keep some usage information about instances that are being launched.
     """
-    #automatically add timestamps when object is created
-    added = models.DateTimeField(auto_now_add=True)
+    # Usage is recorded in batches so keep the time of the launch itself
+    added = models.DateTimeField(default=timezone.now, editable=False)
     app_version_cloud_config = models.ForeignKey(ApplicationVersionCloudConfig, on_delete=models.CASCADE,
                                                  related_name="app_version_cloud_config", null=False)
     app_deployment = models.ForeignKey(ApplicationDeployment, on_delete=models.SET_NULL,
                                        related_name="app_version_cloud_config",
                                        null=True)
-    app_config =  models.TextField(max_length=1024 * 16, blank=True, null=True)
+    # Set instead of app_deployment once the deployment has been archived
+    archived_deployment = models.ForeignKey(
+        ArchivedDeployment, on_delete=models.SET_NULL, related_name='usage',
+        blank=True, null=True)
+    app_config = fields.JSONField(blank=True, null=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
 
     class Meta:
@@ -338,6 +890,71 @@ class Usage(models.Model):
         verbose_name_plural = 'Usage'
 
 
+class IdempotencyKey(models.Model):
+    """
+    A client supplied key under which a request is only acted on once.
+
+    The first request with a key claims it and stores its response. Repeated
+    requests with the same key get the stored response back instead of
+    e.g. launching another deployment. Keys expire after
+    ``CLOUDLAUNCH_IDEMPOTENCY_KEY_TTL`` seconds.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name='+')
+    key = models.CharField(max_length=255)
+    # Digest of the request the key was first used with
+    fingerprint = models.CharField(max_length=64)
+    # The response is not set while the first request is being handled
+    response_status = models.PositiveSmallIntegerField(blank=True, null=True)
+    response_headers = models.TextField(blank=True, null=True)
+    response_body = models.TextField(blank=True, null=True)
+    added = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        unique_together = ('user', 'key')
+
+    def __str__(self):
+        return "{0} ({1})".format(self.key, self.user_id)
+
+    @staticmethod
+    def get_expiry_cutoff():
+        """Return the time before which keys have expired."""
+        return timezone.now() - timedelta(seconds=getattr(
+            settings, 'CLOUDLAUNCH_IDEMPOTENCY_KEY_TTL', 24 * 3600))
+
+    @classmethod
+    def claim(cls, user, key, fingerprint):
+        """
+        Claim a key for a request, unless it has already been claimed.
+
+        :rtype: ``tuple`` of :class:`.IdempotencyKey` and ``bool``
+        :return: The key and whether it was claimed by this call.
+        """
+        cls.objects.filter(user=user, key=key,
+                           added__lt=cls.get_expiry_cutoff()).delete()
+        try:
+            with transaction.atomic():
+                return cls.objects.create(
+                    user=user, key=key, fingerprint=fingerprint), True
+        except IntegrityError:
+            return cls.objects.get(user=user, key=key), False
+
+    def store_response(self, status, headers, body):
+        """Store the response to replay to repeated requests."""
+        self.response_status = status
+        self.response_headers = json.dumps(headers)
+        self.response_body = body
+        self.save(update_fields=['response_status', 'response_headers',
+                                 'response_body'])
+
+    @classmethod
+    def purge_expired(cls):
+        """Delete expired keys and return how many were deleted."""
+        deleted, _ = cls.objects.filter(
+            added__lt=cls.get_expiry_cutoff()).delete()
+        return deleted
+
+
 class PublicKey(cb_models.DateNameAwareModel):
     """Allow users to store their ssh public keys."""
 
@@ -0,0 +1,147 @@
+"""
+A process-local pool of cloud provider objects.
+
+Creating a provider sets up new cloud SDK sessions, so the first request
+made through it has to authenticate (e.g., get a Keystone token) and open
+new TLS connections. Providers are pooled per (cloud, credentials) pair so
+tasks and requests using the same credentials reuse an authenticated
+provider. The settings of the cloud, e.g., its region or endpoints, are part
+of the pool key, so each process stops reusing a provider as soon as it
+loads the changed cloud, even if it did not save the change. Pooled
+providers expire after ``CLOUDLAUNCH_PROVIDER_POOL_TTL`` seconds and the
+least recently used ones are evicted once the pool holds
+``CLOUDLAUNCH_PROVIDER_POOL_SIZE`` providers.
+"""
+import collections
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from djcloudbridge import domain_model
+from djcloudbridge import models as cb_models
+
+log = logging.getLogger(__name__)
+
+
+def get_fingerprint(credentials):
+    """Return a digest identifying the supplied credentials dict."""
+    return hashlib.sha256(json.dumps(
+        credentials or {}, sort_keys=True, default=str).encode(
+            'utf-8')).hexdigest()
+
+
+def get_real_cloud(cloud):
+    """Return the subclass instance, e.g. ``AWS``, of the supplied cloud."""
+    if type(cloud) is cb_models.Cloud:
+        return cb_models.Cloud.objects.get_subclass(slug=cloud.slug)
+    return cloud
+
+
+def get_pool_key(cloud, credentials):
+    """Return the key of the provider for a cloud and credentials."""
+    cloud_settings = {field.attname: field.value_from_object(cloud)
+                      for field in cloud._meta.concrete_fields}
+    return (cloud.slug, get_fingerprint(cloud_settings),
+            get_fingerprint(credentials))
+
+
+class ProviderPool(object):
+    """An LRU cache of cloud providers whose entries expire."""
+
+    def __init__(self, max_size=None, ttl=None):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._providers = collections.OrderedDict()
+
+    @property
+    def max_size(self):
+        if self._max_size is not None:
+            return self._max_size
+        return getattr(settings, 'CLOUDLAUNCH_PROVIDER_POOL_SIZE', 32)
+
+    @property
+    def ttl(self):
+        if self._ttl is not None:
+            return self._ttl
+        return getattr(settings, 'CLOUDLAUNCH_PROVIDER_POOL_TTL', 900)
+
+    def get(self, cloud, credentials):
+        """
+        Return a provider for the supplied cloud and credentials.
+
+        A pooled provider is returned if there is one; otherwise a new one is
+        created and added to the pool.
+
+        :type cloud: :class:`djcloudbridge.models.Cloud`
+        :param cloud: The cloud to return a provider for.
+
+        :type credentials: ``dict``
+        :param credentials: Credentials for the cloud, as returned by
+                            ``Credentials.as_dict()``.
+        """
+        if not self.max_size or not self.ttl:
+            return domain_model.get_cloud_provider(cloud, credentials)
+        cloud = get_real_cloud(cloud)
+        key = get_pool_key(cloud, credentials)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._providers.get(key)
+            if entry and entry[0] > now:
+                self._providers.move_to_end(key)
+                return entry[1]
+        # Creating a provider can be slow so don't hold the lock meanwhile
+        log.debug("Creating a pooled provider for cloud %s", cloud.slug)
+        provider = domain_model.get_cloud_provider(cloud, credentials)
+        with self._lock:
+            self._providers[key] = (now + self.ttl, provider)
+            self._providers.move_to_end(key)
+            while len(self._providers) > self.max_size:
+                self._providers.popitem(last=False)
+        return provider
+
+    def discard(self, cloud, credentials):
+        """Remove the provider for a cloud and credentials from the pool."""
+        with self._lock:
+            self._providers.pop(
+                get_pool_key(get_real_cloud(cloud), credentials), None)
+
+    def clear(self, cloud_slug=None):
+        """Empty the pool or remove the providers of the supplied cloud."""
+        with self._lock:
+            if cloud_slug is None:
+                self._providers.clear()
+                return
+            for key in [key for key in self._providers
+                        if key[0] == cloud_slug]:
+                del self._providers[key]
+
+    def __len__(self):
+        return len(self._providers)
+
+
+provider_pool = ProviderPool()
+
+
+def get_cloud_provider(cloud, credentials):
+    """
+    Return a pooled provider for the supplied cloud and credentials.
+
+    This is a drop-in replacement for
+    ``djcloudbridge.domain_model.get_cloud_provider``.
+    """
+    return provider_pool.get(cloud, credentials)
+
+
+def discard_cloud_provider(cloud, credentials):
+    """
+    Stop reusing the provider for the supplied cloud and credentials.
+
+    Call this after a cloud operation fails so that a provider in a bad
+    state, e.g., holding expired tokens, is not handed out again.
+    """
+    provider_pool.discard(cloud, credentials)
@@ -0,0 +1,131 @@
+"""
+Full-text search over the application catalog.
+
+On PostgreSQL, applications carry a weighted ``tsvector`` column backed by a
+GIN index. On SQLite, an FTS5 table mirrors the searchable text. Both are
+maintained when an application (or one of its categories) is saved, so
+searching never needs to scan the application table. Both match each term
+as a prefix, e.g. ``gal`` finds Galaxy. Other databases fall back to
+``icontains`` lookups.
+"""
+from django.contrib.postgres.search import SearchQuery
+from django.contrib.postgres.search import SearchRank
+from django.contrib.postgres.search import SearchVector
+from django.db import connection
+from django.db.models import Case
+from django.db.models import F
+from django.db.models import FloatField
+from django.db.models import Q
+from django.db.models import TextField
+from django.db.models import Value
+from django.db.models import When
+
+SEARCH_CONFIG = 'english'
+SQLITE_FTS_TABLE = 'cloudlaunch_application_fts'
+# Relative weights of the FTS5 columns: slug, name, summary, maintainer,
+# categories and description
+SQLITE_FTS_WEIGHTS = (0.0, 10.0, 5.0, 2.0, 2.0, 1.0)
+
+
+def _get_search_fields(application):
+    """Return the searchable text of an application, by column."""
+    categories = []
+    for category in application.category.all():
+        categories.extend([category.name or '', category.get_name_display()])
+    return {'name': "{0} {1}".format(application.name or '',
+                                     application.slug.replace('-', ' ')),
+            'summary': application.summary or '',
+            'maintainer': application.maintainer or '',
+            'categories': ' '.join(categories),
+            'description': application.description or ''}
+
+
+def update_index(application):
+    """Store the searchable text of the supplied application."""
+    fields = _get_search_fields(application)
+    if connection.vendor == 'postgresql':
+        vector = (
+            SearchVector(Value(fields['name'], output_field=TextField()),
+                         weight='A', config=SEARCH_CONFIG) +
+            SearchVector(Value(fields['summary'], output_field=TextField()),
+                         weight='B', config=SEARCH_CONFIG) +
+            SearchVector(Value(fields['maintainer'], output_field=TextField()),
+                         Value(fields['categories'], output_field=TextField()),
+                         weight='C', config=SEARCH_CONFIG) +
+            SearchVector(Value(fields['description'],
+                               output_field=TextField()),
+                         weight='D', config=SEARCH_CONFIG))
+        type(application)._default_manager.filter(pk=application.pk).update(
+            search_vector=vector)
+    elif connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM {0} WHERE slug = %s".format(
+                SQLITE_FTS_TABLE), [application.pk])
+            cursor.execute(
+                "INSERT INTO {0} (slug, name, summary, maintainer, "
+                "categories, description) VALUES (%s, %s, %s, %s, %s, %s)"
+                .format(SQLITE_FTS_TABLE),
+                [application.pk, fields['name'], fields['summary'],
+                 fields['maintainer'], fields['categories'],
+                 fields['description']])
+
+
+def remove_from_index(application):
+    """Remove a deleted application from the search index."""
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM {0} WHERE slug = %s".format(
+                SQLITE_FTS_TABLE), [application.pk])
+
+
+def _get_sqlite_ranks(terms):
+    """Return a dict of matching application slugs and their FTS5 rank."""
+    # Quote each term so FTS5 query syntax characters are matched literally
+    # and allow prefix matches on each term.
+    match = ' AND '.join('"{0}"*'.format(term.replace('"', '""'))
+                         for term in terms)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT slug, bm25({0}, {1}) FROM {0} WHERE {0} MATCH %s".format(
+                SQLITE_FTS_TABLE,
+                ', '.join(str(w) for w in SQLITE_FTS_WEIGHTS)),
+            [match])
+        # bm25() returns lower values for better matches
+        return {slug: -rank for slug, rank in cursor.fetchall()}
+
+
+def _get_tsquery(terms):
+    """Return a ``to_tsquery`` query matching all terms, by prefix."""
+    # Quote each term so tsquery operators are matched literally and allow
+    # prefix matches on each term, as on SQLite.
+    return ' & '.join("'{0}':*".format(
+        term.replace('\\', '\\\\').replace("'", "''")) for term in terms)
+
+
+def search_applications(queryset, terms):
+    """
+    Filter an application queryset down to the ones matching all terms.
+
+    Matching applications are annotated with a ``search_rank``; the higher
+    the rank, the better the match.
+    """
+    if connection.vendor == 'postgresql':
+        query = SearchQuery(_get_tsquery(terms), config=SEARCH_CONFIG,
+                            search_type='raw')
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query))
+    elif connection.vendor == 'sqlite':
+        ranks = _get_sqlite_ranks(terms)
+        return queryset.filter(slug__in=ranks.keys()).annotate(
+            search_rank=Case(
+                *[When(slug=slug, then=Value(rank))
+                  for slug, rank in ranks.items()],
+                default=Value(0.0), output_field=FloatField()))
+    for term in terms:
+        queryset = queryset.filter(
+            Q(slug__icontains=term) | Q(name__icontains=term) |
+            Q(summary__icontains=term) | Q(description__icontains=term) |
+            Q(maintainer__icontains=term) |
+            Q(category__name__icontains=term))
+    return queryset.distinct().annotate(
+        search_rank=Value(0.0, output_field=FloatField()))
@@ -1,13 +1,20 @@
-import json
+import copy
 import jsonmerge
 import logging
+import uuid
 
 from bioblend.cloudman.launch import CloudManLauncher
+from celery import group
 from cloudbridge.cloud.factory import ProviderList
+from django.db import connection
+from django.db import transaction
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 
 from . import models
+from . import providers
 from . import tasks
+from . import usage
 from . import util
 
 from djcloudbridge import models as cb_models
@@ -35,7 +42,11 @@ class CloudManSerializer(serializers.Serializer):
         This only fetches saved clusters that used AWS since it appears that
         was the only place this feature was actively used.
         """
-        provider = view_helpers.get_cloud_provider(self.context.get('view'))
+        view = self.context.get('view')
+        cloud = cb_models.Cloud.objects.filter(
+            slug=view.kwargs.get('cloud_pk')).select_subclasses().first()
+        provider = providers.get_cloud_provider(
+            cloud, view_helpers.get_credentials(cloud, view.request))
         if provider.PROVIDER_ID != ProviderList.AWS:
             return []
         # Since we're only working with the AWS, there's no need to specify
@@ -46,6 +57,67 @@ class CloudManSerializer(serializers.Serializer):
         return cml.get_clusters_pd().get('clusters', [])
 
 
+class SparseFieldsMixin(object):
+    """
+    Let clients choose the fields of a response with ``?fields=``/``?omit=``.
+
+    Both parameters take a comma separated list of top-level field names.
+    They only apply to reads through the serializer a view renders its
+    response with; nested serializers always output all of their fields.
+
+    The model attributes read only by dropped fields are returned by
+    ``get_unused_sources()`` so views can avoid loading them. Fields whose
+    source is not a model attribute can list the attributes they read in
+    ``Meta.field_sources``.
+    """
+    fields_param = 'fields'
+    omit_param = 'omit'
+
+    def _is_view_serializer(self):
+        if not self.context.get('view'):
+            return False
+        return self.parent is None or (
+            isinstance(self.parent, serializers.ListSerializer) and
+            self.parent.parent is None)
+
+    def _get_param_values(self, request, param):
+        value = request.query_params.get(param, '')
+        return {name.strip() for name in value.split(',') if name.strip()}
+
+    def get_fields(self):
+        fields = super(SparseFieldsMixin, self).get_fields()
+        self.dropped_fields = {}
+        request = self.context.get('request')
+        if (not request or request.method not in SAFE_METHODS or
+                not self._is_view_serializer()):
+            return fields
+        only = self._get_param_values(request, self.fields_param)
+        omit = self._get_param_values(request, self.omit_param)
+        for name in list(fields):
+            if (only and name not in only) or name in omit:
+                self.dropped_fields[name] = fields.pop(name)
+        return fields
+
+    def _get_field_sources(self, name, field):
+        sources = getattr(self.Meta, 'field_sources', {}).get(name)
+        if sources:
+            return set(sources)
+        source = field.source or name
+        if source == '*':
+            return set()
+        return {source.split('.')[0]}
+
+    def get_unused_sources(self):
+        """Return the names of model attributes only read by dropped fields."""
+        used = set()
+        for name, field in self.fields.items():
+            used |= self._get_field_sources(name, field)
+        unused = set()
+        for name, field in self.dropped_fields.items():
+            unused |= self._get_field_sources(name, field)
+        return unused - used
+
+
 class CloudImageSerializer(serializers.HyperlinkedModelSerializer):
     cloud = serializers.HyperlinkedRelatedField(
         view_name='djcloudbridge:cloud-detail', many=False, read_only=True)
@@ -56,24 +128,10 @@ class CloudImageSerializer(serializers.HyperlinkedModelSerializer):
         fields = ('name', 'cloud', 'image_id', 'description')
 
 
-class StoredJSONField(serializers.JSONField):
-    def __init__(self, *args, **kwargs):
-        super(StoredJSONField, self).__init__(*args, **kwargs)
-
-    def to_representation(self, value):
-        try:
-            if value:
-                return json.loads(value)
-            else:
-                return value
-        except Exception:
-            return value
-
-
 class AppVersionCloudConfigSerializer(serializers.HyperlinkedModelSerializer):
     cloud = cb_serializers.CloudSerializer(read_only=True)
     image = CloudImageSerializer(read_only=True)
-    default_launch_config = serializers.JSONField(source='compute_merged_config')
+    default_launch_config = serializers.JSONField(source='get_merged_config')
 
     class Meta:
         model = models.ApplicationVersionCloudConfig
@@ -89,14 +147,25 @@ class AppVersionSerializer(serializers.HyperlinkedModelSerializer):
         fields = ('version','cloud_config', 'frontend_component_path', 'frontend_component_name', 'default_cloud')
 
 
-class ApplicationSerializer(serializers.HyperlinkedModelSerializer):
+class ApplicationSerializer(SparseFieldsMixin,
+                            serializers.HyperlinkedModelSerializer):
     slug = serializers.CharField(read_only=True)
     versions = AppVersionSerializer(many=True, read_only=True)
     default_version = serializers.SlugRelatedField(read_only=True, slug_field='version')
 
     class Meta:
         model = models.Application
-        exclude = ('default_launch_config', 'category')
+        exclude = ('default_launch_config', 'category', 'search_vector')
+
+
+class LaunchableApplicationSerializer(SparseFieldsMixin,
+                                      serializers.ModelSerializer):
+
+    class Meta:
+        model = models.LaunchableApplication
+        fields = ('application', 'application_name', 'application_version',
+                  'version', 'image_id', 'image_name',
+                  'default_instance_type')
 
 
 class DeploymentAppSerializer(serializers.ModelSerializer):
@@ -114,7 +183,7 @@ class DeploymentAppVersionSerializer(serializers.ModelSerializer):
         fields = ('version', 'frontend_component_path', 'frontend_component_name', 'application')
 
 
-class DeploymentTaskSerializer(serializers.ModelSerializer):
+class DeploymentTaskSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     url = CustomHyperlinkedIdentityField(view_name='deployment_task-detail',
                                          lookup_field='id',
                                          lookup_url_kwarg='pk',
@@ -132,6 +201,10 @@ class DeploymentTaskSerializer(serializers.ModelSerializer):
         model = models.ApplicationDeploymentTask
         exclude = ('_result', '_status')
         read_only_fields = ('deployment',)
+        # ``needs_task_meta()`` reads the action and status of each task
+        field_sources = {'result': ('celery_id', '_result', 'action',
+                                    '_status'),
+                         'status': ('celery_id', '_status', 'action')}
 
     def create(self, validated_data):
         """
@@ -155,15 +228,17 @@ class DeploymentTaskSerializer(serializers.ModelSerializer):
             id=dpl.credentials.id).as_dict()
                  if dpl.credentials
                  else view_helpers.get_credentials(dpl.target_cloud, request))
+        celery_id = str(uuid.uuid4())
         try:
-            if action == models.ApplicationDeploymentTask.HEALTH_CHECK:
-                async_result = tasks.health_check.delay(dpl.pk, creds)
-            elif action == models.ApplicationDeploymentTask.RESTART:
-                async_result = tasks.restart_appliance.delay(dpl.pk, creds)
-            elif action == models.ApplicationDeploymentTask.DELETE:
-                async_result = tasks.delete_appliance.delay(dpl.pk, creds)
-            return models.ApplicationDeploymentTask.objects.create(
-                action=action, deployment=dpl, celery_id=async_result.task_id)
+            with transaction.atomic():
+                adt = models.ApplicationDeploymentTask.objects.create(
+                    action=action, deployment=dpl, celery_id=celery_id)
+                # Dispatch once committed so that a quick result still finds
+                # the task row to record its result against
+                transaction.on_commit(
+                    lambda: tasks.ACTION_TASKS[action].apply_async(
+                        (dpl.pk, creds), task_id=celery_id))
+            return adt
         except serializers.ValidationError as ve:
             raise ve
         except Exception as e:
@@ -181,11 +256,11 @@ class DeploymentTaskSerializer(serializers.ModelSerializer):
                     "Duplicate LAUNCH action for deployment %s" % dpl.name)
         return value.upper()
 
-class DeploymentSerializer(serializers.ModelSerializer):
+class DeploymentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     owner = serializers.CharField(read_only=True)
     name = serializers.CharField(required=True)
-    provider_settings = serializers.CharField(read_only=True)
-    application_config = StoredJSONField(read_only=True)
+    provider_settings = serializers.JSONField(read_only=True)
+    application_config = serializers.JSONField(read_only=True)
     # 'application' id is only used when creating a deployment
     application = serializers.CharField(write_only=True, required=False)
     config_app = serializers.JSONField(write_only=True, required=False)
@@ -201,27 +276,42 @@ class DeploymentSerializer(serializers.ModelSerializer):
         model = models.ApplicationDeployment
         fields = ('id','name', 'application', 'application_version', 'target_cloud', 'provider_settings',
                   'application_config', 'added', 'updated', 'owner', 'config_app', 'app_version_details',
-                  'tasks', 'latest_task', 'launch_task', 'archived', 'credentials')
+                  'tasks', 'latest_task', 'launch_task', 'archived', 'credentials',
+                  'state', 'instance_id', 'public_ip', 'application_url',
+                  'health_status')
+        field_sources = {'latest_task': ('tasks',),
+                         'launch_task': ('tasks',)}
+
+    def _serialize_task(self, obj, task):
+        if not task:
+            return None
+        # Avoid fetching the deployment again when serializing the task
+        task.deployment = obj
+        return DeploymentTaskSerializer(
+            task, context={'request': self.context['request'],
+                           'deployment_pk': obj.id}).data
 
     def get_latest_task(self, obj):
         """Provide task info about the most recenly updated deployment task."""
-        try:
-            task = obj.tasks.latest('updated')
-            return DeploymentTaskSerializer(
-                task, context={'request': self.context['request'],
-                               'deployment_pk': obj.id}).data
-        except models.ApplicationDeploymentTask.DoesNotExist:
-            return None
+        # Use tasks loaded by ``with_task_summary()`` if available
+        if hasattr(obj, 'summary_tasks'):
+            task = max(obj.summary_tasks, key=lambda t: (t.updated, t.id),
+                       default=None)
+        else:
+            task = obj.tasks.order_by('-updated', '-id').first()
+        return self._serialize_task(obj, task)
 
     def get_launch_task(self, obj):
-        """Provide task info about the most recenly updated deployment task."""
-        try:
-            task = obj.tasks.filter(action='LAUNCH').first()
-            return DeploymentTaskSerializer(
-                task, context={'request': self.context['request'],
-                               'deployment_pk': obj.id}).data
-        except models.ApplicationDeploymentTask.DoesNotExist:
-            return None
+        """Provide task info about the deployment's LAUNCH task."""
+        if hasattr(obj, 'summary_tasks'):
+            task = next((t for t in obj.summary_tasks
+                         if t.action == models.ApplicationDeploymentTask.LAUNCH),
+                        None)
+        else:
+            task = obj.tasks.filter(
+                action=models.ApplicationDeploymentTask.LAUNCH).order_by(
+                    'id').first()
+        return self._serialize_task(obj, task)
 
     def to_internal_value(self, data):
         application = data.get('application')
@@ -239,16 +329,17 @@ class DeploymentSerializer(serializers.ModelSerializer):
 
         Called automatically by the DRF following a POST request.
         """
+        if self.context.get('respond_async'):
+            return self._create_async(validated_data)
         name = validated_data.get("name")
         cloud = validated_data.get("target_cloud")
         version = validated_data.get("application_version")
         cloud_version_config = models.ApplicationVersionCloudConfig.objects.get(
             application_version=version.id, cloud=cloud.slug)
-        default_combined_config = cloud_version_config.compute_merged_config()
+        default_combined_config = cloud_version_config.get_merged_config()
         request = self.context.get('view').request
-        provider = view_helpers.get_cloud_provider(
-            self.context.get('view'), cloud_id=cloud.slug)
         credentials = view_helpers.get_credentials(cloud, request)
+        provider = providers.get_cloud_provider(cloud, credentials)
         try:
             handler = util.import_class(version.backend_component_name)()
             app_config = validated_data.get("config_app", {})
@@ -258,22 +349,29 @@ class DeploymentSerializer(serializers.ModelSerializer):
             cloud_config = util.serialize_cloud_config(cloud_version_config)
             final_ud_config = handler.validate_app_config(
                 provider, name, cloud_config, merged_app_config)
-            sanitised_app_config = handler.sanitise_app_config(merged_app_config)
-            async_result = tasks.create_appliance.delay(
-                name, cloud_version_config.pk, credentials, merged_app_config,
-                final_ud_config)
 
             del validated_data['application']
             if 'config_app' in validated_data:
                 del validated_data['config_app']
             validated_data['owner_id'] = request.user.id
-            validated_data['application_config'] = json.dumps(merged_app_config)
+            validated_data['application_config'] = merged_app_config
             validated_data['credentials_id'] = credentials.get('id') or None
-            app_deployment = super(DeploymentSerializer, self).create(validated_data)
-            self.log_usage(cloud_version_config, app_deployment, sanitised_app_config, request.user)
-            models.ApplicationDeploymentTask.objects.create(
-                action=models.ApplicationDeploymentTask.LAUNCH,
-                deployment=app_deployment, celery_id=async_result.task_id)
+            celery_id = str(uuid.uuid4())
+            with transaction.atomic():
+                app_deployment = super(DeploymentSerializer, self).create(
+                    validated_data)
+                self.log_usage(cloud_version_config, app_deployment,
+                               merged_app_config, request.user)
+                models.ApplicationDeploymentTask.objects.create(
+                    action=models.ApplicationDeploymentTask.LAUNCH,
+                    deployment=app_deployment, celery_id=celery_id)
+                # Dispatch once committed so that a quick failure still
+                # finds the task row to record its result against
+                transaction.on_commit(
+                    lambda: tasks.create_appliance.apply_async(
+                        (name, cloud_version_config.pk, credentials,
+                         merged_app_config, final_ud_config),
+                        task_id=celery_id))
             return app_deployment
         except serializers.ValidationError as ve:
             raise ve
@@ -282,15 +380,220 @@ class DeploymentSerializer(serializers.ModelSerializer):
                 {"error": "An exception creating a deployment of %s: %s)" %
                  (version.backend_component_name, e)})
 
+    def _create_async(self, validated_data):
+        """
+        Create a deployment without contacting the cloud.
+
+        The app config is validated by the plugin as the first step of the
+        launch task instead, which fails with the validation errors if the
+        config is invalid.
+        """
+        name = validated_data.get("name")
+        cloud = validated_data.get("target_cloud")
+        version = validated_data.get("application_version")
+        cloud_version_config = models.ApplicationVersionCloudConfig.objects.get(
+            application_version=version.id, cloud=cloud.slug)
+        request = self.context.get('view').request
+        credentials = view_helpers.get_credentials(cloud, request)
+        try:
+            merged_app_config = jsonmerge.merge(
+                cloud_version_config.get_merged_config(),
+                validated_data.get("config_app", {}))
+        except Exception as e:
+            raise serializers.ValidationError(
+                {"error": "An exception creating a deployment of %s: %s)" %
+                 (version.backend_component_name, e)})
+        celery_id = str(uuid.uuid4())
+        with transaction.atomic():
+            app_deployment = models.ApplicationDeployment.objects.create(
+                name=name, application_version=version, target_cloud=cloud,
+                owner_id=request.user.id,
+                application_config=merged_app_config,
+                credentials_id=credentials.get('id') or None)
+            self.log_usage(cloud_version_config, app_deployment,
+                           merged_app_config, request.user)
+            models.ApplicationDeploymentTask.objects.create(
+                action=models.ApplicationDeploymentTask.LAUNCH,
+                deployment=app_deployment, celery_id=celery_id)
+            # Dispatch once committed so that a quick failure still finds
+            # the task row to record its result against
+            transaction.on_commit(lambda: tasks.create_appliance.apply_async(
+                (name, cloud_version_config.pk, credentials,
+                 merged_app_config, None),
+                {'validate': True}, task_id=celery_id))
+        return app_deployment
+
     def update(self, instance, validated_data):
         instance.archived = validated_data.get('archived', instance.archived)
         instance.save()
         return instance
 
-    def log_usage(self, app_version_cloud_config, app_deployment, sanitised_app_config, user):
-        u = models.Usage(app_version_cloud_config=app_version_cloud_config,
-                         app_deployment=app_deployment, app_config=sanitised_app_config, user=user)
-        u.save()
+    def log_usage(self, app_version_cloud_config, app_deployment, app_config, user):
+        usage.record(app_version_cloud_config, app_deployment, app_config, user)
+
+
+class ArchivedDeploymentTaskSerializer(serializers.ModelSerializer):
+    result = serializers.JSONField(read_only=True)
+
+    class Meta:
+        model = models.ArchivedDeploymentTask
+        exclude = ('deployment',)
+
+
+class ArchivedDeploymentSerializer(serializers.ModelSerializer):
+    owner = serializers.CharField(read_only=True)
+    provider_settings = serializers.JSONField(read_only=True)
+    application_config = serializers.JSONField(read_only=True)
+    app_version_details = DeploymentAppVersionSerializer(
+        source="application_version", read_only=True)
+    tasks = ArchivedDeploymentTaskSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = models.ArchivedDeployment
+        fields = ('id', 'name', 'application_version', 'target_cloud',
+                  'provider_settings', 'application_config', 'added',
+                  'updated', 'archived_at', 'owner', 'app_version_details',
+                  'credentials', 'state', 'instance_id', 'public_ip',
+                  'application_url', 'health_status', 'tasks')
+
+
+class DeploymentBulkCreateSerializer(serializers.Serializer):
+    """
+    Create many deployments of the same application with the same config.
+
+    The launch config is merged and validated, and the cloud provider
+    created, once for all deployments. Deployments, their LAUNCH tasks and
+    usage records are inserted in bulk and the launches dispatched as a
+    single Celery group.
+    """
+    MAX_DEPLOYMENTS = 200
+
+    names = serializers.ListField(
+        child=serializers.CharField(max_length=60), min_length=1,
+        max_length=MAX_DEPLOYMENTS)
+    application = serializers.CharField()
+    application_version = serializers.CharField()
+    target_cloud = serializers.PrimaryKeyRelatedField(
+        queryset=cb_models.Cloud.objects.all())
+    config_app = serializers.JSONField(required=False)
+
+    def validate(self, attrs):
+        try:
+            version = models.ApplicationVersion.objects.get(
+                application=attrs['application'],
+                version=attrs['application_version'])
+            attrs['cloud_version_config'] = (
+                models.ApplicationVersionCloudConfig.objects.select_related(
+                    'application_version').get(
+                        application_version=version,
+                        cloud=attrs['target_cloud']))
+        except models.ApplicationVersion.DoesNotExist:
+            raise serializers.ValidationError(
+                {"application_version": "No version %s of application %s." %
+                 (attrs['application_version'], attrs['application'])})
+        except models.ApplicationVersionCloudConfig.DoesNotExist:
+            raise serializers.ValidationError(
+                {"target_cloud": "Version %s of %s is not available on "
+                 "cloud %s." % (attrs['application_version'],
+                                attrs['application'], attrs['target_cloud'])})
+        return attrs
+
+    def _get_user_data(self, handler, provider, names, cloud_config,
+                       app_config):
+        """
+        Validate the app config and build the user data of each name.
+
+        Plugins may contact the cloud while validating so this is done
+        before any rows are written.
+        """
+        # Plugins may add defaults to the config they validate so only the
+        # first call works on the config that gets stored and launched.
+        user_data = {names[0]: handler.validate_app_config(
+            provider, names[0], cloud_config, app_config)}
+        for name in names[1:]:
+            if name not in user_data:
+                user_data[name] = handler.validate_app_config(
+                    provider, name, cloud_config, copy.deepcopy(app_config))
+        return user_data
+
+    def create(self, validated_data):
+        """
+        Create the deployments and dispatch their launch.
+
+        :rtype: ``list`` of :class:`.models.ApplicationDeployment`
+        :return: The created deployments, with their LAUNCH task loaded.
+        """
+        names = validated_data['names']
+        cloud = validated_data['target_cloud']
+        cloud_version_config = validated_data['cloud_version_config']
+        version = cloud_version_config.application_version
+        view = self.context.get('view')
+        request = view.request
+        credentials = view_helpers.get_credentials(cloud, request)
+        provider = providers.get_cloud_provider(cloud, credentials)
+        try:
+            handler = util.import_class(version.backend_component_name)()
+            app_config = jsonmerge.merge(
+                cloud_version_config.get_merged_config(),
+                validated_data.get("config_app", {}))
+            user_data = self._get_user_data(
+                handler, provider, names,
+                util.serialize_cloud_config(cloud_version_config), app_config)
+        except serializers.ValidationError as ve:
+            raise ve
+        except Exception as e:
+            raise serializers.ValidationError(
+                {"error": "An exception creating deployments of %s: %s)" %
+                 (version.backend_component_name, e)})
+        deployments = [models.ApplicationDeployment(
+            owner=request.user, name=name, application_version=version,
+            target_cloud=cloud, application_config=app_config,
+            credentials_id=credentials.get('id') or None) for name in names]
+        with transaction.atomic():
+            if connection.features.can_return_ids_from_bulk_insert:
+                models.ApplicationDeployment.objects.bulk_create(deployments)
+            else:
+                for deployment in deployments:
+                    deployment.save()
+            launch_tasks = [models.ApplicationDeploymentTask(
+                action=models.ApplicationDeploymentTask.LAUNCH,
+                deployment=deployment, celery_id=str(uuid.uuid4()))
+                for deployment in deployments]
+            models.ApplicationDeploymentTask.objects.bulk_create(launch_tasks)
+            for deployment in deployments:
+                usage.record(cloud_version_config, deployment, app_config,
+                             request.user)
+            # Dispatch once committed so that workers find the task rows
+            signatures = [tasks.create_appliance.s(
+                deployment.name, cloud_version_config.pk, credentials,
+                app_config, user_data[deployment.name]).set(
+                    task_id=task.celery_id)
+                for deployment, task in zip(deployments, launch_tasks)]
+            transaction.on_commit(lambda: group(signatures).apply_async())
+        return list(models.ApplicationDeployment.objects.filter(
+            pk__in=[deployment.pk for deployment in deployments]).order_by(
+                'id').with_task_summary())
+
+
+class DeploymentBulkTaskSerializer(serializers.Serializer):
+    """Apply an action to many of the user's deployments at once."""
+    MAX_DEPLOYMENTS = 500
+
+    action = serializers.ChoiceField(
+        choices=[choice for choice in
+                 models.ApplicationDeploymentTask.ACTION_CHOICES
+                 if choice[0] in tasks.ACTION_TASKS])
+    deployments = serializers.ListField(
+        child=serializers.IntegerField(), required=False,
+        help_text="IDs of the deployments to act on. Defaults to all "
+                  "deployments matching the request's filters.")
+
+
+class DeploymentActionTaskSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = models.ApplicationDeploymentTask
+        fields = ('id', 'deployment', 'celery_id', 'action', 'added')
 
 
 class PublicKeySerializer(serializers.HyperlinkedModelSerializer):
@@ -1,10 +1,25 @@
 """App-wide Django signals."""
+from celery import states
+from celery.signals import task_postrun
 from celery.utils.log import get_task_logger
 
+from django.core.signals import request_finished
+from django.db import transaction
+from django.db.models.signals import m2m_changed
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.db.models.signals import pre_save
 from django.dispatch import receiver
 from django.dispatch import Signal
 
+from djcloudbridge import models as cb_models
+
+from . import events
 from . import models
+from . import providers
+from . import search
+from . import usage
+from .backend_plugins import cloudman_app
 
 log = get_task_logger(__name__)
 
@@ -28,3 +43,151 @@ def delete_old_tasks(sender, deployment, **kwargs):
         log.debug('Deleting old health task %s from deployment %s',
                   old_task.id, deployment.name)
         old_task.delete()
+
+
+@receiver(post_save, sender=models.Application)
+def refresh_application_merged_configs(sender, instance, **kwargs):
+    """Refresh stored merged launch configs when an application is saved."""
+    models.ApplicationVersionCloudConfig.refresh_merged_configs(
+        application_version__application=instance)
+
+
+@receiver(post_save, sender=models.ApplicationVersion)
+def refresh_version_merged_configs(sender, instance, **kwargs):
+    """Refresh stored merged launch configs when a version is saved."""
+    models.ApplicationVersionCloudConfig.refresh_merged_configs(
+        application_version=instance)
+
+
+# Models whose changes alter the content of the application catalog
+CATALOG_MODELS = (models.Application, models.AppCategory,
+                  models.ApplicationVersion,
+                  models.ApplicationVersionCloudConfig, models.Image,
+                  cb_models.Cloud)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def bump_catalog_revision(sender, **kwargs):
+    """Bump the catalog revision when any catalog object changes."""
+    if issubclass(sender, CATALOG_MODELS):
+        models.CatalogRevision.bump()
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def clear_pooled_providers(sender, instance, **kwargs):
+    """
+    Drop the pooled providers of a cloud once its settings change.
+
+    This only frees them in the saving process; other processes stop using
+    them because the cloud settings are part of the pool key.
+    """
+    if issubclass(sender, cb_models.Cloud):
+        providers.provider_pool.clear(instance.slug)
+
+
+@receiver(pre_save, sender=cb_models.OpenStackCredentials)
+@receiver(post_delete, sender=cb_models.OpenStackCredentials)
+def invalidate_ec2_cache(sender, instance, **kwargs):
+    """Drop the EC2 info cached for OpenStack credentials that change."""
+    if kwargs.get('signal') == pre_save:
+        instance = sender.objects.filter(pk=instance.pk).first()
+    if instance:
+        cloudman_app.invalidate_credentials_ec2_cache(instance)
+
+
+@receiver(post_save, sender=models.Application)
+def update_application_search_index(sender, instance, **kwargs):
+    """Update the search index entry of a saved application."""
+    search.update_index(instance)
+
+
+@receiver(post_delete, sender=models.Application)
+def remove_application_search_index(sender, instance, **kwargs):
+    """Remove a deleted application from the search index."""
+    search.remove_from_index(instance)
+
+
+@receiver(m2m_changed, sender=models.Application.category.through)
+def update_categorized_search_index(sender, instance, action, reverse,
+                                    pk_set, **kwargs):
+    """
+    Update the search index and bump the catalog revision when application
+    categories change.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    models.CatalogRevision.bump()
+    if not reverse:
+        search.update_index(instance)
+    else:
+        # Categories were (un)assigned from the category side
+        applications = models.Application.objects.filter(pk__in=pk_set or [])
+        for application in applications:
+            search.update_index(application)
+
+
+@receiver(post_save, sender=models.AppCategory)
+@receiver(post_delete, sender=models.AppCategory)
+def update_category_search_index(sender, instance, **kwargs):
+    """Update the search index of applications when a category changes."""
+    applications = models.Application.objects.all()
+    if kwargs.get('signal') == post_save:
+        applications = applications.filter(category=instance)
+    for application in applications:
+        search.update_index(application)
+
+
+@receiver(post_save, sender=models.ApplicationVersionCloudConfig)
+def refresh_cloud_config_launchability(sender, instance, **kwargs):
+    """Index a saved cloud config as launchable on its cloud."""
+    models.LaunchableApplication.refresh(pk=instance.pk)
+
+
+@receiver(post_save, sender=models.Application)
+def refresh_application_launchability(sender, instance, **kwargs):
+    """Refresh launchability of an application, e.g., if it went LIVE."""
+    models.LaunchableApplication.refresh(
+        application_version__application=instance)
+
+
+@receiver(post_save, sender=models.ApplicationVersion)
+def refresh_version_launchability(sender, instance, **kwargs):
+    """Refresh launchability of a saved application version."""
+    models.LaunchableApplication.refresh(application_version=instance)
+
+
+@receiver(post_save, sender=models.CloudImage)
+def refresh_image_launchability(sender, instance, **kwargs):
+    """Refresh launchability of the cloud configs using a saved image."""
+    models.LaunchableApplication.refresh(image=instance)
+
+
+@task_postrun.connect
+def update_deployment_state(sender=None, task_id=None, retval=None,
+                            state=None, **kwargs):
+    """
+    Record the outcome of a finished deployment task.
+
+    The task's final status and result are frozen into the task table and
+    the deployment state columns are updated, in one transaction.
+    """
+    if state not in states.READY_STATES:
+        return
+    task = models.ApplicationDeploymentTask.objects.select_related(
+        'deployment').filter(celery_id=task_id).first()
+    if task:
+        deployment = task.deployment
+        with transaction.atomic():
+            task.freeze_result(state, retval)
+            deployment.update_from_task(task.action, state, retval)
+        events.publish(deployment, 'finished',
+                       events.get_finished_data(task),
+                       events.get_finished_event_id(task))
+
+
+@receiver(request_finished)
+def flush_usage(sender, **kwargs):
+    """Hand buffered usage events over for recording once they are due."""
+    usage.flush_if_due()
@@ -0,0 +1,95 @@
+"""
+Bulk lookups of Celery task state.
+
+Looking up the state of a single task costs one result backend round trip.
+These helpers fetch the state of many tasks at once: with a single
+``TaskResult`` query for the ``django-db`` backend or a single ``MGET`` for
+key-value backends such as Redis. Other backends are queried per task.
+"""
+import logging
+
+from celery import current_app
+from celery import states
+from celery.backends.base import KeyValueStoreBackend
+from django_celery_results.backends.database import DatabaseBackend
+
+log = logging.getLogger(__name__)
+
+
+def _pending_meta(task_id):
+    # What Celery reports for tasks the backend knows nothing about
+    return {'task_id': task_id, 'status': states.PENDING, 'result': None,
+            'traceback': None, 'children': []}
+
+
+def _get_database_task_metas(backend, task_ids):
+    metas = {}
+    for obj in backend.TaskModel._default_manager.filter(
+            task_id__in=task_ids):
+        metas[obj.task_id] = backend.meta_from_decoded({
+            'task_id': obj.task_id,
+            'status': obj.status,
+            'result': backend.decode_content(obj, obj.result),
+            'traceback': obj.traceback,
+            'date_done': obj.date_done})
+    return metas
+
+
+def _get_key_value_task_metas(backend, task_ids):
+    values = backend.mget([backend.get_key_for_task(task_id)
+                           for task_id in task_ids])
+    return {task_id: backend.decode_result(value)
+            for task_id, value in zip(task_ids, values) if value}
+
+
+def get_task_metas(task_ids, backend=None):
+    """
+    Return the Celery task meta of each of the supplied task IDs.
+
+    :type task_ids: ``list`` of ``str``
+    :param task_ids: Celery IDs of the tasks to look up.
+
+    :type backend: :class:`celery.backends.base.Backend`
+    :param backend: Result backend to query. Defaults to the backend of the
+                    current Celery app.
+
+    :rtype: ``dict``
+    :return: A dict mapping each task ID to its task meta, as returned by
+             the backend's ``get_task_meta()``.
+    """
+    task_ids = list(set(task_ids))
+    if not task_ids:
+        return {}
+    backend = backend or current_app.backend
+    metas = None
+    if isinstance(backend, DatabaseBackend):
+        metas = _get_database_task_metas(backend, task_ids)
+    elif isinstance(backend, KeyValueStoreBackend):
+        try:
+            metas = _get_key_value_task_metas(backend, task_ids)
+        except NotImplementedError:
+            log.debug("%s does not support MGET", type(backend).__name__)
+    if metas is None:
+        return {task_id: backend.get_task_meta(task_id)
+                for task_id in task_ids}
+    return {task_id: metas.get(task_id) or _pending_meta(task_id)
+            for task_id in task_ids}
+
+
+def forget_task_metas(task_ids, backend=None):
+    """
+    Remove the supplied tasks from the result backend.
+
+    Results in the ``django-db`` backend are deleted with a single query;
+    other backends forget each task in turn.
+    """
+    task_ids = list(set(task_ids))
+    if not task_ids:
+        return
+    backend = backend or current_app.backend
+    if isinstance(backend, DatabaseBackend):
+        backend.TaskModel._default_manager.filter(
+            task_id__in=task_ids).delete()
+    else:
+        for task_id in task_ids:
+            backend.forget(task_id)
@@ -1,16 +1,25 @@
 """Tasks to be executed asynchronously (via Celery)."""
-import copy
-import json
+from datetime import timedelta
 import logging
+import time
 
+from celery import states
 from celery.app import shared_task
 from celery.exceptions import SoftTimeLimitExceeded
 from celery.result import AsyncResult
 from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.serializers import ValidationError
 
-from djcloudbridge import domain_model
+from . import archive
+from . import events
 from . import models
+from . import providers
 from . import signals
+from . import task_meta
+from . import usage
 from . import util
 
 log = get_task_logger('cloudlaunch')
@@ -28,6 +37,8 @@ def migrate_launch_task(task_id):
     Task result may contain temporary info that we don't want to keep. This
     task is intended to be called some time after the initial task has run to
     migrate the info we do want to keep to a model table.
+
+    Superseded by ``migrate_task_results``; kept for already queued calls.
     """
     adt = models.ApplicationDeploymentTask.objects.get(celery_id=task_id)
     task = AsyncResult(task_id)
@@ -35,28 +46,42 @@ def migrate_launch_task(task_id):
     adt.status = task_meta.get('status')
     adt.traceback = task_meta.get('traceback')
     adt.celery_id = None
-    sanitized_result = copy.deepcopy(task_meta['result'])
-    if sanitized_result.get('cloudLaunch', {}).get('keyPair', {}).get(
-            'material'):
-        sanitized_result['cloudLaunch']['keyPair']['material'] = None
-    adt.result = json.dumps(sanitized_result)
+    sanitized_result = adt.sanitise_result(task_meta['result'])
+    adt.result = sanitized_result
     adt.save()
+    # Covers launches that completed before their deployment tracked state
+    if adt.deployment.state == models.ApplicationDeployment.LAUNCHING:
+        adt.deployment.update_from_task(adt.action, adt.status,
+                                        sanitized_result)
     task.forget()
 
 
 @shared_task(expires=120)
 def create_appliance(name, cloud_version_config_id, credentials, app_config,
-                     user_data):
-    """Call the appropriate app plugin and initiate the app launch process."""
+                     user_data, validate=False):
+    """
+    Call the appropriate app plugin and initiate the app launch process.
+
+    If ``validate`` is set, the app config has not been validated yet. The
+    plugin validates it first and builds the user data, and the task fails
+    with a ``LaunchValidationError`` if the config is invalid.
+    """
+    provider = None
     try:
         log.debug("Creating appliance %s", name)
         cloud_version_conf = models.ApplicationVersionCloudConfig.objects.get(
             pk=cloud_version_config_id)
         plugin = util.import_class(
             cloud_version_conf.application_version.backend_component_name)()
-        provider = domain_model.get_cloud_provider(
+        provider = providers.get_cloud_provider(
             cloud_version_conf.cloud, credentials)
         cloud_config = util.serialize_cloud_config(cloud_version_conf)
+        if validate:
+            try:
+                user_data = plugin.validate_app_config(
+                    provider, name, cloud_config, app_config)
+            except ValidationError as ve:
+                raise util.LaunchValidationError(ve.detail)
         # TODO: Add keys (& support) for using existing, user-supplied hosts
         provider_config = {'cloud_provider': provider,
                            'cloud_config': cloud_config,
@@ -64,19 +89,22 @@ def create_appliance(name, cloud_version_config_id, credentials, app_config,
         log.info("Provider_config: %s", provider_config)
         log.info("Creating app %s with the follwing app config: %s \n and "
                  "cloud config: %s", name, app_config, provider_config)
-        deploy_result = plugin.deploy(name, Task(create_appliance), app_config,
-                                      provider_config)
-        # Schedule a task to migrate result one hour from now
-        migrate_launch_task.apply_async([create_appliance.request.id],
-                                        countdown=3600)
-        return deploy_result
+        # The result is migrated by ``migrate_task_results`` after an hour
+        return plugin.deploy(name, Task(create_appliance), app_config,
+                             provider_config)
     except SoftTimeLimitExceeded:
         msg = "Create appliance task time limit exceeded; stopping the task."
         log.warning(msg)
         raise Exception(msg)
+    except util.LaunchValidationError as exc:
+        log.info("Invalid app config for appliance %s: %s", name, exc.detail)
+        raise
     except Exception as exc:
         msg = "Create appliance task failed: %s" % str(exc)
         log.error(msg)
+        if provider:
+            providers.discard_cloud_provider(cloud_version_conf.cloud,
+                                             credentials)
         raise Exception(msg) from exc
 
 
@@ -97,19 +125,120 @@ def _get_app_plugin(deployment):
 
 @shared_task(time_limit=120)
 def migrate_task_result(task_id):
-    """Migrate task results to the database from the broker table."""
+    """
+    Migrate task results to the database from the broker table.
+
+    Superseded by ``migrate_task_results``; kept for already queued calls.
+    """
     log.debug("Migrating task %s result to the DB" % task_id)
     adt = models.ApplicationDeploymentTask.objects.get(celery_id=task_id)
     task = AsyncResult(task_id)
     task_meta = task.backend.get_task_meta(task.id)
     adt.celery_id = None
     adt.status = task_meta.get('status')
-    adt.result = json.dumps(task_meta.get('result'))
+    if task_meta.get('status') == states.FAILURE:
+        adt.result = adt.get_failure_result(task_meta.get('result'))
+    else:
+        adt.result = task_meta.get('result')
     adt.traceback = task_meta.get('traceback')
     adt.save()
     task.forget()
 
 
+def get_result_retention(action):
+    """
+    Return how long, in seconds, the result of a finished task is kept in
+    the Celery result backend.
+
+    LAUNCH results hold the key pair material of the deployment so they are
+    kept for ``CLOUDLAUNCH_LAUNCH_RESULT_RETENTION`` seconds (an hour by
+    default) for users to fetch it. Other results are only kept for
+    ``CLOUDLAUNCH_TASK_RESULT_RETENTION`` seconds (a minute by default).
+    """
+    if action == models.ApplicationDeploymentTask.LAUNCH:
+        return getattr(settings, 'CLOUDLAUNCH_LAUNCH_RESULT_RETENTION', 3600)
+    return getattr(settings, 'CLOUDLAUNCH_TASK_RESULT_RETENTION', 60)
+
+
+def _migrate_task_batch(deployment_tasks):
+    """
+    Move the results of the supplied tasks out of the result backend.
+
+    :rtype: ``int``
+    :return: The number of tasks migrated. Tasks that have not finished yet
+             are left alone.
+    """
+    ADT = models.ApplicationDeploymentTask
+    # Results are normally frozen as tasks finish; look up the others
+    metas = task_meta.get_task_metas(
+        [task.celery_id for task in deployment_tasks
+         if task._status not in states.READY_STATES])
+    migrated = []
+    for task in deployment_tasks:
+        if task._status not in states.READY_STATES:
+            meta = metas[task.celery_id]
+            if meta['status'] not in states.READY_STATES:
+                continue
+            task._status = meta['status']
+            if meta['status'] == states.FAILURE:
+                task._result = ADT.get_failure_result(meta['result'])
+            else:
+                task._result = ADT.sanitise_result(meta['result'])
+            task.traceback = meta.get('traceback')
+            if (task.action == ADT.LAUNCH and task.deployment.state ==
+                    models.ApplicationDeployment.LAUNCHING):
+                task.deployment.update_from_task(
+                    task.action, meta['status'], meta['result'])
+        migrated.append(task)
+    celery_ids = [task.celery_id for task in migrated]
+    for task in migrated:
+        task.celery_id = None
+    ADT.objects.bulk_update(
+        migrated, ['celery_id', '_status', '_result', 'traceback'])
+    task_meta.forget_task_metas(celery_ids)
+    return len(migrated)
+
+
+@shared_task(time_limit=600)
+def migrate_task_results(batch_size=500):
+    """
+    Migrate the results of finished tasks out of the result backend.
+
+    Run periodically by celery beat. Tasks that finished longer ago than
+    their retention period (see ``get_result_retention``) are migrated in
+    batches: each batch is saved with one ``bulk_update`` and its results
+    are deleted from the result backend at once.
+
+    :rtype: ``dict``
+    :return: Throughput metrics of the run.
+    """
+    ADT = models.ApplicationDeploymentTask
+    started = time.monotonic()
+    now = timezone.now()
+    launch_cutoff = now - timedelta(seconds=get_result_retention(ADT.LAUNCH))
+    cutoff = now - timedelta(seconds=get_result_retention(None))
+    candidates = ADT.objects.filter(celery_id__isnull=False).filter(
+        Q(action=ADT.LAUNCH, updated__lt=launch_cutoff) |
+        (~Q(action=ADT.LAUNCH) & Q(updated__lt=cutoff))).select_related(
+            'deployment').order_by('id')
+    migrated = batches = 0
+    last_id = 0
+    while True:
+        batch = list(candidates.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        last_id = batch[-1].id
+        migrated += _migrate_task_batch(batch)
+        batches += 1
+    elapsed = time.monotonic() - started
+    metrics = {'migrated': migrated, 'batches': batches,
+               'seconds': round(elapsed, 3),
+               'per_second': round(migrated / elapsed, 1) if elapsed else 0}
+    log.info("Migrated %(migrated)s task results in %(batches)s batches "
+             "(%(seconds)ss, %(per_second)s/s)", metrics)
+    return metrics
+
+
 def _serialize_deployment(deployment):
     """
     Extract appliance info for the supplied deployment and serialize it.
@@ -119,15 +248,17 @@ def _serialize_deployment(deployment):
 
     :rtype: ``str``
     :return: Serialized info about the appliance deployment, which corresponds
-             to the result of the LAUNCH task.
+             to the result of the LAUNCH task, and the ID of its instance.
     """
     launch_task = deployment.tasks.filter(
         action=models.ApplicationDeploymentTask.LAUNCH).first()
     if launch_task:
         return {'launch_status': launch_task.status,
-                'launch_result': launch_task.result}
+                'launch_result': launch_task.result,
+                'instance_id': deployment.instance_id}
     else:
-        return {'launch_status': None, 'launch_result': {}}
+        return {'launch_status': None, 'launch_result': {},
+                'instance_id': None}
 
 
 @shared_task(bind=True, time_limit=60, expires=300)
@@ -140,26 +271,26 @@ def health_check(self, deployment_id, credentials):
     by default, the health reflects the status of the cloud instance by
     querying the cloud provider.
     """
+    provider = None
     try:
         deployment = models.ApplicationDeployment.objects.get(pk=deployment_id)
         log.debug("Checking health of deployment %s", deployment.name)
         plugin = _get_app_plugin(deployment)
         dpl = _serialize_deployment(deployment)
-        provider = domain_model.get_cloud_provider(deployment.target_cloud,
-                                                   credentials)
+        provider = providers.get_cloud_provider(deployment.target_cloud,
+                                                credentials)
         result = plugin.health_check(provider, dpl)
     except Exception as e:
         msg = "Health check failed: %s" % str(e)
         log.error(msg)
+        if provider:
+            providers.discard_cloud_provider(deployment.target_cloud,
+                                             credentials)
         raise Exception(msg) from e
     finally:
         # We only keep the two most recent health check task results so delete
         # any older ones
         signals.health_check.send(sender=None, deployment=deployment)
-    # Schedule a task to migrate results right after task completion
-    # Do this as a separate task because until this task completes, we
-    # cannot obtain final status or traceback.
-    migrate_task_result.apply_async([self.request.id], countdown=1)
     return result
 
 
@@ -168,22 +299,22 @@ def restart_appliance(self, deployment_id, credentials):
     """
     Restarts this appliances
     """
+    provider = None
     try:
         deployment = models.ApplicationDeployment.objects.get(pk=deployment_id)
         log.debug("Performing restart on deployment %s", deployment.name)
         plugin = _get_app_plugin(deployment)
         dpl = _serialize_deployment(deployment)
-        provider = domain_model.get_cloud_provider(deployment.target_cloud,
-                                                   credentials)
+        provider = providers.get_cloud_provider(deployment.target_cloud,
+                                                credentials)
         result = plugin.restart(provider, dpl)
     except Exception as e:
         msg = "Restart task failed: %s" % str(e)
         log.error(msg)
+        if provider:
+            providers.discard_cloud_provider(deployment.target_cloud,
+                                             credentials)
         raise Exception(msg) from e
-    # Schedule a task to migrate results right after task completion
-    # Do this as a separate task because until this task completes, we
-    # cannot obtain final status or traceback.
-    migrate_task_result.apply_async([self.request.id], countdown=1)
     return result
 
 
@@ -194,13 +325,14 @@ def delete_appliance(self, deployment_id, credentials):
     If successful, will also mark the supplied ``deployment`` as
     ``archived`` in the database.
     """
+    provider = None
     try:
         deployment = models.ApplicationDeployment.objects.get(pk=deployment_id)
         log.debug("Performing delete on deployment %s", deployment.name)
         plugin = _get_app_plugin(deployment)
         dpl = _serialize_deployment(deployment)
-        provider = domain_model.get_cloud_provider(deployment.target_cloud,
-                                                   credentials)
+        provider = providers.get_cloud_provider(deployment.target_cloud,
+                                                credentials)
         result = plugin.delete(provider, dpl)
         if result is True:
             deployment.archived = True
@@ -208,14 +340,51 @@ def delete_appliance(self, deployment_id, credentials):
     except Exception as e:
         msg = "Delete task failed: %s" % str(e)
         log.error(msg)
+        if provider:
+            providers.discard_cloud_provider(deployment.target_cloud,
+                                             credentials)
         raise Exception(msg) from e
-    # Schedule a task to migrate results right after task completion
-    # Do this as a separate task because until this task completes, we
-    # cannot obtain final status or traceback.
-    migrate_task_result.apply_async([self.request.id], countdown=1)
     return result
 
 
+@shared_task(time_limit=300)
+def record_usage(events):
+    """Store a batch of usage events buffered by ``usage.record()``."""
+    log.debug("Recording %s usage events", len(events))
+    return usage.save(events)
+
+
+@shared_task(time_limit=300)
+def purge_idempotency_keys():
+    """
+    Delete expired idempotency keys.
+
+    Expired keys are ignored when requests are handled; this task is run
+    hourly by celery beat to keep their table small.
+    """
+    deleted = models.IdempotencyKey.purge_expired()
+    log.debug("Purged %s expired idempotency keys", deleted)
+    return deleted
+
+
+@shared_task(time_limit=3600)
+def archive_deployments():
+    """
+    Move old archived deployments to the archive tables.
+
+    Run daily by celery beat.
+    """
+    return archive.archive_deployments()
+
+
+# Tasks performing each action that can be requested on a running deployment
+ACTION_TASKS = {
+    models.ApplicationDeploymentTask.HEALTH_CHECK: health_check,
+    models.ApplicationDeploymentTask.RESTART: restart_appliance,
+    models.ApplicationDeploymentTask.DELETE: delete_appliance,
+}
+
+
 class Task(object):
     """
     An abstraction class for handling task actions.
@@ -241,4 +410,12 @@ class Task(object):
         @type  meta: ``dict``
         @param meta: State meta-data.
         """
-        self.task.update_state(state=state, meta=meta)
+        self.task.update_state(task_id=task_id, state=state, meta=meta)
+        # Push the update to clients following the deployment's progress
+        adt = models.ApplicationDeploymentTask.objects.select_related(
+            'deployment').filter(
+                celery_id=task_id or self.task.request.id).first()
+        if adt:
+            events.publish(adt.deployment, 'progress',
+                           {'task': adt.id, 'action': adt.action,
+                            'state': state, 'meta': meta})
@@ -1,50 +1,53 @@
+from datetime import timedelta
+import gzip
 import json
+import os
+import tempfile
+import threading
+from unittest.mock import Mock
 from unittest.mock import patch
 import uuid
 
-from celery.result import AsyncResult
+from celery.signals import task_postrun
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
 from django.urls import reverse
+from django.utils import timezone
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django_celery_results.models import TaskResult
+from djcloudbridge import domain_model
 from djcloudbridge import models as cb_models
 from djcloudbridge import serializers as cb_serializers
 from rest_framework import status
+from rest_framework.serializers import ValidationError
 from rest_framework.test import APITestCase
 
+from . import archive
+from . import catalog
+from . import events
+from . import providers
+from . import search
 from . import tasks
-from .models import (Application,
+from . import usage
+from . import util
+from . import views
+from .backend_plugins import cloudman_app
+from .models import (AppCategory,
+                     Application,
                      ApplicationDeployment,
                      ApplicationVersion,
                      ApplicationVersionCloudConfig,
                      ApplicationDeploymentTask,
-                     CloudImage)
+                     ArchivedDeployment,
+                     CatalogRevision,
+                     CloudImage,
+                     DeploymentInstance,
+                     Usage)
 
 
 # Create your tests here.
-class MockedCeleryTaskCall:
-    """Mock a call to a celery task."""
-
-    def __init__(self, task, *args, **kwargs):
-        """Specify task, as string, and expected arguments to be passed."""
-        self.task = task
-        self.args = args
-        self.kwargs = kwargs
-
-    def __enter__(self):
-        self.patcher = patch(self.task)
-        self.mocked_task = self.patcher.start()
-        celery_id = str(uuid.uuid4())
-        return_value = AsyncResult(celery_id)
-        self.mocked_task.return_value = return_value
-        return return_value
-
-    def __exit__(self, *exc):
-        self.patcher.stop()
-        self.mocked_task.assert_called_with(
-            *self.args, **self.kwargs)
-        return False
-
-
 class BaseAPITestCase(APITestCase):
     """Base class for all CloudLaunch API testcases."""
     def assertResponse(self, response, status=None, data_contains=None):
@@ -53,6 +56,12 @@ class BaseAPITestCase(APITestCase):
         if data_contains:
             self.assertDictContains(response.data, data_contains)
 
+    def run_commit_hooks(self):
+        """Run the on_commit callbacks, which TestCase never runs."""
+        callbacks, connection.run_on_commit = connection.run_on_commit, []
+        for _, callback in callbacks:
+            callback()
+
     def assertDictContains(self, dict1, dict2):
         for key in dict2:
             self.assertTrue(key in dict1)
@@ -132,6 +141,298 @@ class ApplicationTests(APITestCase):
                          'HelloWorldDesc2')
 
 
+class ApplicationCatalogETagTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.application = Application.objects.create(
+            name="Ubuntu",
+            status=Application.LIVE,
+        )
+
+    def test_not_modified_when_etag_matches(self):
+        """Test a matching If-None-Match header results in a 304."""
+        url = reverse('application-list')
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        response = self.client.get(url, format='json',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertFalse(response.content)
+
+    def test_etag_changes_with_catalog(self):
+        """Test saving a catalog object invalidates previous ETags."""
+        url = reverse('application-detail', args=[self.application.slug])
+        etag = self.client.get(url, format='json')['ETag']
+        self.application.summary = "Updated summary"
+        self.application.save()
+        response = self.client.get(url, format='json',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['summary'], "Updated summary")
+
+    def test_etag_changes_with_categories(self):
+        """Test (un)assigning categories invalidates previous ETags."""
+        url = reverse('application-list')
+        etag = self.client.get(url, format='json')['ETag']
+        category = AppCategory.objects.create(name=AppCategory.VM)
+        response = self.client.get(url, format='json',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        self.application.category.add(category)
+        response = self.client.get(url, format='json',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ApplicationSearchTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.galaxy = Application.objects.create(
+            name="Galaxy",
+            status=Application.LIVE,
+            summary="Web-based platform for data intensive research",
+            description="Analyze genomics datasets in the cloud.",
+        )
+        self.ubuntu = Application.objects.create(
+            name="Ubuntu",
+            status=Application.LIVE,
+            summary="Plain Ubuntu virtual machine",
+            description="Use it for genomics, Galaxy or anything else.",
+            maintainer="Canonical",
+        )
+
+    def _search(self, terms):
+        response = self.client.get(reverse('application-list'),
+                                   {'search': terms})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [app['slug'] for app in response.json()['results']]
+
+    def test_search_ranks_matches(self):
+        """Test name matches rank above description matches."""
+        self.assertEqual(self._search('platform'), ['galaxy'])
+        self.assertEqual(self._search('galaxy'), ['galaxy', 'ubuntu'])
+        self.assertEqual(set(self._search('genomic')), {'galaxy', 'ubuntu'})
+        self.assertEqual(self._search('genomics virtual'), ['ubuntu'])
+        self.assertEqual(self._search('canonical'), ['ubuntu'])
+        self.assertEqual(self._search('nonexistent'), [])
+
+    def test_search_matches_prefixes(self):
+        """Test each term matches as a prefix on every database."""
+        self.assertEqual(self._search('gal'), ['galaxy', 'ubuntu'])
+        self.assertEqual(self._search('gal plat'), ['galaxy'])
+        self.assertEqual(search._get_tsquery(['gal', "o'brien"]),
+                         "'gal':* & 'o''brien':*")
+
+    def test_search_index_maintained(self):
+        """Test the index follows application and category changes."""
+        category = AppCategory.objects.create(name=AppCategory.SCALABLE)
+        self.galaxy.category.add(category)
+        self.assertEqual(self._search('scalable'), ['galaxy'])
+        self.galaxy.summary = "Scalable analysis"
+        self.galaxy.category.remove(category)
+        self.galaxy.save()
+        self.assertEqual(self._search('platform'), [])
+        self.assertEqual(self._search('scalable analysis'), ['galaxy'])
+        self.galaxy.delete()
+        self.assertEqual(self._search('genomics'), ['ubuntu'])
+
+    def test_search_with_cursor_pagination(self):
+        """Test search results keep their ranking when a cursor is asked for."""
+        self.galaxy.description = "Runs on Ubuntu."
+        self.galaxy.save()
+        response = self.client.get(reverse('application-list'),
+                                   {'search': 'ubuntu',
+                                    'pagination': 'cursor'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual([app['slug'] for app in response.data['results']],
+                         ['ubuntu', 'galaxy'])
+
+
+class CloudApplicationTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.target_cloud = cb_models.AWS.objects.create(
+            name='Amazon US East 1 - N. Virginia',
+            kind='cloud',
+        )
+        self.application = Application.objects.create(
+            name="Ubuntu",
+            status=Application.LIVE,
+        )
+        self.application_version = ApplicationVersion.objects.create(
+            application=self.application,
+            version="16.04",
+        )
+        self.image = CloudImage.objects.create(name='Ubuntu 16.04',
+                                               image_id='abc123',
+                                               cloud=self.target_cloud)
+        ApplicationVersionCloudConfig.objects.create(
+            application_version=self.application_version,
+            cloud=self.target_cloud,
+            image=self.image,
+            default_instance_type='m1.small',
+        )
+        self.url = reverse('cloud_application-list',
+                           kwargs={'cloud_pk': self.target_cloud.slug})
+
+    def test_list_cloud_applications(self):
+        """Test launchable apps of a cloud are listed in a single query."""
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [{
+            'application': 'ubuntu',
+            'application_name': 'Ubuntu',
+            'application_version': self.application_version.id,
+            'version': '16.04',
+            'image_id': 'abc123',
+            'image_name': 'Ubuntu 16.04',
+            'default_instance_type': 'm1.small',
+        }])
+
+    def test_index_follows_catalog_changes(self):
+        """Test image and application changes are reflected in the index."""
+        self.image.image_id = 'def456'
+        self.image.save()
+        self.assertEqual(self.client.get(self.url).data[0]['image_id'],
+                         'def456')
+        self.application.status = Application.DEV
+        self.application.save()
+        self.assertEqual(self.client.get(self.url).data, [])
+
+
+class CatalogSnapshotTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        snapshot_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(snapshot_dir.cleanup)
+        settings_override = self.settings(
+            CLOUDLAUNCH_CATALOG_SNAPSHOT_DIR=snapshot_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        Application.objects.create(name="Ubuntu", status=Application.LIVE)
+        Application.objects.create(name="Galaxy", status=Application.DEV)
+
+    def _get_snapshot(self, **headers):
+        response = self.client.get(reverse('catalog-list'), **headers)
+        content = b''.join(getattr(response, 'streaming_content', []))
+        return response, content
+
+    def test_get_snapshot(self):
+        """Test the snapshot contains LIVE applications only."""
+        response, content = self._get_snapshot()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        snapshot = json.loads(content.decode('utf-8'))
+        self.assertEqual([app['slug'] for app in snapshot['applications']],
+                         ['ubuntu'])
+
+    def test_get_gzipped_snapshot(self):
+        """Test a gzipped snapshot is served when accepted."""
+        response, content = self._get_snapshot(
+            HTTP_ACCEPT_ENCODING='gzip;q=1.0, identity; q=0.5')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        snapshot = json.loads(gzip.decompress(content).decode('utf-8'))
+        self.assertEqual(len(snapshot['applications']), 1)
+        response, _ = self._get_snapshot(
+            HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+
+    def test_snapshot_rebuilt_on_catalog_change(self):
+        """Test a new snapshot is rendered when the catalog changes."""
+        response, _ = self._get_snapshot()
+        Application.objects.create(name="CloudMan", status=Application.LIVE)
+        new_response, content = self._get_snapshot(
+            HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(new_response.status_code, status.HTTP_200_OK)
+        snapshot = json.loads(content.decode('utf-8'))
+        self.assertEqual(len(snapshot['applications']), 2)
+
+    def test_only_older_snapshots_pruned(self):
+        """Test rendering a snapshot leaves newer revisions in place."""
+        snapshot_dir = catalog.get_snapshot_dir()
+        os.makedirs(snapshot_dir, exist_ok=True)
+        revision = CatalogRevision.get_current()
+        older = os.path.join(snapshot_dir, 'catalog-{0}-abc.json'.format(
+            revision - 1))
+        newer = os.path.join(snapshot_dir, 'catalog-{0}-abc.json'.format(
+            revision + 1))
+        for path in (older, newer):
+            open(path, 'w').close()
+        response, _ = self._get_snapshot()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(os.path.exists(older))
+        self.assertTrue(os.path.exists(newer))
+
+
+class ApplicationCatalogQueryTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.target_cloud = cb_models.AWS.objects.create(
+            name='Amazon US East 1 - N. Virginia',
+            kind='cloud',
+        )
+        self.image = CloudImage.objects.create(image_id='abc123',
+                                               cloud=self.target_cloud)
+
+    def _create_catalog(self, start, end):
+        """Bulk create LIVE apps, each with one version and cloud config."""
+        Application.objects.bulk_create(
+            Application(slug='app-%s' % i, name='App %s' % i,
+                        status=Application.LIVE) for i in range(start, end))
+        ApplicationVersion.objects.bulk_create(
+            ApplicationVersion(application_id='app-%s' % i, version='1.0')
+            for i in range(start, end))
+        ApplicationVersionCloudConfig.objects.bulk_create(
+            ApplicationVersionCloudConfig(application_version=version,
+                                          cloud=self.target_cloud,
+                                          image=self.image,
+                                          merged_launch_config='{}')
+            for version in ApplicationVersion.objects.filter(
+                app_version_config__isnull=True))
+
+    def _count_catalog_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('application-list'),
+                                       {'page_size': 1000})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries), response.json()['count']
+
+    def test_catalog_query_count_is_flat(self):
+        """Test listing the catalog runs a fixed number of queries."""
+        self._create_catalog(0, 10)
+        small_queries, small_count = self._count_catalog_queries()
+        self._create_catalog(10, 1000)
+        large_queries, large_count = self._count_catalog_queries()
+        self.assertEqual(small_count, 10)
+        self.assertEqual(large_count, 1000)
+        self.assertEqual(small_queries, large_queries)
+
+    def test_catalog_sparse_fields(self):
+        """Test versions are not loaded when omitted from the catalog."""
+        self._create_catalog(0, 3)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('application-list'),
+                                       {'fields': 'slug,name'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.json()['results'][0]), {'slug', 'name'})
+        sql = ' '.join(q['sql'] for q in queries.captured_queries)
+        self.assertNotIn('cloudlaunch_applicationversion', sql)
+        self.assertNotIn('"description"', sql)
+
+
 class UserTests(APITestCase):
 
     LOGIN_DATA = {'username': 'TestUser',
@@ -278,43 +579,47 @@ class ApplicationDeploymentTests(BaseAuthenticatedAPITestCase):
         self.credentials = self._create_credentials(self.target_cloud)
         self.app_version_cloud_config = self._create_app_version_cloud_config(
             self.application_version, self.target_cloud, self.ubuntu_image)
+        usage.usage_buffer.clear()
+        self.addCleanup(usage.usage_buffer.clear)
 
     def test_create_deployment(self):
         """Create deployment from 'application' and 'application_version'."""
-        with MockedCeleryTaskCall(
-                "cloudlaunch.tasks.create_appliance.delay",
-                'test-deployment',
-                self.app_version_cloud_config.id,
-                self.credentials.as_dict(),
-                self.DEFAULT_LAUNCH_CONFIG,
-                None) as async_result:
-
+        with patch('cloudlaunch.tasks.create_appliance.apply_async') as launch:
             response = self.client.post(reverse('deployments-list'), {
                 'name': 'test-deployment',
                 'application': self.application_version.application.slug,
                 'application_version': self.application_version.version,
                 'target_cloud': self.target_cloud.slug,
             })
-            self.assertResponse(response, status=201, data_contains={
-                'name': 'test-deployment',
-                'application_version': self.application_version.id,
-                'target_cloud': self.target_cloud.slug,
-                'application_config': self.DEFAULT_LAUNCH_CONFIG,
-                'app_version_details': {
-                    'version': self.application_version.version,
-                    'application': {
-                        'slug': self.application_version.application.slug,
-                    }
-                },
-                'latest_task': {
-                    'celery_id': async_result.id,
-                    'action': 'LAUNCH'
-                },
-                'launch_task': {
-                    'celery_id': async_result.id,
-                    'action': 'LAUNCH'
+            # The launch is only sent once its task row is committed
+            self.assertFalse(launch.called)
+            self.run_commit_hooks()
+        launch_task = ApplicationDeploymentTask.objects.get(
+            action=ApplicationDeploymentTask.LAUNCH)
+        launch.assert_called_once_with(
+            ('test-deployment', self.app_version_cloud_config.id,
+             self.credentials.as_dict(), self.DEFAULT_LAUNCH_CONFIG, None),
+            task_id=launch_task.celery_id)
+        self.assertResponse(response, status=201, data_contains={
+            'name': 'test-deployment',
+            'application_version': self.application_version.id,
+            'target_cloud': self.target_cloud.slug,
+            'application_config': self.DEFAULT_LAUNCH_CONFIG,
+            'app_version_details': {
+                'version': self.application_version.version,
+                'application': {
+                    'slug': self.application_version.application.slug,
                 }
-            })
+            },
+            'latest_task': {
+                'celery_id': launch_task.celery_id,
+                'action': 'LAUNCH'
+            },
+            'launch_task': {
+                'celery_id': launch_task.celery_id,
+                'action': 'LAUNCH'
+            }
+        })
         # Check that deployment and its LAUNCH task were created
         app_deployment = ApplicationDeployment.objects.get()
         launch_task = ApplicationDeploymentTask.objects.get(
@@ -324,15 +629,7 @@ class ApplicationDeploymentTests(BaseAuthenticatedAPITestCase):
 
     def test_merging_app_config(self):
         """Specify app_config and verify it is merged correctly."""
-        with MockedCeleryTaskCall(
-                "cloudlaunch.tasks.create_appliance.delay",
-                'test-deployment',
-                self.app_version_cloud_config.id,
-                self.credentials.as_dict(),
-                {'foo': 1, 'bar': 3, 'baz': 4,
-                 'config_cloudlaunch': {'instance_user_data': "userdata"}},
-                'userdata') as async_result:
-
+        with patch('cloudlaunch.tasks.create_appliance.apply_async') as launch:
             response = self.client.post(reverse('deployments-list'), {
                 'name': 'test-deployment',
                 'application': self.application_version.application.slug,
@@ -340,33 +637,43 @@ class ApplicationDeploymentTests(BaseAuthenticatedAPITestCase):
                 'target_cloud': self.target_cloud.slug,
                 'config_app': json.dumps(self.DEFAULT_APP_CONFIG),
             })
-            self.assertResponse(response, status=201, data_contains={
-                'name': 'test-deployment',
-                'application_version': self.application_version.id,
-                'target_cloud': self.target_cloud.slug,
-                'application_config': {
-                    'foo': 1,  # default from DEFAULT_LAUNCH_CONFIG
-                    'bar': 3,  # config_app overrides DEFAULT_LAUNCH_CONFIG
-                    'baz': 4,  # added by config_app
-                    'config_cloudlaunch': {
-                        'instance_user_data': "userdata"
-                    }
-                },
-                'app_version_details': {
-                    'version': self.application_version.version,
-                    'application': {
-                        'slug': self.application_version.application.slug,
-                    }
-                },
-                'latest_task': {
-                    'celery_id': async_result.id,
-                    'action': 'LAUNCH'
-                },
-                'launch_task': {
-                    'celery_id': async_result.id,
-                    'action': 'LAUNCH'
+            self.run_commit_hooks()
+        launch_task = ApplicationDeploymentTask.objects.get(
+            action=ApplicationDeploymentTask.LAUNCH)
+        launch.assert_called_once_with(
+            ('test-deployment', self.app_version_cloud_config.id,
+             self.credentials.as_dict(),
+             {'foo': 1, 'bar': 3, 'baz': 4,
+              'config_cloudlaunch': {'instance_user_data': "userdata"}},
+             'userdata'),
+            task_id=launch_task.celery_id)
+        self.assertResponse(response, status=201, data_contains={
+            'name': 'test-deployment',
+            'application_version': self.application_version.id,
+            'target_cloud': self.target_cloud.slug,
+            'application_config': {
+                'foo': 1,  # default from DEFAULT_LAUNCH_CONFIG
+                'bar': 3,  # config_app overrides DEFAULT_LAUNCH_CONFIG
+                'baz': 4,  # added by config_app
+                'config_cloudlaunch': {
+                    'instance_user_data': "userdata"
                 }
-            })
+            },
+            'app_version_details': {
+                'version': self.application_version.version,
+                'application': {
+                    'slug': self.application_version.application.slug,
+                }
+            },
+            'latest_task': {
+                'celery_id': launch_task.celery_id,
+                'action': 'LAUNCH'
+            },
+            'launch_task': {
+                'celery_id': launch_task.celery_id,
+                'action': 'LAUNCH'
+            }
+        })
         # Check that deployment and its LAUNCH task were created
         app_deployment = ApplicationDeployment.objects.get()
         launch_task = ApplicationDeploymentTask.objects.get(
@@ -374,6 +681,171 @@ class ApplicationDeploymentTests(BaseAuthenticatedAPITestCase):
                 deployment=app_deployment)
         self.assertIsNotNone(launch_task)
 
+    def test_create_deployment_async(self):
+        """Prefer: respond-async creates a deployment without the cloud."""
+        with patch('cloudlaunch.tasks.create_appliance.apply_async') as launch, \
+                patch('cloudlaunch.providers.get_cloud_provider') as gcp:
+            response = self.client.post(reverse('deployments-list'), {
+                'name': 'test-deployment',
+                'application': self.application_version.application.slug,
+                'application_version': self.application_version.version,
+                'target_cloud': self.target_cloud.slug,
+                'config_app': json.dumps(self.DEFAULT_APP_CONFIG),
+            }, HTTP_PREFER='respond-async')
+            self.assertFalse(launch.called)
+            self.run_commit_hooks()
+        self.assertResponse(response, status=202, data_contains={
+            'name': 'test-deployment',
+            'launch_task': {'action': 'LAUNCH'}})
+        self.assertEqual(response['Preference-Applied'], 'respond-async')
+        self.assertFalse(gcp.called)
+        launch_task = ApplicationDeploymentTask.objects.get(
+            action=ApplicationDeploymentTask.LAUNCH)
+        args, kwargs = launch.call_args
+        self.assertEqual(args[0][0], 'test-deployment')
+        self.assertEqual(args[0][3]['bar'], 3)
+        self.assertEqual(args[1], {'validate': True})
+        self.assertEqual(kwargs['task_id'], launch_task.celery_id)
+
+    def test_launch_task_validates_app_config(self):
+        """Deferred validation fails the launch task with the errors."""
+        self.application_version.backend_component_name = (
+            "cloudlaunch.backend_plugins.docker_app.DockerAppPlugin")
+        self.application_version.save()
+        with self.assertRaises(util.LaunchValidationError) as cm:
+            tasks.create_appliance(
+                'test-deployment', self.app_version_cloud_config.id,
+                self.credentials.as_dict(), {}, None, validate=True)
+        self.assertIn("Docker configuration data must be provided.",
+                      str(cm.exception.detail))
+        deployment_task = ApplicationDeploymentTask(celery_id='abc')
+        deployment_task._task_meta = {'status': 'FAILURE',
+                                      'result': cm.exception}
+        self.assertEqual(deployment_task.result['validation_errors'],
+                         cm.exception.detail)
+
+    def test_bulk_create_deployments(self):
+        """Create many deployments with a single request."""
+        names = ['workshop-%s' % i for i in range(5)]
+        with patch('cloudlaunch.serializers.group') as mocked_group:
+            response = self.client.post(reverse('deployments-bulk'), {
+                'names': names,
+                'application': self.application_version.application.slug,
+                'application_version': self.application_version.version,
+                'target_cloud': self.target_cloud.slug,
+                'config_app': json.dumps(self.DEFAULT_APP_CONFIG),
+            })
+            # Launches are only dispatched once their rows are committed
+            self.assertFalse(mocked_group.called)
+            self.run_commit_hooks()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([d['name'] for d in response.data], names)
+        launch_tasks = ApplicationDeploymentTask.objects.filter(
+            action=ApplicationDeploymentTask.LAUNCH)
+        self.assertEqual(launch_tasks.count(), 5)
+        # Usage is buffered rather than written by the request
+        self.assertEqual(len(usage.usage_buffer), 5)
+        self.assertFalse(Usage.objects.exists())
+        for deployment in response.data:
+            self.assertEqual(deployment['launch_task']['action'], 'LAUNCH')
+            self.assertEqual(deployment['application_config']['bar'], 3)
+        # All launches are dispatched as one group, under the stored ids
+        mocked_group.return_value.apply_async.assert_called_once_with()
+        signatures = list(mocked_group.call_args[0][0])
+        self.assertEqual([sig.args[0] for sig in signatures], names)
+        self.assertEqual({sig.options['task_id'] for sig in signatures},
+                         set(launch_tasks.values_list('celery_id', flat=True)))
+
+    def test_create_deployment_idempotency_key(self):
+        """Repeated requests with an Idempotency-Key launch only once."""
+        data = {
+            'name': 'test-deployment',
+            'application': self.application_version.application.slug,
+            'application_version': self.application_version.version,
+            'target_cloud': self.target_cloud.slug,
+        }
+        with patch('cloudlaunch.tasks.create_appliance.apply_async') as launch:
+            responses = [self.client.post(
+                reverse('deployments-list'), data,
+                HTTP_IDEMPOTENCY_KEY='launch-1') for _ in range(2)]
+            self.run_commit_hooks()
+            self.assertEqual(launch.call_count, 1)
+            self.assertEqual(ApplicationDeployment.objects.count(), 1)
+            self.assertEqual(responses[1].status_code, 201)
+            self.assertEqual(responses[1]['Idempotent-Replayed'], 'true')
+            self.assertEqual(responses[1].data['id'], responses[0].data['id'])
+            # The key cannot be reused for another request
+            response = self.client.post(
+                reverse('deployments-list'), dict(data, name='other'),
+                HTTP_IDEMPOTENCY_KEY='launch-1')
+            self.assertResponse(response, status=422)
+            # Failed requests can be retried under the same key
+            response = self.client.post(
+                reverse('deployments-list'), dict(data, name=''),
+                HTTP_IDEMPOTENCY_KEY='launch-2')
+            self.assertResponse(response, status=400)
+            response = self.client.post(
+                reverse('deployments-list'), dict(data, name='retried'),
+                HTTP_IDEMPOTENCY_KEY='launch-2')
+            self.assertResponse(response, status=201)
+            self.run_commit_hooks()
+            self.assertEqual(launch.call_count, 2)
+
+    def test_usage_is_recorded_in_batches(self):
+        """Buffered usage is recorded with one insert once it is due."""
+        deployments = [ApplicationDeployment.objects.create(
+            name='test-%s' % i, owner=self.user,
+            application_version=self.application_version,
+            target_cloud=self.target_cloud) for i in range(3)]
+        app_config = {'config_cloudlaunch': {'instanceType': 'm1.small'}}
+        with patch('cloudlaunch.tasks.record_usage.delay',
+                   side_effect=tasks.record_usage) as record_usage:
+            for deployment in deployments:
+                usage.record(self.app_version_cloud_config, deployment,
+                             app_config, self.user)
+            # Not due yet
+            self.client.get(reverse('deployments-list'))
+            self.assertFalse(record_usage.called)
+            deployments[0].delete()
+            with self.settings(CLOUDLAUNCH_USAGE_BATCH_SIZE=3):
+                self.client.get(reverse('deployments-list'))
+        # The usage of deleted deployments is dropped
+        record_usage.assert_called_once()
+        self.assertEqual(len(usage.usage_buffer), 0)
+        self.assertEqual(
+            set(Usage.objects.values_list('app_deployment', flat=True)),
+            {deployments[1].id, deployments[2].id})
+        self.assertEqual(Usage.objects.first().app_config, app_config)
+
+    def test_usage_buffer_flushes_when_idle(self):
+        """Buffered usage is handed on once due, even without requests."""
+        due = threading.Event()
+        buffer = usage.UsageBuffer(on_due=due.set)
+        self.addCleanup(buffer.clear)
+        with self.settings(CLOUDLAUNCH_USAGE_FLUSH_INTERVAL=0.01):
+            buffer.add({'app_deployment': 1})
+        self.assertTrue(due.wait(5))
+        # Clearing the buffer stops its timer
+        due.clear()
+        buffer.clear()
+        buffer.add({'app_deployment': 1})
+        buffer.clear()
+        self.assertFalse(due.wait(0.05))
+
+    def test_bulk_create_unknown_version(self):
+        """Bulk creation fails validation for an unknown version."""
+        with patch('cloudlaunch.serializers.group') as mocked_group:
+            response = self.client.post(reverse('deployments-bulk'), {
+                'names': ['workshop-1'],
+                'application': self.application_version.application.slug,
+                'application_version': 'no-such-version',
+                'target_cloud': self.target_cloud.slug,
+            })
+        self.assertResponse(response, status=400)
+        self.assertIn('application_version', response.data)
+        self.assertFalse(mocked_group.called)
+        self.assertFalse(ApplicationDeployment.objects.exists())
+
 
 class ApplicationDeploymentTaskTests(BaseAuthenticatedAPITestCase):
 
@@ -414,72 +886,75 @@ class ApplicationDeploymentTaskTests(BaseAuthenticatedAPITestCase):
 
     def test_create_health_check_task(self):
         """Test creating a HEALTH_CHECK type task."""
-        with MockedCeleryTaskCall(
-                "cloudlaunch.tasks.health_check.delay",
-                self.app_deployment.id,
-                self.app_deployment.credentials.as_dict()) as async_result:
-
+        with patch('cloudlaunch.tasks.health_check.apply_async') as send:
             response = self.client.post(
                 reverse('deployment_task-list',
                         kwargs={'deployment_pk': self.app_deployment.id}),
                 {'action': 'HEALTH_CHECK'})
-            self.assertResponse(response, status=201, data_contains={
-                'celery_id': async_result.id,
-                'action': 'HEALTH_CHECK',
-                'deployment': self.app_deployment.id,
-            })
+            # The task is only sent once its row is committed
+            self.assertFalse(send.called)
+            self.run_commit_hooks()
         # check that ApplicationDeploymentTask was created, will throw
         # DoesNotExist if missing
         task = ApplicationDeploymentTask.objects.get(action='HEALTH_CHECK',
-                                                     celery_id=async_result.id,
                                                      deployment=self.app_deployment)
-        self.assertIsNotNone(task)
+        self.assertResponse(response, status=201, data_contains={
+            'celery_id': task.celery_id,
+            'action': 'HEALTH_CHECK',
+            'deployment': self.app_deployment.id,
+        })
+        send.assert_called_once_with(
+            (self.app_deployment.id,
+             self.app_deployment.credentials.as_dict()),
+            task_id=task.celery_id)
 
     def test_create_restart_task(self):
         """Test creating a RESTART type task."""
-        with MockedCeleryTaskCall(
-                "cloudlaunch.tasks.restart_appliance.delay",
-                self.app_deployment.id,
-                self.app_deployment.credentials.as_dict()) as async_result:
-
+        with patch('cloudlaunch.tasks.restart_appliance.apply_async') as send:
             response = self.client.post(
                 reverse('deployment_task-list',
                         kwargs={'deployment_pk': self.app_deployment.id}),
                 {'action': 'RESTART'})
-            self.assertResponse(response, status=201, data_contains={
-                'celery_id': async_result.id,
-                'action': 'RESTART',
-                'deployment': self.app_deployment.id,
-            })
+            # The task is only sent once its row is committed
+            self.assertFalse(send.called)
+            self.run_commit_hooks()
         # check that ApplicationDeploymentTask was created, will throw
         # DoesNotExist if missing
         task = ApplicationDeploymentTask.objects.get(action='RESTART',
-                                                     celery_id=async_result.id,
                                                      deployment=self.app_deployment)
-        self.assertIsNotNone(task)
+        self.assertResponse(response, status=201, data_contains={
+            'celery_id': task.celery_id,
+            'action': 'RESTART',
+            'deployment': self.app_deployment.id,
+        })
+        send.assert_called_once_with(
+            (self.app_deployment.id,
+             self.app_deployment.credentials.as_dict()),
+            task_id=task.celery_id)
 
     def test_create_delete_task(self):
         """Test creating a DELETE type task."""
-        with MockedCeleryTaskCall(
-                "cloudlaunch.tasks.delete_appliance.delay",
-                self.app_deployment.id,
-                self.app_deployment.credentials.as_dict()) as async_result:
-
+        with patch('cloudlaunch.tasks.delete_appliance.apply_async') as send:
             response = self.client.post(
                 reverse('deployment_task-list',
                         kwargs={'deployment_pk': self.app_deployment.id}),
                 {'action': 'DELETE'})
-            self.assertResponse(response, status=201, data_contains={
-                'celery_id': async_result.id,
-                'action': 'DELETE',
-                'deployment': self.app_deployment.id,
-            })
+            # The task is only sent once its row is committed
+            self.assertFalse(send.called)
+            self.run_commit_hooks()
         # check that ApplicationDeploymentTask was created, will throw
         # DoesNotExist if missing
         task = ApplicationDeploymentTask.objects.get(action='DELETE',
-                                                     celery_id=async_result.id,
                                                      deployment=self.app_deployment)
-        self.assertIsNotNone(task)
+        self.assertResponse(response, status=201, data_contains={
+            'celery_id': task.celery_id,
+            'action': 'DELETE',
+            'deployment': self.app_deployment.id,
+        })
+        send.assert_called_once_with(
+            (self.app_deployment.id,
+             self.app_deployment.credentials.as_dict()),
+            task_id=task.celery_id)
 
     def test_only_one_launch_task(self):
         """Test LAUNCH task not allowed if one already exists."""
@@ -510,6 +985,499 @@ class ApplicationDeploymentTaskTests(BaseAuthenticatedAPITestCase):
             1,
             "Only one LAUNCH task should exist.")
 
+    def test_list_deployments_with_cursor(self):
+        """Walk the deployment list with cursor pagination."""
+        for i in range(4):
+            ApplicationDeployment.objects.create(
+                owner=self.user,
+                name="{0}-{1}".format(self.DEPLOYMENT_NAME, i),
+                application_version=self.app_deployment.application_version,
+                target_cloud=self.app_deployment.target_cloud,
+                credentials=self.app_deployment.credentials)
+        expected = list(ApplicationDeployment.objects.order_by(
+            '-added', 'id').values_list('id', flat=True))
+        url = reverse('deployments-list') + '?pagination=cursor&page_size=2'
+        seen = []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            self.assertFalse(any('COUNT(' in q['sql']
+                                 for q in queries.captured_queries))
+            seen.extend(d['id'] for d in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, expected)
+
+    def test_page_size_is_capped(self):
+        """Clients cannot request pages larger than the maximum size."""
+        pagination = views.OptionalCursorPagination
+        with patch.object(pagination, 'max_page_size', 2):
+            for i in range(3):
+                ApplicationDeployment.objects.create(
+                    owner=self.user,
+                    name="{0}-{1}".format(self.DEPLOYMENT_NAME, i),
+                    application_version=(
+                        self.app_deployment.application_version),
+                    target_cloud=self.app_deployment.target_cloud)
+            for params in ({'page_size': 1000000},
+                           {'page_size': 1000000, 'pagination': 'cursor'}):
+                response = self.client.get(reverse('deployments-list'),
+                                           params)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), 2)
+
+    def test_filter_deployments(self):
+        """Filter deployments by application, cloud, state and date."""
+        other_cloud = cb_models.AWS.objects.create(
+            name='Amazon US West 2', kind='cloud')
+        other = ApplicationDeployment.objects.create(
+            owner=self.user, name="other", state=ApplicationDeployment.RUNNING,
+            application_version=self.app_deployment.application_version,
+            target_cloud=other_cloud)
+        ApplicationDeployment.objects.filter(pk=self.app_deployment.pk).update(
+            added='2018-01-01T00:00:00Z')
+        version = self.app_deployment.application_version
+
+        def filtered_ids(**params):
+            response = self.client.get(reverse('deployments-list'), params)
+            self.assertResponse(response, status=200)
+            return {d['id'] for d in response.data['results']}
+
+        both = {self.app_deployment.id, other.id}
+        self.assertEqual(filtered_ids(application=version.application.slug,
+                                      version=version.version), both)
+        self.assertEqual(filtered_ids(application='no-such-app'), set())
+        self.assertEqual(filtered_ids(target_cloud=other_cloud.slug),
+                         {other.id})
+        self.assertEqual(filtered_ids(state='RUNNING'), {other.id})
+        self.assertEqual(filtered_ids(added_before='2018-06-01T00:00:00Z'),
+                         {self.app_deployment.id})
+        self.assertEqual(filtered_ids(added_after='2018-06-01T00:00:00Z',
+                                      archived='false'), {other.id})
+
+    def test_list_deployments_with_page_numbers(self):
+        """Page number pagination remains the default."""
+        response = self.client.get(reverse('deployments-list'))
+        self.assertResponse(response, status=200, data_contains={'count': 1})
+
+    def _count_deployment_list_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('deployments-list'))
+        self.assertResponse(response, status=200)
+        return len(queries), response.data['results']
+
+    def test_deployment_list_query_count_is_flat(self):
+        """Listing deployments and their tasks runs a fixed number of queries."""
+        def add_deployment(i):
+            deployment = ApplicationDeployment.objects.create(
+                owner=self.user,
+                name="{0}-{1}".format(self.DEPLOYMENT_NAME, i),
+                application_version=self.app_deployment.application_version,
+                target_cloud=self.app_deployment.target_cloud,
+                credentials=self.app_deployment.credentials)
+            for action in ('LAUNCH', 'HEALTH_CHECK', 'RESTART'):
+                ApplicationDeploymentTask.objects.create(
+                    deployment=deployment, action=action)
+        add_deployment(0)
+        small_queries, small_results = self._count_deployment_list_queries()
+        for i in range(1, 10):
+            add_deployment(i)
+        large_queries, large_results = self._count_deployment_list_queries()
+        self.assertEqual(len(large_results), 11)
+        self.assertEqual(small_queries, large_queries)
+        for result in large_results:
+            if result['name'] == self.DEPLOYMENT_NAME:
+                self.assertIsNone(result['latest_task'])
+                self.assertIsNone(result['launch_task'])
+            else:
+                self.assertEqual(result['latest_task']['action'], 'RESTART')
+                self.assertEqual(result['launch_task']['action'], 'LAUNCH')
+
+    def _add_task(self, action, status=None, result=None):
+        task = ApplicationDeploymentTask.objects.create(
+            deployment=self.app_deployment, action=action,
+            celery_id=str(uuid.uuid4()))
+        if status:
+            TaskResult.objects.create(
+                task_id=task.celery_id, status=status,
+                result=json.dumps(result), content_type='application/json',
+                content_encoding='utf-8')
+        return task
+
+    def _list_tasks(self, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('deployment_task-list',
+                        kwargs={'deployment_pk': self.app_deployment.id}),
+                params)
+        self.assertResponse(response, status=200)
+        return len(queries), {task['id']: task
+                              for task in response.data['results']}
+
+    def test_task_states_are_resolved_in_bulk(self):
+        """Listing tasks looks up their Celery state in a single query."""
+        success = self._add_task('HEALTH_CHECK', 'SUCCESS', {'foo': 'bar'})
+        pending = self._add_task('RESTART')
+        small_queries, results = self._list_tasks()
+        self.assertEqual(results[success.id]['status'], 'SUCCESS')
+        self.assertEqual(results[success.id]['result'], {'foo': 'bar'})
+        self.assertEqual(results[pending.id]['status'], 'PENDING')
+        self.assertEqual(results[pending.id]['result'], {'result': 'None'})
+        for i in range(10):
+            self._add_task('HEALTH_CHECK', 'SUCCESS', True)
+        large_queries, results = self._list_tasks()
+        self.assertEqual(len(results), 12)
+        self.assertEqual(small_queries, large_queries)
+
+    def test_sparse_task_list_queries(self):
+        """Dropping task fields never adds queries per task."""
+        self._add_task('HEALTH_CHECK', 'SUCCESS', {'foo': 'bar'})
+        self._add_task('RESTART')
+        small_sparse_queries, _ = self._list_tasks({'fields': 'id'})
+        small_status_queries, _ = self._list_tasks({'fields': 'id,status'})
+        for i in range(10):
+            self._add_task('HEALTH_CHECK', 'SUCCESS', True)
+        full_queries, _ = self._list_tasks()
+        sparse_queries, results = self._list_tasks({'fields': 'id'})
+        self.assertEqual(len(results), 12)
+        self.assertEqual(set(next(iter(results.values()))), {'id'})
+        self.assertEqual(sparse_queries, small_sparse_queries)
+        self.assertLess(sparse_queries, full_queries)
+        status_queries, results = self._list_tasks({'fields': 'id,status'})
+        self.assertEqual(status_queries, small_status_queries)
+        self.assertEqual(
+            {task['status'] for task in results.values()},
+            {'SUCCESS', 'PENDING'})
+
+    def _finish_task(self, task, state, retval):
+        task_postrun.send(sender=None, task_id=task.celery_id, task=None,
+                          retval=retval, state=state)
+        self.app_deployment.refresh_from_db()
+
+    def test_archive_old_deployments(self):
+        """Old archived deployments are moved to the archive tables."""
+        deployment = self.app_deployment
+        launch = self._add_task('LAUNCH', 'SUCCESS', {'instance': 'i-123'})
+        cloud_config = ApplicationVersionCloudConfig.objects.create(
+            application_version=deployment.application_version,
+            cloud=deployment.target_cloud,
+            image=CloudImage.objects.create(image_id='abc123',
+                                            cloud=deployment.target_cloud))
+        Usage.objects.create(app_version_cloud_config=cloud_config,
+                             app_deployment=deployment, user=self.user)
+        recent = ApplicationDeployment.objects.create(
+            owner=self.user, name='recent', archived=True,
+            application_version=deployment.application_version,
+            target_cloud=deployment.target_cloud)
+        ApplicationDeployment.objects.filter(pk=deployment.pk).update(
+            archived=True, updated='2018-01-01T00:00:00Z')
+
+        self.assertEqual(archive.archive_deployments(age=30), 1)
+        self.assertEqual(list(ApplicationDeployment.objects.all()), [recent])
+        self.assertFalse(ApplicationDeploymentTask.objects.exists())
+        self.assertFalse(TaskResult.objects.exists())
+        usage = Usage.objects.get()
+        self.assertIsNone(usage.app_deployment)
+        self.assertEqual(usage.archived_deployment_id, deployment.id)
+
+        response = self.client.get(reverse('archived_deployments-list'))
+        self.assertResponse(response, status=200, data_contains={'count': 1})
+        archived = response.data['results'][0]
+        self.assertEqual(archived['id'], deployment.id)
+        self.assertEqual(archived['name'], self.DEPLOYMENT_NAME)
+        self.assertEqual(archived['tasks'][0]['id'], launch.id)
+        self.assertEqual(archived['tasks'][0]['status'], 'SUCCESS')
+        self.assertEqual(archived['tasks'][0]['result'],
+                         {'instance': 'i-123'})
+
+    def test_finished_task_results_are_frozen(self):
+        """Finished tasks are read from the DB, not the result backend."""
+        health_check = self._add_task('HEALTH_CHECK', 'SUCCESS',
+                                      {'instance_status': 'running'})
+        self._finish_task(health_check, 'SUCCESS',
+                          {'instance_status': 'running'})
+        health_check.refresh_from_db()
+        self.assertFalse(health_check.needs_task_meta())
+        with self.assertNumQueries(0):
+            self.assertEqual(health_check.status, 'SUCCESS')
+            self.assertEqual(health_check.result,
+                             {'instance_status': 'running'})
+        restart = self._add_task('RESTART')
+        self._finish_task(restart, 'FAILURE', Exception("no instance"))
+        restart.refresh_from_db()
+        self.assertEqual(restart.status, 'FAILURE')
+        self.assertEqual(restart.result, {'exc_message': 'no instance'})
+        self.assertIn("Exception: no instance", restart.traceback)
+
+    def test_launch_key_material_is_not_frozen(self):
+        """Key material stays in the result backend only."""
+        result = {'cloudLaunch': {'keyPair': {'material': 'secret'}}}
+        launch = self._add_task('LAUNCH', 'SUCCESS', result)
+        self._finish_task(launch, 'SUCCESS', result)
+        launch.refresh_from_db()
+        self.assertEqual(launch._result,
+                         {'cloudLaunch': {'keyPair': {'material': None}}})
+        self.assertTrue(launch.needs_task_meta())
+        self.assertEqual(launch.result, result)
+
+    def test_migrate_task_results(self):
+        """Results past their retention are migrated in bulk."""
+        frozen = self._add_task('HEALTH_CHECK', 'SUCCESS',
+                                {'instance_status': 'running'})
+        self._finish_task(frozen, 'SUCCESS', {'instance_status': 'running'})
+        # The worker did not get to freeze this one
+        unfrozen = self._add_task('RESTART', 'SUCCESS', {'restarted': True})
+        running = self._add_task('DELETE')
+        launch = self._add_task('LAUNCH', 'SUCCESS', {'cloudLaunch': {}})
+        self._finish_task(launch, 'SUCCESS', {'cloudLaunch': {}})
+        an_hour_ago = timezone.now() - timedelta(minutes=59)
+        ApplicationDeploymentTask.objects.update(updated=an_hour_ago)
+
+        metrics = tasks.migrate_task_results()
+        self.assertEqual(metrics['migrated'], 2)
+        self.assertEqual(
+            set(ApplicationDeploymentTask.objects.filter(
+                celery_id__isnull=False).values_list('id', flat=True)),
+            {running.id, launch.id})
+        self.assertEqual(set(TaskResult.objects.values_list(
+            'task_id', flat=True)), {launch.celery_id})
+        unfrozen.refresh_from_db()
+        self.assertEqual(unfrozen.status, 'SUCCESS')
+        self.assertEqual(unfrozen.result, {'restarted': True})
+        frozen.refresh_from_db()
+        self.assertEqual(frozen.result, {'instance_status': 'running'})
+
+    def test_deployment_state_follows_finished_tasks(self):
+        """Finished tasks update the deployment state columns."""
+        self.assertEqual(self.app_deployment.state,
+                         ApplicationDeployment.LAUNCHING)
+        launch = self._add_task('LAUNCH')
+        self._finish_task(launch, 'SUCCESS', {'cloudLaunch': {
+            'instance': {'id': 'i-123'}, 'publicIP': '10.0.0.1',
+            'applicationURL': 'http://10.0.0.1/'}})
+        self.assertEqual(self.app_deployment.state,
+                         ApplicationDeployment.RUNNING)
+        self.assertEqual(self.app_deployment.instance_id, 'i-123')
+        self.assertEqual(self.app_deployment.public_ip, '10.0.0.1')
+        self.assertEqual(self.app_deployment.application_url,
+                         'http://10.0.0.1/')
+        self._finish_task(self._add_task('HEALTH_CHECK'), 'SUCCESS',
+                          {'instance_status': 'running'})
+        self.assertEqual(self.app_deployment.health_status, 'running')
+        self._finish_task(self._add_task('DELETE'), 'SUCCESS', True)
+        self.assertEqual(self.app_deployment.state,
+                         ApplicationDeployment.DELETED)
+        response = self.client.get(reverse('deployments-list'),
+                                   {'state': 'DELETED'})
+        self.assertResponse(response, status=200, data_contains={'count': 1})
+
+    def test_stale_deployment_keeps_launch_state(self):
+        """A task finishing on a stale deployment only writes its fields."""
+        stale = ApplicationDeployment.objects.get(pk=self.app_deployment.pk)
+        ApplicationDeployment.objects.get(pk=stale.pk).update_from_task(
+            'LAUNCH', 'SUCCESS', {'cloudLaunch': {
+                'instance': {'id': 'i-123'}, 'publicIP': '10.0.0.1'}})
+        stale.update_from_task('HEALTH_CHECK', 'SUCCESS',
+                               {'instance_status': 'running'})
+        deployment = ApplicationDeployment.objects.get(pk=stale.pk)
+        self.assertEqual(deployment.state, ApplicationDeployment.RUNNING)
+        self.assertEqual(deployment.instance_id, 'i-123')
+        self.assertEqual(deployment.public_ip, '10.0.0.1')
+        self.assertEqual(deployment.health_status, 'running')
+
+    def test_launch_result_without_instance(self):
+        """A launch result with a null instance leaves no instance ID."""
+        self.app_deployment.update_from_task(
+            'LAUNCH', 'SUCCESS', {'cloudLaunch': {'instance': None}})
+        self.assertEqual(self.app_deployment.state,
+                         ApplicationDeployment.RUNNING)
+        self.assertIsNone(self.app_deployment.instance_id)
+
+    def test_deployment_state_on_failed_launch(self):
+        """A failed LAUNCH task marks the deployment as failed."""
+        self._finish_task(self._add_task('LAUNCH'), 'FAILURE',
+                          Exception("boom"))
+        self.assertEqual(self.app_deployment.state,
+                         ApplicationDeployment.LAUNCH_FAILED)
+        self.assertFalse(DeploymentInstance.objects.exists())
+
+    def test_launched_instance_is_indexed(self):
+        """Instances map back to their deployment once launched."""
+        launch = self._add_task('LAUNCH')
+        self._finish_task(launch, 'SUCCESS', {'cloudLaunch': {
+            'instance': {'id': 'i-123'}, 'publicIP': '10.0.0.1'}})
+        cloud = self.app_deployment.target_cloud
+        self.assertEqual(DeploymentInstance.find_deployment(
+            cloud, instance_id='i-123'), self.app_deployment)
+        self.assertEqual(DeploymentInstance.find_deployment(
+            cloud.slug, public_ip='10.0.0.1'), self.app_deployment)
+        self.assertIsNone(DeploymentInstance.find_deployment(
+            cloud, instance_id='i-456'))
+        response = self.client.get(reverse('deployments-list'),
+                                   {'instance_id': 'i-123'})
+        self.assertResponse(response, status=200, data_contains={'count': 1})
+        response = self.client.get(reverse('deployments-list'),
+                                   {'public_ip': '10.0.0.2'})
+        self.assertResponse(response, status=200, data_contains={'count': 0})
+
+    def test_reused_instance_is_reassigned(self):
+        """A reused instance ID maps to the deployment that launched last."""
+        deployments = [ApplicationDeployment.objects.create(
+            owner=self.user, name="{0}-{1}".format(self.DEPLOYMENT_NAME, i),
+            application_version=self.app_deployment.application_version,
+            target_cloud=self.app_deployment.target_cloud) for i in range(3)]
+        for deployment, instance_id in zip(deployments,
+                                           ('i-1', 'i-2', 'i-1')):
+            deployment.update_from_task('LAUNCH', 'SUCCESS', {'cloudLaunch': {
+                'instance': {'id': instance_id}, 'publicIP': '10.0.0.1'}})
+        cloud = self.app_deployment.target_cloud
+        self.assertEqual(DeploymentInstance.find_deployment(
+            cloud, instance_id='i-1'), deployments[2])
+        self.assertEqual(DeploymentInstance.find_deployment(
+            cloud, public_ip='10.0.0.1'), deployments[2])
+
+    def test_archived_instances_are_found(self):
+        """Instances of archived deployments still map to them."""
+        deployment = self.app_deployment
+        deployment.update_from_task('LAUNCH', 'SUCCESS', {'cloudLaunch': {
+            'instance': {'id': 'i-123'}, 'publicIP': '10.0.0.1'}})
+        ApplicationDeployment.objects.filter(pk=deployment.pk).update(
+            archived=True, updated='2018-01-01T00:00:00Z')
+        self.assertEqual(archive.archive_deployments(age=30), 1)
+        cloud = deployment.target_cloud
+        archived = DeploymentInstance.find_deployment(cloud,
+                                                      instance_id='i-123')
+        self.assertIsInstance(archived, ArchivedDeployment)
+        self.assertEqual(archived.id, deployment.id)
+        self.assertEqual(DeploymentInstance.find_deployment(
+            cloud, public_ip='10.0.0.1'), archived)
+
+    def test_stream_deployment_events(self):
+        """Task progress and completion are pushed to the event stream."""
+        task = self._add_task('LAUNCH')
+        response = self.client.get(reverse('deployments-events'),
+                                   HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        broker_task = Mock()
+        broker_task.request.id = task.celery_id
+        tasks.Task(broker_task).update_state(state='PROGRESSING',
+                                             meta={'action': 'Booting'})
+        self._finish_task(task, 'SUCCESS', {'cloudLaunch': {}})
+        stream = iter(response.streaming_content)
+        preamble = next(stream).decode('utf-8')
+        self.assertTrue(preamble.startswith('retry: '))
+        progress = next(stream).decode('utf-8')
+        finished = next(stream).decode('utf-8')
+        response.close()
+        self.assertTrue(progress.startswith('event: progress\n'))
+        self.assertIn('"action": "Booting"', progress)
+        self.assertTrue(finished.startswith('id: '))
+        self.assertIn('\nevent: finished\n', finished)
+        self.assertIn('"deployment_state": "RUNNING"', finished)
+        self.assertFalse(events.local_broker._subscribers)
+
+    def test_event_stream_resumes_from_last_event_id(self):
+        """Finished events missed while disconnected are sent again."""
+        seen = self._add_task('HEALTH_CHECK')
+        self._finish_task(seen, 'SUCCESS', {'instance_status': 'running'})
+        seen.refresh_from_db()
+        missed = self._add_task('DELETE')
+        self._finish_task(missed, 'SUCCESS', True)
+        with self.settings(CLOUDLAUNCH_EVENTS_MAX_AGE=0):
+            response = self.client.get(
+                reverse('deployments-events'),
+                HTTP_ACCEPT='text/event-stream',
+                HTTP_LAST_EVENT_ID=seen.updated.isoformat())
+            # The stream ends once it reaches its maximum age
+            chunks = [chunk.decode('utf-8')
+                      for chunk in response.streaming_content]
+        self.assertEqual(len(chunks), 2)
+        self.assertTrue(chunks[0].startswith('retry: '))
+        self.assertIn('\nevent: finished\n', chunks[1])
+        self.assertIn('"task": {0}'.format(missed.id), chunks[1])
+        self.assertIn('"deployment_state": "DELETED"', chunks[1])
+        self.assertFalse(events.local_broker._subscribers)
+
+    def test_bulk_delete_deployments(self):
+        """Apply an action to many deployments with a single request."""
+        for i in range(3):
+            ApplicationDeployment.objects.create(
+                owner=self.user,
+                name="{0}-{1}".format(self.DEPLOYMENT_NAME, i),
+                application_version=self.app_deployment.application_version,
+                target_cloud=self.app_deployment.target_cloud,
+                credentials=self.app_deployment.credentials,
+                archived=(i == 2))
+        with patch('cloudlaunch.view_helpers.group') as mocked_group:
+            response = self.client.post(
+                reverse('deployments-bulk-tasks') + '?archived=False',
+                {'action': 'DELETE'})
+            # Tasks are only dispatched once their rows are committed
+            self.assertFalse(mocked_group.called)
+            self.run_commit_hooks()
+        self.assertResponse(response, status=201)
+        self.assertEqual(len(response.data['tasks']), 3)
+        self.assertEqual(response.data['skipped'], [])
+        self.assertEqual(ApplicationDeploymentTask.objects.filter(
+            action='DELETE').count(), 3)
+        mocked_group.return_value.apply_async.assert_called_once_with()
+        signatures = list(mocked_group.call_args[0][0])
+        credentials = self.app_deployment.credentials.as_dict()
+        self.assertEqual([sig.args[1] for sig in signatures],
+                         [credentials] * 3)
+        self.assertEqual({sig.options['task_id'] for sig in signatures},
+                         {task['celery_id'] for task in
+                          response.data['tasks']})
+
+    def test_bulk_action_on_listed_deployments(self):
+        """Only the listed deployments are acted on."""
+        with patch('cloudlaunch.view_helpers.group'):
+            response = self.client.post(
+                reverse('deployments-bulk-tasks'),
+                {'action': 'HEALTH_CHECK',
+                 'deployments': [self.app_deployment.id]})
+        self.assertResponse(response, status=201)
+        self.assertEqual([t['deployment'] for t in response.data['tasks']],
+                         [self.app_deployment.id])
+
+    def test_bulk_action_idempotency_key_covers_filters(self):
+        """Reusing a key with different filters is a different request."""
+        with patch('cloudlaunch.view_helpers.group'):
+            response = self.client.post(
+                reverse('deployments-bulk-tasks') + '?archived=False',
+                {'action': 'HEALTH_CHECK'}, HTTP_IDEMPOTENCY_KEY='bulk-1')
+            self.assertResponse(response, status=201)
+            response = self.client.post(
+                reverse('deployments-bulk-tasks') + '?archived=True',
+                {'action': 'HEALTH_CHECK'}, HTTP_IDEMPOTENCY_KEY='bulk-1')
+        self.assertResponse(response, status=422)
+
+    def test_list_deployments_with_sparse_fields(self):
+        """Only the requested deployment fields are loaded and output."""
+        ApplicationDeploymentTask.objects.create(
+            deployment=self.app_deployment,
+            action=ApplicationDeploymentTask.LAUNCH)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('deployments-list'),
+                                       {'fields': 'id,name'})
+        self.assertResponse(response, status=200)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'name'})
+        sql = ' '.join(q['sql'] for q in queries.captured_queries)
+        self.assertNotIn('application_config', sql)
+        self.assertNotIn('cloudlaunch_applicationdeploymenttask', sql)
+
+    def test_list_deployments_omitting_fields(self):
+        """Fields passed to omit are left out of the response."""
+        response = self.client.get(reverse('deployments-list'),
+                                   {'omit': 'latest_task,launch_task'})
+        self.assertResponse(response, status=200)
+        result = response.data['results'][0]
+        self.assertNotIn('latest_task', result)
+        self.assertNotIn('launch_task', result)
+        self.assertEqual(result['name'], self.DEPLOYMENT_NAME)
+
 
 class ApplicationDeploymentTaskModelTestCase(TestCase):
 
@@ -559,3 +1527,221 @@ class ApplicationDeploymentTaskModelTestCase(TestCase):
                 action=ApplicationDeploymentTask.LAUNCH)
         self.assertEqual(str(cm.exception), "Duplicate LAUNCH action for "
                                             "deployment test-deployment")
+
+    def test_filter_on_json_keys(self):
+        """Stored JSON is decoded on load and its keys can be filtered on."""
+        self.app_deployment.application_config = {
+            'config_cloudlaunch': {'vmType': 'm1.small'}}
+        self.app_deployment.save()
+        task = ApplicationDeploymentTask.objects.create(
+            deployment=self.app_deployment,
+            action=ApplicationDeploymentTask.HEALTH_CHECK,
+            _status='SUCCESS',
+            _result={'cloudLaunch': {'instance': {'id': 'i-123'}}})
+        deployment = ApplicationDeployment.objects.get(
+            application_config__config_cloudlaunch__vmType='m1.small')
+        self.assertEqual(deployment.application_config,
+                         {'config_cloudlaunch': {'vmType': 'm1.small'}})
+        self.assertFalse(ApplicationDeployment.objects.filter(
+            application_config__config_cloudlaunch__vmType='m1.large'))
+        self.assertEqual(ApplicationDeploymentTask.objects.get(
+            _result__cloudLaunch__instance__id='i-123'), task)
+        self.assertEqual(task.result,
+                         {'cloudLaunch': {'instance': {'id': 'i-123'}}})
+
+
+class ApplicationVersionCloudConfigModelTestCase(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.application = Application.objects.create(
+            name="Ubuntu",
+            status=Application.LIVE,
+            default_launch_config=json.dumps({'foo': 1, 'bar': 1}),
+        )
+        self.application_version = ApplicationVersion.objects.create(
+            application=self.application,
+            version="16.04",
+            default_launch_config=json.dumps({'bar': 2}),
+        )
+        target_cloud = cb_models.AWS.objects.create(
+            name='Amazon US East 1 - N. Virginia',
+            kind='cloud',
+        )
+        self.cloud_config = ApplicationVersionCloudConfig.objects.create(
+            application_version=self.application_version,
+            cloud=target_cloud,
+            image=CloudImage.objects.create(image_id='abc123',
+                                            cloud=target_cloud),
+            default_launch_config=json.dumps({'baz': 3}),
+        )
+
+    def test_merged_config_stored_on_save(self):
+        """Test the merged config is stored when a cloud config is saved."""
+        self.assertEqual(json.loads(self.cloud_config.merged_launch_config),
+                         {'foo': 1, 'bar': 2, 'baz': 3})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cloud_config.get_merged_config(),
+                             {'foo': 1, 'bar': 2, 'baz': 3})
+
+    def test_merged_config_refreshed_on_parent_save(self):
+        """Test the merged config is refreshed when app or version change."""
+        self.application.default_launch_config = json.dumps({'foo': 4})
+        self.application.save()
+        self.cloud_config.refresh_from_db()
+        self.assertEqual(self.cloud_config.get_merged_config(),
+                         {'foo': 4, 'bar': 2, 'baz': 3})
+        self.application_version.default_launch_config = json.dumps(
+            {'bar': 5})
+        self.application_version.save()
+        self.cloud_config.refresh_from_db()
+        self.assertEqual(self.cloud_config.get_merged_config(),
+                         {'foo': 4, 'bar': 5, 'baz': 3})
+
+
+class CloudManEC2CacheTestCase(TestCase):
+
+    def _create_provider(self, password='password'):
+        provider = Mock(auth_url='https://keystone:5000/v3',
+                        region_name='RegionOne', project_name='project',
+                        project_domain_name='default',
+                        user_domain_name='default', username='user',
+                        password=password)
+        provider.security.get_ec2_endpoints.return_value = {
+            'ec2_endpoint': 'https://ec2:8773/services/Cloud',
+            's3_endpoint': None}
+        provider.security.get_or_create_ec2_credentials.return_value = Mock(
+            access='access', secret='secret')
+        return provider
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_ec2_info_is_cached_per_credentials(self):
+        """EC2 endpoints and credentials are only fetched once per user."""
+        provider = self._create_provider()
+        for _ in range(2):
+            self.assertEqual(
+                cloudman_app.get_ec2_endpoints(provider)['ec2_endpoint'],
+                'https://ec2:8773/services/Cloud')
+            self.assertEqual(cloudman_app.get_ec2_credentials(provider),
+                             {'access': 'access', 'secret': 'secret'})
+        provider.security.get_ec2_endpoints.assert_called_once_with()
+        provider.security.get_or_create_ec2_credentials.assert_called_once_with()
+        other_user = self._create_provider(password='other')
+        cloudman_app.get_ec2_credentials(other_user)
+        other_user.security.get_or_create_ec2_credentials.assert_called_once_with()
+
+    def test_invalidate_ec2_cache(self):
+        """Invalidated EC2 info is fetched again."""
+        provider = self._create_provider()
+        cloudman_app.get_ec2_endpoints(provider)
+        cloudman_app.invalidate_ec2_cache(provider)
+        cloudman_app.get_ec2_endpoints(provider)
+        self.assertEqual(provider.security.get_ec2_endpoints.call_count, 2)
+
+    def test_failed_validation_invalidates_ec2_cache(self):
+        """EC2 info is fetched again after it failed validation."""
+        provider = self._create_provider()
+        provider.PROVIDER_ID = 'openstack'
+        provider.security.get_ec2_endpoints.return_value = {}
+        app_config = {'config_cloudman': {
+            'defaultBucket': 'bucket', 'clusterPassword': 'password',
+            'clusterType': 'Galaxy', 'storageType': 'volume'}}
+        for _ in range(2):
+            with self.assertRaises(ValidationError):
+                cloudman_app.CloudManAppPlugin.validate_app_config(
+                    provider, 'cluster', {}, app_config)
+        self.assertEqual(provider.security.get_ec2_endpoints.call_count, 2)
+
+    def test_changed_credentials_invalidate_ec2_cache(self):
+        """EC2 info cached for credentials is dropped when they change."""
+        cloud = cb_models.OpenStack.objects.create(
+            name='OpenStack', kind='cloud',
+            auth_url='https://keystone:5000/v3', region_name='RegionOne')
+        user_profile = cb_models.UserProfile.objects.create(
+            user=User.objects.create(username='test-user'))
+        credentials = cb_models.OpenStackCredentials.objects.create(
+            cloud=cloud, user_profile=user_profile, username='user',
+            password='password', project_name='project')
+        provider = domain_model.get_cloud_provider(cloud,
+                                                   credentials.as_dict())
+        key = cloudman_app._get_ec2_cache_key(provider, 'credentials')
+        cache.set(key, {'access': 'access', 'secret': 'secret'})
+        credentials.password = 'changed'
+        credentials.save()
+        self.assertIsNone(cache.get(key))
+
+
+class ProviderPoolTestCase(TestCase):
+
+    CREDENTIALS = {'aws_access_key': 'access', 'aws_secret_key': 'secret'}
+
+    def setUp(self):
+        super().setUp()
+        self.cloud = cb_models.AWS.objects.create(
+            name='Amazon US East 1 - N. Virginia',
+            kind='cloud',
+        )
+        patcher = patch('cloudlaunch.providers.domain_model.'
+                        'get_cloud_provider', side_effect=lambda *a: Mock())
+        self.create_provider = patcher.start()
+        self.addCleanup(patcher.stop)
+        providers.provider_pool.clear()
+        self.addCleanup(providers.provider_pool.clear)
+
+    def test_providers_are_reused_per_credentials(self):
+        """A provider is only created once per cloud and credentials."""
+        provider = providers.get_cloud_provider(self.cloud, self.CREDENTIALS)
+        self.assertIs(providers.get_cloud_provider(
+            self.cloud, dict(self.CREDENTIALS)), provider)
+        other = providers.get_cloud_provider(
+            self.cloud, dict(self.CREDENTIALS, aws_secret_key='other'))
+        self.assertIsNot(other, provider)
+        self.assertEqual(self.create_provider.call_count, 2)
+
+    def test_expired_providers_are_recreated(self):
+        """Providers are not reused after their TTL."""
+        pool = providers.ProviderPool(max_size=2, ttl=60)
+        with patch('cloudlaunch.providers.time.monotonic', return_value=0):
+            provider = pool.get(self.cloud, self.CREDENTIALS)
+        with patch('cloudlaunch.providers.time.monotonic', return_value=61):
+            self.assertIsNot(pool.get(self.cloud, self.CREDENTIALS), provider)
+
+    def test_least_recently_used_providers_are_evicted(self):
+        """The pool drops the least recently used provider when full."""
+        pool = providers.ProviderPool(max_size=2, ttl=60)
+        first = pool.get(self.cloud, {'key': 1})
+        pool.get(self.cloud, {'key': 2})
+        pool.get(self.cloud, {'key': 1})
+        pool.get(self.cloud, {'key': 3})
+        self.assertEqual(len(pool), 2)
+        self.assertIs(pool.get(self.cloud, {'key': 1}), first)
+        self.assertEqual(self.create_provider.call_count, 3)
+
+    def test_saving_cloud_clears_its_providers(self):
+        """Providers are recreated once the cloud settings change."""
+        provider = providers.get_cloud_provider(self.cloud, self.CREDENTIALS)
+        providers.discard_cloud_provider(self.cloud, self.CREDENTIALS)
+        provider = providers.get_cloud_provider(self.cloud, self.CREDENTIALS)
+        self.cloud.region_name = 'us-west-2'
+        self.cloud.save()
+        self.assertIsNot(
+            providers.get_cloud_provider(self.cloud, self.CREDENTIALS),
+            provider)
+        self.assertEqual(self.create_provider.call_count, 3)
+
+    def test_changed_cloud_settings_are_not_reused(self):
+        """A cloud changed by another process gets a new provider."""
+        provider = providers.get_cloud_provider(self.cloud, self.CREDENTIALS)
+        cb_models.AWS.objects.filter(pk=self.cloud.pk).update(
+            region_name='us-west-2')
+        cloud = cb_models.Cloud.objects.get(pk=self.cloud.pk)
+        self.assertIsNot(
+            providers.get_cloud_provider(cloud, self.CREDENTIALS), provider)
+        self.assertIs(
+            providers.get_cloud_provider(cloud, self.CREDENTIALS),
+            providers.get_cloud_provider(
+                cb_models.AWS.objects.get(pk=self.cloud.pk),
+                self.CREDENTIALS))
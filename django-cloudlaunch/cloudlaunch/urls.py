@@ -31,8 +31,11 @@ router = HybridDefaultRouter()
 router.register(r'infrastructure', views.InfrastructureView,
                 base_name='infrastructure')
 router.register(r'applications', views.ApplicationViewSet)
+router.register(r'catalog', views.CatalogSnapshotView, base_name='catalog')
 # router.register(r'images', views.ImageViewSet)
 router.register(r'deployments', views.DeploymentViewSet, base_name='deployments')
+router.register(r'archived_deployments', views.ArchivedDeploymentViewSet,
+                base_name='archived_deployments')
 router.register(r'auth', views.AuthView, base_name='auth')
 router.register(r'cors_proxy', views.CorsProxyView, base_name='corsproxy')
 deployments_router = HybridNestedRouter(router, r'deployments',
@@ -42,6 +45,8 @@ deployments_router.register(r'tasks', views.DeploymentTaskViewSet,
 
 # Extend djcloudbridge endpoints
 cloud_router.register(r'cloudman', views.CloudManViewSet, base_name='cloudman')
+cloud_router.register(r'applications', views.CloudApplicationViewSet,
+                      base_name='cloud_application')
 
 infrastructure_regex_pattern = r'api/v1/infrastructure/'
 auth_regex_pattern = r'api/v1/auth/'
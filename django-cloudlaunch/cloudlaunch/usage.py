@@ -0,0 +1,177 @@
+"""
+Buffered recording of launch usage.
+
+Launch requests do not write ``Usage`` rows themselves. They add a usage
+event to a process-local buffer, which is handed to the ``record_usage``
+Celery task in batches. The task sanitises the app configs and inserts the
+whole batch with a single ``bulk_create``.
+
+The buffer is flushed after a request once it holds
+``CLOUDLAUNCH_USAGE_BATCH_SIZE`` events, by a timer once its oldest event
+is ``CLOUDLAUNCH_USAGE_FLUSH_INTERVAL`` seconds old, and when the process
+exits. Events buffered by a process that is killed are lost, so keep the
+interval short or set the batch size to 1 to record each launch at once.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import models
+from . import util
+
+log = logging.getLogger(__name__)
+
+
+def get_batch_size():
+    return getattr(settings, 'CLOUDLAUNCH_USAGE_BATCH_SIZE', 50)
+
+
+def get_flush_interval():
+    return getattr(settings, 'CLOUDLAUNCH_USAGE_FLUSH_INTERVAL', 10)
+
+
+class UsageBuffer(object):
+    """
+    Collect usage events until they are due to be recorded.
+
+    ``on_due`` is called from a timer thread once the oldest buffered event
+    is ``CLOUDLAUNCH_USAGE_FLUSH_INTERVAL`` seconds old.
+    """
+
+    def __init__(self, on_due=None):
+        self._lock = threading.Lock()
+        self._events = []
+        self._first_added = None
+        self._timer = None
+        self.on_due = on_due
+
+    def add(self, event):
+        with self._lock:
+            if not self._events:
+                self._first_added = time.monotonic()
+                if self.on_due:
+                    self._timer = threading.Timer(get_flush_interval(),
+                                                  self.on_due)
+                    self._timer.daemon = True
+                    self._timer.start()
+            self._events.append(event)
+
+    def is_due(self):
+        # Read without the lock; a stale answer only delays a flush
+        if not self._events:
+            return False
+        return (len(self._events) >= get_batch_size() or
+                time.monotonic() - self._first_added >= get_flush_interval())
+
+    def pop_all(self):
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            events, self._events = self._events, []
+            return events
+
+    def clear(self):
+        self.pop_all()
+
+    def __len__(self):
+        return len(self._events)
+
+
+def record(app_version_cloud_config, app_deployment, app_config, user):
+    """
+    Record the launch of a deployment.
+
+    :type app_config: ``dict``
+    :param app_config: The app config the deployment was launched with. It
+                       is sanitised by the application's plugin before it
+                       is stored.
+    """
+    version = app_deployment.application_version
+    usage_buffer.add({
+        'app_version_cloud_config': app_version_cloud_config.pk,
+        'app_deployment': app_deployment.pk,
+        'user': user.pk,
+        'app_config': app_config,
+        'plugin': version.backend_component_name,
+        'added': timezone.now().isoformat()})
+    if get_batch_size() <= 1:
+        flush()
+
+
+def flush():
+    """Hand all buffered usage events to the ``record_usage`` task."""
+    from . import tasks  # tasks depends on this module
+
+    events = usage_buffer.pop_all()
+    if not events:
+        return
+    try:
+        tasks.record_usage.delay(events)
+    except Exception:
+        log.exception("Could not queue %s usage events; recording them "
+                      "directly", len(events))
+        save(events)
+
+
+def flush_if_due():
+    """Flush the usage buffer if it is full or holds old events."""
+    if usage_buffer.is_due():
+        flush()
+
+
+def _flush_from_timer():
+    try:
+        flush()
+    except Exception:
+        log.exception("Could not flush the usage buffer")
+    finally:
+        # The timer thread's database connections are not reused
+        connections.close_all()
+
+
+usage_buffer = UsageBuffer(on_due=_flush_from_timer)
+atexit.register(flush)
+
+
+def save(events):
+    """
+    Store the supplied usage events with a single insert.
+
+    Events about deployments that no longer exist, e.g., because their
+    creation was rolled back, are dropped.
+    """
+    deployment_ids = set(models.ApplicationDeployment.objects.filter(
+        pk__in={event['app_deployment'] for event in events}).values_list(
+            'pk', flat=True))
+    plugins = {}
+    usage = []
+    for event in events:
+        if event['app_deployment'] not in deployment_ids:
+            log.debug("Dropping usage of missing deployment %s",
+                      event['app_deployment'])
+            continue
+        plugin = event['plugin']
+        if plugin not in plugins:
+            plugins[plugin] = util.import_class(plugin)
+        try:
+            app_config = plugins[plugin].sanitise_app_config(
+                event['app_config'])
+        except Exception as exc:
+            # Never store an unsanitised config
+            log.warning("Could not sanitise the app config of deployment "
+                        "%s: %s", event['app_deployment'], exc)
+            app_config = None
+        usage.append(models.Usage(
+            app_version_cloud_config_id=event['app_version_cloud_config'],
+            app_deployment_id=event['app_deployment'],
+            user_id=event['user'], app_config=app_config,
+            added=parse_datetime(event['added'])))
+    models.Usage.objects.bulk_create(usage)
+    return len(usage)
@@ -2,6 +2,19 @@
 from importlib import import_module
 
 
+class LaunchValidationError(Exception):
+    """
+    Raised by a launch task when the app config fails plugin validation.
+
+    ``detail`` holds the validation errors, in the format returned by the
+    API for synchronous launches.
+    """
+
+    def __init__(self, detail):
+        super(LaunchValidationError, self).__init__(detail)
+        self.detail = detail
+
+
 def import_class(name):
     parts = name.rsplit('.', 1)
     cls = getattr(import_module(parts[0]), parts[1])
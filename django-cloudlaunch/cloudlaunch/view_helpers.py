@@ -1,8 +1,15 @@
+from celery import group
+from django.db import transaction
+
+from djcloudbridge import models as cb_models
 from djcloudbridge import view_helpers as cb_view_helpers
 from djcloudbridge import domain_model
 from . import models
+from . import providers
+from . import tasks
 
 import json
+import uuid
 
 def get_cloud_provider(view, cloud_id=None):
     """
@@ -11,4 +18,74 @@ def get_cloud_provider(view, cloud_id=None):
     from the request or user profile. Return ``None`` if no credentials were
     retrieved.
     """
-    return cb_view_helpers.get_cloud_provider(view, cloud_id)
+    cloud_pk = cloud_id or view.kwargs.get("cloud_pk")
+    cloud = cb_models.Cloud.objects.filter(
+        slug=cloud_pk).select_subclasses().first()
+    return providers.get_cloud_provider(
+        cloud, cb_view_helpers.get_credentials(cloud, view.request))
+
+
+def create_deployment_tasks(deployments, action, request=None):
+    """
+    Start the supplied action on each of the supplied deployments.
+
+    Deployments use their stored credentials or, if they have none, the
+    credentials supplied with ``request``. Credentials are resolved once per
+    (cloud, credentials) pair. The deployment tasks are inserted in bulk and
+    dispatched as a single Celery group once the transaction commits, so
+    workers always find the task rows of the tasks they run.
+
+    :type deployments: ``list`` of :class:`.models.ApplicationDeployment`
+    :param deployments: Deployments to act on.
+
+    :type action: ``str``
+    :param action: One of the actions in ``tasks.ACTION_TASKS``.
+
+    :type request: :class:`rest_framework.request.Request`
+    :param request: Request to take credentials from for deployments without
+                    stored credentials. Such deployments are skipped if no
+                    request is supplied.
+
+    :rtype: ``tuple``
+    :return: The created ``ApplicationDeploymentTask`` objects and the
+             deployments that were skipped for lack of credentials.
+    """
+    task = tasks.ACTION_TASKS[action]
+    deployments = list(deployments)
+    stored_credentials = {
+        credentials.id: credentials.as_dict()
+        for credentials in cb_models.Credentials.objects.filter(
+            id__in={d.credentials_id for d in deployments
+                    if d.credentials_id}).select_subclasses()}
+    request_credentials = {}
+    deployment_tasks = []
+    signatures = []
+    skipped = []
+    for deployment in deployments:
+        if deployment.credentials_id:
+            credentials = stored_credentials.get(deployment.credentials_id)
+        elif request:
+            if deployment.target_cloud_id not in request_credentials:
+                request_credentials[deployment.target_cloud_id] = (
+                    cb_view_helpers.get_credentials(deployment.target_cloud,
+                                                    request))
+            credentials = request_credentials[deployment.target_cloud_id]
+        else:
+            credentials = None
+        if not credentials:
+            skipped.append(deployment)
+            continue
+        deployment_task = models.ApplicationDeploymentTask(
+            action=action, deployment=deployment, celery_id=str(uuid.uuid4()))
+        deployment_tasks.append(deployment_task)
+        signatures.append(task.s(deployment.pk, credentials).set(
+            task_id=deployment_task.celery_id))
+    if not deployment_tasks:
+        return [], skipped
+    with transaction.atomic():
+        models.ApplicationDeploymentTask.objects.bulk_create(deployment_tasks)
+        transaction.on_commit(lambda: group(signatures).apply_async())
+    # Not all databases return the IDs of bulk inserted rows
+    return list(models.ApplicationDeploymentTask.objects.filter(
+        celery_id__in=[t.celery_id for t in deployment_tasks]).order_by(
+            'id')), skipped
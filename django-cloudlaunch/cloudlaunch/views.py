@@ -1,6 +1,19 @@
+import functools
+import hashlib
+import json
+import time
+
+from celery import states
 from django.http import HttpResponse
+from django.http import HttpResponseNotModified
 from django.http.response import FileResponse
 from django.http.response import Http404
+from django.http.response import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.cache import patch_vary_headers
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_etags
 from django_filters import rest_framework as dj_filters
 from rest_framework import authentication
 from rest_framework import filters
@@ -11,34 +24,263 @@ from rest_framework import renderers
 from rest_framework import status
 from rest_framework import viewsets
 from rest_framework.authtoken.models import Token
+from rest_framework.compat import coreapi
+from rest_framework.compat import coreschema
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
+from rest_framework.settings import api_settings
+from rest_framework.utils import encoders
 from rest_framework.views import APIView
 import requests
 
 from djcloudbridge import drf_helpers
+from . import catalog
+from . import events
 from . import models
+from . import search
 from . import serializers
 from . import view_helpers
 
 
-class CustomApplicationPagination(PageNumberPagination):
+class OptionalCursorPagination(PageNumberPagination):
+    """
+    Page number pagination with opt-in cursor pagination.
+
+    Requests including ``?pagination=cursor`` are paginated with a cursor
+    over the view's ordering instead. This avoids the ``COUNT`` and
+    ``OFFSET`` queries of page numbers so deep pages cost the same as the
+    first one. Requests with any of ``cursor_excluded_params`` set, whose
+    results are not in the view's ordering, are paginated with page numbers
+    regardless.
+    """
+    page_size_query_param = 'page_size'
+    # Keep clients from turning a page into an unbounded query
+    max_page_size = 200
+    pagination_query_param = 'pagination'
+    cursor_excluded_params = ()
+    cursor_paginator = None
+
+    def uses_cursor(self, request):
+        """Check whether the request is to be paginated with a cursor."""
+        return (request.query_params.get(self.pagination_query_param) ==
+                'cursor' and not any(request.query_params.get(param)
+                                     for param in self.cursor_excluded_params))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.uses_cursor(request):
+            self.cursor_paginator = CursorPagination()
+            self.cursor_paginator.page_size = self.page_size
+            self.cursor_paginator.page_size_query_param = (
+                self.page_size_query_param)
+            self.cursor_paginator.max_page_size = self.max_page_size
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view)
+        self.cursor_paginator = None
+        return super(OptionalCursorPagination, self).paginate_queryset(
+            queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super(OptionalCursorPagination, self).get_paginated_response(
+            data)
+
+    def get_html_context(self):
+        if self.cursor_paginator:
+            return self.cursor_paginator.get_html_context()
+        return super(OptionalCursorPagination, self).get_html_context()
+
+    def get_schema_fields(self, view):
+        fields = super(OptionalCursorPagination, self).get_schema_fields(view)
+        return fields + [coreapi.Field(
+            name=self.pagination_query_param,
+            required=False,
+            location='query',
+            schema=coreschema.Enum(
+                enum=['cursor'],
+                description="Set to 'cursor' to paginate with a cursor "
+                            "instead of page numbers."))]
+
+
+class CustomApplicationPagination(OptionalCursorPagination):
     page_size_query_param = 'page_size'
+    # Search results are ordered by rank, which a cursor would replace with
+    # the view's ordering
+    cursor_excluded_params = (api_settings.SEARCH_PARAM,)
+
+
+class SparseFieldsQuerySetMixin(object):
+    """
+    Skip loading what the fields dropped with ``?fields=``/``?omit=`` need.
+
+    Model columns read only by dropped fields are deferred and the related
+    objects they output are no longer selected or prefetched. The view's
+    serializer must use ``serializers.SparseFieldsMixin``.
+    """
+
+    def filter_queryset(self, queryset):
+        queryset = super(SparseFieldsQuerySetMixin, self).filter_queryset(
+            queryset)
+        serializer = self.get_serializer()
+        if not isinstance(serializer, serializers.SparseFieldsMixin):
+            # e.g. the serializer of an extra action
+            return queryset
+        unused = serializer.get_unused_sources()
+        if not unused:
+            return queryset
+        lookups = queryset._prefetch_related_lookups
+        kept_lookups = [
+            lookup for lookup in lookups
+            if getattr(lookup, 'prefetch_through', lookup).split('__')[0]
+            not in unused]
+        if len(kept_lookups) != len(lookups):
+            queryset = queryset.prefetch_related(None).prefetch_related(
+                *kept_lookups)
+        selected = queryset.query.select_related
+        if isinstance(selected, dict):
+            paths = self._get_select_related_paths(selected)
+            kept_paths = [path for path in paths
+                          if path.split('__')[0] not in unused]
+            if len(kept_paths) != len(paths):
+                queryset = queryset.select_related(None)
+                if kept_paths:
+                    queryset = queryset.select_related(*kept_paths)
+        # Columns used to order the results (and build pagination cursors)
+        # must still be loaded
+        ordering = {field.lstrip('-').split('__')[0]
+                    for field in queryset.query.order_by
+                    if isinstance(field, str)}
+        deferred = [
+            field.name for field in queryset.model._meta.concrete_fields
+            if field.name in unused and field.name not in ordering and
+            not field.primary_key and not (
+                field.is_relation and
+                queryset.query.select_related is True)]
+        return queryset.defer(*deferred) if deferred else queryset
+
+    def _get_select_related_paths(self, selected, prefix=''):
+        paths = []
+        for name, nested in selected.items():
+            path = prefix + name
+            if nested:
+                paths.extend(
+                    self._get_select_related_paths(nested, path + '__'))
+            else:
+                paths.append(path)
+        return paths
+
+
+class CatalogETagMixin(object):
+    """
+    Answer catalog reads with an ETag derived from the catalog revision.
+
+    Requests carrying a matching ``If-None-Match`` header get a
+    ``304 Not Modified`` response without the catalog being serialized.
+    The browsable API is excluded since its pages are user specific.
+    """
+
+    def get_catalog_etag(self, request):
+        if request.accepted_renderer.format == 'api':
+            return None
+        revision = models.CatalogRevision.get_current()
+        variant = "{0}|{1}|{2}".format(request.get_host(),
+                                       request.get_full_path(),
+                                       request.accepted_media_type)
+        return '"{0}-{1}"'.format(
+            revision, hashlib.md5(variant.encode('utf-8')).hexdigest())
+
+    def conditional_response(self, request, handler, *args, **kwargs):
+        etag = self.get_catalog_etag(request)
+        if not etag:
+            return handler(request, *args, **kwargs)
+        if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if '*' in if_none_match or etag in [
+                tag[2:] if tag.startswith('W/') else tag
+                for tag in if_none_match]:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (status.HTTP_200_OK,
+                                    status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            patch_cache_control(response, no_cache=True)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request, super(CatalogETagMixin, self).list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request, super(CatalogETagMixin, self).retrieve, *args, **kwargs)
+
+
+class CatalogSearchFilter(filters.SearchFilter):
+    """
+    Ranked full-text search over applications.
+
+    Matches are ordered by relevance unless an explicit ordering was
+    requested.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        search_terms = self.get_search_terms(request)
+        if not search_terms:
+            return queryset
+        queryset = search.search_applications(queryset, search_terms)
+        if not request.query_params.get(api_settings.ORDERING_PARAM):
+            queryset = queryset.order_by('-search_rank',
+                                         *queryset.query.order_by)
+        return queryset
 
-class ApplicationViewSet(viewsets.ModelViewSet):
+
+class ApplicationViewSet(CatalogETagMixin, SparseFieldsQuerySetMixin,
+                         viewsets.ModelViewSet):
     """
     API endpoint that allows applications to be viewed or edited.
     """
-    queryset = models.Application.objects.filter(status=models.Application.LIVE)
+    queryset = models.Application.objects.filter(
+        status=models.Application.LIVE).with_catalog_tree()
     serializer_class = serializers.ApplicationSerializer
-    filter_backends = (filters.OrderingFilter,filters.SearchFilter)
-    search_fields = ('slug',)
-    ordering = ('display_order',)
+    filter_backends = (filters.OrderingFilter, CatalogSearchFilter)
+    search_fields = ('slug', 'name', 'summary', 'description', 'maintainer',
+                     'category__name')
+    ordering = ('display_order', 'slug')
     pagination_class = CustomApplicationPagination
 
 
+class CatalogSnapshotView(APIView):
+    """
+    Return all live applications as a single, prebuilt document.
+
+    The document is rendered once per catalog revision and served
+    precompressed according to the request's ``Accept-Encoding`` header.
+    """
+
+    def get(self, request, format=None):
+        encoding = catalog.choose_encoding(
+            request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        snapshot_id, snapshot = catalog.open_snapshot(request, encoding)
+        etag = '"{0}-{1}"'.format(snapshot_id, encoding)
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            snapshot.close()
+            response = HttpResponseNotModified()
+        else:
+            response = FileResponse(snapshot,
+                                    content_type='application/json')
+            if encoding != 'identity':
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        patch_cache_control(response, no_cache=True)
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
 class InfrastructureView(APIView):
     """
     List kinds in infrastructures.
@@ -102,15 +344,133 @@ class CloudManViewSet(drf_helpers.CustomReadOnlySingleViewSet):
     serializer_class = serializers.CloudManSerializer
 
 
-class DeploymentViewSet(viewsets.ModelViewSet):
+class CloudApplicationViewSet(SparseFieldsQuerySetMixin,
+                              viewsets.ReadOnlyModelViewSet):
+    """
+    List applications that can be launched on a cloud.
+    """
+    serializer_class = serializers.LaunchableApplicationSerializer
+    # The index is small per cloud so return it whole, in a single query
+    pagination_class = None
+
+    def get_queryset(self):
+        return models.LaunchableApplication.objects.filter(
+            cloud_id=self.kwargs.get('cloud_pk')).order_by(
+                'display_order', 'application_id', 'version')
+
+
+# Response headers replayed along with responses to idempotent requests
+IDEMPOTENT_RESPONSE_HEADERS = ('Location', 'Preference-Applied')
+
+
+def _get_request_fingerprint(request):
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    return hashlib.sha256(json.dumps(
+        [request.method, request.get_full_path(), data], sort_keys=True,
+        cls=encoders.JSONEncoder).encode('utf-8')).hexdigest()
+
+
+def idempotent(handler):
+    """
+    Act on a request carrying an ``Idempotency-Key`` header only once.
+
+    The first successful response to a request with a given key is stored
+    and returned, with an ``Idempotent-Replayed`` header, to repeated
+    requests with the same key instead of calling the handler again. Reusing
+    a key for a different request is rejected with ``422``, and so is
+    retrying while the first request is still being handled, with ``409``.
+    Responses with an error status are not stored so the request can be
+    retried under the same key.
+    """
+    @functools.wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.META.get('HTTP_IDEMPOTENCY_KEY')
+        if not key:
+            return handler(self, request, *args, **kwargs)
+        if len(key) > models.IdempotencyKey._meta.get_field(
+                'key').max_length:
+            raise ValidationError({'Idempotency-Key': "Key is too long."})
+        fingerprint = _get_request_fingerprint(request)
+        record, claimed = models.IdempotencyKey.claim(
+            request.user, key, fingerprint)
+        if not claimed:
+            if record.fingerprint != fingerprint:
+                return Response(
+                    {'detail': "Idempotency-Key was already used for a "
+                               "different request."},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if record.response_status is None:
+                return Response(
+                    {'detail': "A request with this Idempotency-Key is "
+                               "still being processed."},
+                    status=status.HTTP_409_CONFLICT)
+            response = Response(json.loads(record.response_body),
+                                status=record.response_status,
+                                headers=json.loads(record.response_headers))
+            response['Idempotent-Replayed'] = 'true'
+            return response
+        try:
+            response = handler(self, request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+        if status.is_success(response.status_code):
+            record.store_response(
+                response.status_code,
+                {header: response[header]
+                 for header in IDEMPOTENT_RESPONSE_HEADERS
+                 if response.has_header(header)},
+                json.dumps(response.data, cls=encoders.JSONEncoder))
+        else:
+            record.delete()
+        return response
+    return wrapper
+
+
+class EventStreamRenderer(renderers.BaseRenderer):
+    """Negotiate ``text/event-stream``; errors are rendered as JSON."""
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data)
+
+
+class DeploymentFilter(dj_filters.FilterSet):
+    """
+    Filters of the deployment list.
+
+    ``application``, ``version`` and ``target_cloud`` take slugs or version
+    strings as used when creating a deployment; ``added_after`` and
+    ``added_before`` take ISO 8601 timestamps. ``instance_id`` and
+    ``public_ip`` find the deployment a cloud instance belongs to.
+    """
+    application = dj_filters.CharFilter(
+        field_name='application_version__application')
+    version = dj_filters.CharFilter(field_name='application_version__version')
+    target_cloud = dj_filters.CharFilter(field_name='target_cloud')
+    added = dj_filters.IsoDateTimeFromToRangeFilter()
+    instance_id = dj_filters.CharFilter(field_name='instances__instance_id')
+    public_ip = dj_filters.CharFilter(field_name='instances__public_ip')
+
+    class Meta:
+        model = models.ApplicationDeployment
+        fields = ('archived', 'state', 'health_status', 'application_version')
+
+
+class DeploymentViewSet(SparseFieldsQuerySetMixin, viewsets.ModelViewSet):
     """
     List compute related urls.
     """
     permission_classes = (IsAuthenticated,)
     serializer_class = serializers.DeploymentSerializer
     filter_backends = (filters.OrderingFilter,dj_filters.DjangoFilterBackend)
-    ordering = ('-added',)
-    filter_fields = ('archived',)
+    ordering = ('-added', 'id')
+    pagination_class = OptionalCursorPagination
+    filterset_class = DeploymentFilter
 
     def get_queryset(self):
         """
@@ -118,15 +478,186 @@ class DeploymentViewSet(viewsets.ModelViewSet):
         for the currently authenticated user.
         """
         user = self.request.user
-        return models.ApplicationDeployment.objects.filter(owner=user)
+        return models.ApplicationDeployment.objects.filter(
+            owner=user).with_task_summary()
+
+    def prefers_async(self, request):
+        """Check whether the request carries ``Prefer: respond-async``."""
+        preferences = request.META.get('HTTP_PREFER', '')
+        return 'respond-async' in [
+            preference.split(';')[0].split('=')[0].strip().lower()
+            for preference in preferences.split(',')]
+
+    def get_serializer_context(self):
+        context = super(DeploymentViewSet, self).get_serializer_context()
+        context['respond_async'] = (self.action == 'create' and
+                                    self.prefers_async(self.request))
+        return context
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        """
+        Create a deployment and launch it.
+
+        With a ``Prefer: respond-async`` header, the deployment is created
+        without contacting the cloud and ``202 Accepted`` is returned right
+        away. The launch config is then validated by the launch task, which
+        fails with the validation errors if the config is invalid.
+        """
+        response = super(DeploymentViewSet, self).create(
+            request, *args, **kwargs)
+        if self.prefers_async(request):
+            response.status_code = status.HTTP_202_ACCEPTED
+            response['Preference-Applied'] = 'respond-async'
+            response['Location'] = reverse(
+                'deployments-detail', kwargs={'pk': response.data['id']},
+                request=request)
+        return response
+
+    @action(detail=False, methods=['post'],
+            serializer_class=serializers.DeploymentBulkCreateSerializer)
+    @idempotent
+    def bulk(self, request):
+        """
+        Launch many deployments of an application with the same config.
 
+        Takes a list of deployment ``names`` along with the ``application``,
+        ``application_version``, ``target_cloud`` and optional
+        ``config_app`` accepted when creating a single deployment.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        deployments = serializer.save()
+        return Response(
+            serializers.DeploymentSerializer(
+                deployments, many=True,
+                context=self.get_serializer_context()).data,
+            status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'], url_path='bulk/tasks',
+            serializer_class=serializers.DeploymentBulkTaskSerializer)
+    @idempotent
+    def bulk_tasks(self, request):
+        """
+        Apply an action to many deployments at once.
 
-class DeploymentTaskViewSet(viewsets.ModelViewSet):
+        Acts on the deployments listed in ``deployments`` or, if omitted, on
+        all deployments matching the query string filters (e.g.
+        ``?archived=False``). Deployments without stored credentials use the
+        credentials supplied with the request.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        queryset = self.filter_queryset(self.get_queryset()).select_related(
+            'target_cloud')
+        ids = serializer.validated_data.get('deployments')
+        if ids is not None:
+            queryset = queryset.filter(pk__in=ids)
+        deployments = list(queryset[:serializer.MAX_DEPLOYMENTS + 1])
+        if len(deployments) > serializer.MAX_DEPLOYMENTS:
+            raise ValidationError(
+                "At most %s deployments can be acted on at once." %
+                serializer.MAX_DEPLOYMENTS)
+        deployment_tasks, skipped = view_helpers.create_deployment_tasks(
+            deployments, serializer.validated_data['action'], request)
+        return Response({
+            'tasks': serializers.DeploymentActionTaskSerializer(
+                deployment_tasks, many=True).data,
+            'skipped': [deployment.id for deployment in skipped]},
+            status=status.HTTP_201_CREATED)
+
+    @action(detail=False, renderer_classes=(EventStreamRenderer,))
+    def events(self, request):
+        """
+        Stream task progress and completion events of the user's deployments.
+
+        Events are sent as server-sent events, named after the event type
+        (``progress`` or ``finished``). Use ``?deployment=<id>`` (repeatable)
+        to only follow some deployments.
+
+        The stream is closed after ``CLOUDLAUNCH_EVENTS_MAX_AGE`` seconds and
+        clients reconnect after the ``retry`` interval sent with it. On
+        reconnection, ``finished`` events stored since the ``Last-Event-ID``
+        are sent again; ``progress`` events are not. This endpoint needs an
+        asynchronous worker class, e.g. ``gunicorn -k gevent``, since every
+        open stream occupies a worker.
+        """
+        deployment_ids = {int(pk) for pk in
+                          request.query_params.getlist('deployment')
+                          if pk.isdigit()}
+        since = self._get_last_event_time(request)
+        start = timezone.now()
+        # Subscribe before looking up stored events so none are missed
+        subscription = events.Subscription(request.user.id)
+        if since:
+            missed = self._get_finished_events(request.user, since,
+                                               deployment_ids)
+            start_id = None
+        else:
+            # Let clients resume from now if they get no finished event
+            missed = []
+            start_id = start.isoformat()
+        response = StreamingHttpResponse(
+            self._stream_events(subscription, deployment_ids, missed,
+                                start_id),
+            content_type=EventStreamRenderer.media_type)
+        patch_cache_control(response, no_cache=True)
+        # Stop proxies such as nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def _get_last_event_time(self, request):
+        last_event_id = request.META.get('HTTP_LAST_EVENT_ID')
+        try:
+            return parse_datetime(last_event_id) if last_event_id else None
+        except ValueError:
+            return None
+
+    def _get_finished_events(self, user, since, deployment_ids):
+        finished_tasks = models.ApplicationDeploymentTask.objects.filter(
+            deployment__owner=user, _status__in=states.READY_STATES,
+            updated__gt=since).select_related('deployment').order_by(
+                'updated', 'id')
+        if deployment_ids:
+            finished_tasks = finished_tasks.filter(
+                deployment__in=deployment_ids)
+        return [events.get_finished_event(task) for task in finished_tasks]
+
+    def _format_event(self, event):
+        message = 'event: {0}\ndata: {1}\n\n'.format(
+            event['type'], json.dumps(event))
+        if event.get('id'):
+            message = 'id: {0}\n'.format(event['id']) + message
+        return message
+
+    def _stream_events(self, subscription, deployment_ids, missed,
+                       start_id=None):
+        deadline = time.monotonic() + events.get_max_age()
+        try:
+            preamble = 'retry: {0}\n'.format(events.RETRY_INTERVAL)
+            if start_id:
+                preamble += 'id: {0}\n'.format(start_id)
+            yield preamble + '\n'
+            for event in missed:
+                yield self._format_event(event)
+            while time.monotonic() < deadline:
+                event = next(subscription)
+                if event is None:
+                    yield ': keepalive\n\n'
+                elif (not deployment_ids or
+                        event['deployment'] in deployment_ids):
+                    yield self._format_event(event)
+        finally:
+            subscription.close()
+
+
+class DeploymentTaskViewSet(SparseFieldsQuerySetMixin, viewsets.ModelViewSet):
     """List tasks associated with a deployment."""
     permission_classes = (IsAuthenticated,)
     serializer_class = serializers.DeploymentTaskSerializer
     filter_backends = (filters.OrderingFilter,)
-    ordering = ('-updated',)
+    ordering = ('-updated', 'id')
+    pagination_class = OptionalCursorPagination
 
     def get_queryset(self):
         """
@@ -138,6 +669,39 @@ class DeploymentTaskViewSet(viewsets.ModelViewSet):
         return models.ApplicationDeploymentTask.objects.filter(
             deployment=deployment, deployment__owner=user)
 
+    def filter_queryset(self, queryset):
+        queryset = super(DeploymentTaskViewSet, self).filter_queryset(
+            queryset)
+        # The Celery task meta is only read by the result and status fields,
+        # which are the only users of the status column
+        if '_status' in self.get_serializer().get_unused_sources():
+            return queryset
+        return queryset.with_task_meta()
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super(DeploymentTaskViewSet, self).create(
+            request, *args, **kwargs)
+
+
+class ArchivedDeploymentViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    List deployments that have been moved to the archive.
+
+    Archived deployments are read only; their tasks are included in full.
+    """
+    permission_classes = (IsAuthenticated,)
+    serializer_class = serializers.ArchivedDeploymentSerializer
+    filter_backends = (filters.OrderingFilter,)
+    ordering = ('-added', 'id')
+    pagination_class = OptionalCursorPagination
+
+    def get_queryset(self):
+        return models.ArchivedDeployment.objects.filter(
+            owner=self.request.user).select_related(
+                'owner', 'application_version__application').prefetch_related(
+                    'tasks')
+
 
 class PublicKeyList(generics.ListCreateAPIView):
     """List public ssh keys associated with the user profile."""
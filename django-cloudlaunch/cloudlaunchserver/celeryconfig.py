@@ -5,3 +5,18 @@ result_serializer = 'json'
 task_serializer = 'json'
 accept_content = ['json']
 #accept_content = ['json', 'yaml']
+# Periodic tasks; the database scheduler picks these up on start
+beat_schedule = {
+    'migrate-task-results': {
+        'task': 'cloudlaunch.tasks.migrate_task_results',
+        'schedule': 60.0,
+    },
+    'purge-idempotency-keys': {
+        'task': 'cloudlaunch.tasks.purge_idempotency_keys',
+        'schedule': 3600.0,
+    },
+    'archive-deployments': {
+        'task': 'cloudlaunch.tasks.archive_deployments',
+        'schedule': 86400.0,
+    },
+}
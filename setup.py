@@ -43,7 +43,7 @@ readme = open('README.rst').read()
 history = open('HISTORY.rst').read().replace('.. :changelog:', '')
 
 REQS_BASE = [
-    'Django>=2.0',
+    'Django>=2.2',
     # ======== Celery =========
     'celery>=4.1',
     # celery results backend which uses the django DB
@@ -59,7 +59,7 @@ REQS_BASE = [
     # Provides nested routing for DRF
     'drf-nested-routers>=0.90.0',
     # For DRF filtering by querystring
-    'django-filter>=1.1.0',
+    'django-filter>=2.0',
     # Provides REST API schema
     'coreapi>=2.2.3',
     # ======== CloudBridge =========
@@ -93,7 +93,13 @@ REQS_BASE = [
 REQS_PROD = ([
     # postgres database driver
     'psycopg2',
-    'gunicorn'] + REQS_BASE
+    # Brotli compression of the catalog snapshot
+    'brotli',
+    # Pub/sub for the deployment event stream
+    'redis',
+    'gunicorn',
+    # Worker class serving the long-lived deployment event streams
+    'gevent'] + REQS_BASE
 )
 
 REQS_TEST = ([
@@ -139,7 +145,7 @@ setup(
     classifiers=[
         'Development Status :: 5 - Production/Stable',
         'Framework :: Django',
-        'Framework :: Django :: 2.0',
+        'Framework :: Django :: 2.2',
         'Intended Audience :: Developers',
         'License :: OSI Approved :: BSD License',
         'Natural Language :: English',